@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import time
+import threading
 import numpy as np
 import tensorflow as tf
 
@@ -8,9 +11,12 @@ from typing import \
     Dict, \
     Union, \
     NoReturn, \
-    List
+    List, \
+    Optional
 
 from rls.utils.np_utils import int2one_hot
+from rls.memories.prefetcher import Prefetcher
+from rls.memories.tf_dataset import make_replay_dataset
 
 
 def make_off_policy_class(mode: str = 'share'):
@@ -39,12 +45,58 @@ def make_off_policy_class(mode: str = 'share'):
             self.n_step = kwargs.get('n_step', False)
             self.use_isw = bool(kwargs.get('use_isw', False))
             self.train_times_per_step = int(kwargs.get('train_times_per_step', 1))
+            self.store_cell_state = self.use_rnn and bool(kwargs.get('store_cell_state', False))
+            self.prefetch_batches = int(kwargs.get('prefetch_batches', 0))
+            self._prefetcher = None
+            self.use_tf_data = bool(kwargs.get('use_tf_data', False))
+            self._dataset_iter = None
+            self._packed_obs = False
+            self._data_wait_time = 0.
+            self._buffer_lock = threading.Lock()    # guards the replay buffer against the prefetching thread
+            self._priority_updates = 0  # number of PER updates, used to measure how stale prefetched priorities are
+            self.snapshot_buffer = bool(kwargs.get('snapshot_buffer', False))
+            self.buffer_restored = False
 
         def set_buffer(self, buffer) -> NoReturn:
             '''
             TODO: Annotation
             '''
+            self._stop_prefetching()
             self.data = buffer
+            self._packed_obs = hasattr(buffer, 'packed_pairs')  # TrajectoryER samples observations packed with their next observations
+            if hasattr(buffer, 'lock'):     # share the lock of ThreadSafeWrapper, so that compound operations stay atomic
+                self._buffer_lock = buffer.lock
+
+        def init_or_restore(self, base_dir: Optional[str] = None) -> NoReturn:
+            self._stop_prefetching()    # batches prefetched before restoring are stale
+            super().init_or_restore(base_dir)
+            if self.snapshot_buffer and base_dir is None and getattr(self, 'data', None) is not None:
+                start = time.time()
+                with self._buffer_lock:
+                    self.buffer_restored = self.data.load(os.path.join(self.cp_dir, 'buffer'))
+                if self.buffer_restored:
+                    self.logger.info(f'restore replay buffer SUCCUESS, size: {self.data.size}, {time.time() - start:.2f}s.')
+
+        def _stop_prefetching(self) -> NoReturn:
+            '''
+            stop the prefetching thread and drop the tf.data iterator, both are created again by the next learn
+            '''
+            if self._prefetcher is not None:
+                self._prefetcher.close()
+                self._prefetcher = None
+            self._dataset_iter = None
+
+        def close(self) -> NoReturn:
+            self._stop_prefetching()
+            super().close()
+
+        def save_checkpoint(self, **kwargs) -> NoReturn:
+            super().save_checkpoint(**kwargs)
+            if self.snapshot_buffer and getattr(self, 'data', None) is not None:
+                start = time.time()
+                with self._buffer_lock:
+                    self.data.save(os.path.join(self.cp_dir, 'buffer'))
+                self.logger.info(f'Save replay buffer success, {time.time() - start:.2f}s.')
 
         def store_data(self,
                        s: Union[List, np.ndarray],
@@ -60,16 +112,18 @@ def make_off_policy_class(mode: str = 'share'):
             assert isinstance(a, np.ndarray), "store need action type is np.ndarray"
             assert isinstance(r, np.ndarray), "store need reward type is np.ndarray"
             assert isinstance(done, np.ndarray), "store need done type is np.ndarray"
-            self._running_average(s)
-            self.data.add(
-                s,
-                visual_s,
-                a,
-                r[:, np.newaxis],   # 升维
-                s_,
-                visual_s_,
-                done[:, np.newaxis]  # 升维
-            )
+            with self._buffer_lock:
+                self._running_average(s)
+                self.data.add(
+                    s,
+                    visual_s,
+                    a,
+                    r[:, np.newaxis],   # 升维
+                    s_,
+                    visual_s_,
+                    done[:, np.newaxis],  # 升维
+                    *self._cell_state_to_store()
+                )
 
         def no_op_store(self,
                         s: Union[List, np.ndarray],
@@ -82,36 +136,144 @@ def make_off_policy_class(mode: str = 'share'):
             assert isinstance(a, np.ndarray), "no_op_store need action type is np.ndarray"
             assert isinstance(r, np.ndarray), "no_op_store need reward type is np.ndarray"
             assert isinstance(done, np.ndarray), "no_op_store need done type is np.ndarray"
-            self._running_average(s)
-            self.data.add(
-                s,
-                visual_s,
-                a,
-                r[:, np.newaxis],
-                s_,
-                visual_s_,
-                done[:, np.newaxis]
-            )
+            with self._buffer_lock:
+                self._running_average(s)
+                self.data.add(
+                    s,
+                    visual_s,
+                    a,
+                    r[:, np.newaxis],
+                    s_,
+                    visual_s_,
+                    done[:, np.newaxis],
+                    *self._cell_state_to_store()
+                )
+
+        def _cell_state_to_store(self) -> List[np.ndarray]:
+            '''
+            cell states after choosing actions, which are the initial states of the next steps when training.
+            '''
+            if self.store_cell_state:
+                return [np.asarray(c) for c in self.cell_state]
+            return []
 
         def get_transitions(self,
                             data_name_list: List[str] = ['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done']) -> Dict:
             '''
             TODO: Annotation
             '''
-            data = self.data.sample()   # 经验池取数据
+            return self._process_transitions(self._sample_raw(), data_name_list)['data']
+
+        def _sample_raw(self) -> Dict:
+            '''
+            sample a batch together with everything tied to it, i.e. indexes and IS weights of PER, burn-in and cell states of RNN,
+            and statistics of vector observations at that moment, so that batches could also be prepared ahead of training.
+            '''
+            batch = {}
+            with self._buffer_lock:
+                if self._packed_obs and not self.use_tf_data:   # tf.data maps batches on the host, unpacking there saves nothing
+                    batch['data'] = tuple(self.data.sample(packed=True))
+                    batch['packed'] = self.data.packed_pairs
+                else:
+                    batch['data'] = tuple(self.data.sample())   # 经验池取数据
+                if self.use_priority:
+                    batch['index'] = self.data.last_indexs
+                    batch['isw'] = self.data.get_IS_w()
+                    batch['priority_updates'] = self._priority_updates
+                if self.use_rnn:
+                    batch['burn_in_states'] = tuple(self.data.get_burn_in_states())
+                    if self.store_cell_state:
+                        batch['cell_states'] = tuple(self.data.get_cell_states())
+                batch['obs_mean'] = np.asarray(self._running_average.mean(), dtype=np.float32)
+                batch['obs_std'] = np.asarray(self._running_average.std(), dtype=np.float32)
+            return batch
+
+        def _process_transitions(self, batch: Dict, data_name_list: List[str]) -> Dict:
+            '''
+            one-hot actions, normalize vector observations and convert them to tensors.
+            '''
+            batch = batch.copy()
+            data = list(batch.pop('data'))
+            mean, std = batch.pop('obs_mean'), batch.pop('obs_std')
+            for i, j, shape in batch.pop('packed', []):
+                data[i], data[j] = self._unpack_observations(data[i], shape)
             if not self.is_continuous and 'a' in data_name_list:
                 a_idx = data_name_list.index('a')
                 data[a_idx] = int2one_hot(data[a_idx].astype(np.int32), self.a_dim)
-            if 's' in data_name_list:
-                s_idx = data_name_list.index('s')
-                data[s_idx] = self.normalize_vector_obs(data[s_idx])
-            if 's_' in data_name_list:
-                s_idx = data_name_list.index('s_')
-                data[s_idx] = self.normalize_vector_obs(data[s_idx])
-
-            return dict([
+            if self._normalize_vector_obs:
+                for name in ['s', 's_']:
+                    if name in data_name_list:
+                        s_idx = data_name_list.index(name)
+                        data[s_idx] = (data[s_idx] - mean) / std
+
+            batch['data'] = dict([
                 [n, d] for n, d in zip(data_name_list, list(map(self.data_convert, data)))
             ])
+            return batch
+
+        def _unpack_observations(self, frames: np.ndarray, shape: tuple) -> List[tf.Tensor]:
+            '''
+            copy frames shared by observations and next observations to the device in their stored dtype, and split them there.
+            [B, stack+1, ..., C] => [B, *shape], [B, *shape]
+            '''
+            with tf.device(self.device):
+                x = tf.cast(tf.convert_to_tensor(frames), self._tf_data_type)
+                k = len(x.shape) - 2
+                x = tf.transpose(x, [0, *range(2, k + 1), 1, k + 1])    # [B, ..., stack+1, C]
+                return [tf.reshape(x[..., :-1, :], [-1, *shape]), tf.reshape(x[..., 1:, :], [-1, *shape])]
+
+        def _tf_process_transitions(self, batch: Dict, data_name_list: List[str]) -> Dict:
+            '''
+            the same as _process_transitions but with tensor ops, so that it runs inside the parallel map of tf.data,
+            and `ss`/`vvss` are concatenated there as well.
+            '''
+            batch = batch.copy()
+            data = dict(zip(data_name_list, batch.pop('data')))
+            mean, std = batch.pop('obs_mean'), batch.pop('obs_std')
+            if not self.is_continuous and 'a' in data:
+                data['a'] = tf.one_hot(tf.reshape(tf.cast(data['a'], tf.int32), [-1]), self.a_dim)
+            if self._normalize_vector_obs:
+                for name in ['s', 's_']:
+                    if name in data:
+                        data[name] = (tf.cast(data[name], tf.float32) - mean) / std
+            data = {k: tf.cast(v, self._tf_data_type) for k, v in data.items()}
+            if all(n in data for n in ['s', 'visual_s', 's_', 'visual_s_']):
+                data['ss'], data['vvss'] = self._concat_s_and_s_(data)
+            batch['data'] = data
+            return batch
+
+        def _concat_s_and_s_(self, data: Dict) -> List[tf.Tensor]:
+            if self.use_rnn:    # 如果使用RNN， 就将s和s‘状态进行拼接处理
+                return [tf.concat([    # [B, T, N], [B, T, N] => [B, T+1, N]
+                    data[s],
+                    data[s_][:, -1:]
+                ], axis=1) for s, s_ in [['s', 's_'], ['visual_s', 'visual_s_']]]
+            else:   # 如果不使用RNN， 就将s和s‘状态进行堆叠处理
+                return [tf.concat([data[s], data[s_]], axis=0)    # [B, N] => [2*B, N]
+                        for s, s_ in [['s', 's_'], ['visual_s', 'visual_s_']]]
+
+        def _next_batch(self, data_name_list: List[str]) -> Dict:
+            '''
+            get the next batch from tf.data if use_tf_data, or from the prefetcher if prefetch_batches > 0, otherwise sample it right now.
+            '''
+            if self.use_tf_data:
+                if self._dataset_iter is None:
+                    self._dataset_iter = iter(make_replay_dataset(
+                        self._sample_raw,
+                        map_func=lambda batch: self._tf_process_transitions(batch, data_name_list),
+                        prefetch=self.prefetch_batches if self.prefetch_batches > 0 else tf.data.AUTOTUNE))
+                start = time.perf_counter()
+                batch = next(self._dataset_iter)
+                self._data_wait_time = time.perf_counter() - start
+                return {k: v if k == 'data' else tf.nest.map_structure(lambda x: x.numpy(), v) for k, v in batch.items()}
+            elif self.prefetch_batches > 0:
+                if self._prefetcher is None:
+                    self._prefetcher = Prefetcher(lambda: self._process_transitions(self._sample_raw(), data_name_list), self.prefetch_batches)
+                batch = self._prefetcher.get()
+                self._data_wait_time = self._prefetcher.last_wait_time
+                return batch
+            else:
+                return self._process_transitions(self._sample_raw(), data_name_list)
 
         def get_value_from_dict(self, data_name_list: List[str], data_dict: Dict) -> List:
             '''
@@ -128,7 +290,9 @@ def make_off_policy_class(mode: str = 'share'):
             _update = function_dict.get('update_function', lambda *args: None)  # maybe need update parameters of target networks
             _summary = function_dict.get('summary_dict', {})    # 记录输出到tensorboard的词典
             _sample_data_list = function_dict.get('sample_data_list', ['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done'])  # 需要从经验池提取的经验
-            _train_data_list = function_dict.get('train_data_list', ['ss', 'vvss', 'a', 'r', 'done'])  # 需要从经验池提取的经验
+            _train_data_list = function_dict.get('train_data_list', ['ss', 'vvss', 'a', 'r', 'done', 'discount'])  # 需要从经验池提取的经验
+            if self.n_step and not self.use_rnn:    # n-step buffers append the true discount gamma**k of every transition, rnn policies use EpisodeER
+                _sample_data_list = _sample_data_list + ['discount']
 
             if self.data.is_lg_batch_size:
                 # -----------初始化某些变量---------------
@@ -136,23 +300,15 @@ def make_off_policy_class(mode: str = 'share'):
                 # --------------------------------------
 
                 # --------------------------------------从经验池中获取数据
-                data = self.get_transitions(data_name_list=_sample_data_list)  # default: s, visual_s, a, r, s_, visual_s_, done
+                batch = self._next_batch(data_name_list=_sample_data_list)
+                data = batch['data']  # default: s, visual_s, a, r, s_, visual_s_, done
                 # --------------------------------------
 
-                # --------------------------------------如果使用RNN， 就将s和s‘状态进行拼接处理
-                if self.use_rnn:
-                    data['ss'] = tf.concat([    # [B, T, N], [B, T, N] => [B, T+1, N]
-                        data['s'],
-                        data['s_'][:, -1:]
-                    ], axis=1)
-                    data['vvss'] = tf.concat([
-                        data['visual_s'],
-                        data['visual_s_'][:, -1:]
-                    ], axis=1)
-                # --------------------------------------如果不使用RNN， 就将s和s‘状态进行堆叠处理
-                else:
-                    data['ss'] = tf.concat([data['s'], data['s_']], axis=0)  # [B, N] => [2*B, N]
-                    data['vvss'] = tf.concat([data['visual_s'], data['visual_s_']], axis=0)
+                # --------------------------------------将s和s‘状态进行拼接或堆叠处理，tf.data已经在map中完成
+                if 'ss' not in data:
+                    data['ss'], data['vvss'] = self._concat_s_and_s_(data)
+                if 'discount' not in data:  # 1-step transitions are all discounted by gamma
+                    data['discount'] = tf.constant(value=self.gamma, dtype=self._tf_data_type)
                 # --------------------------------------
 
                 # --------------------------------------预处理过程
@@ -177,7 +333,7 @@ def make_off_policy_class(mode: str = 'share'):
 
                 # --------------------------------------优先经验回放部分，获取重要性比例
                 if self.use_priority and self.use_isw:
-                    _isw = self.data.get_IS_w().reshape(-1, 1)  # [B, ] => [B, 1]
+                    _isw = batch['isw'].reshape(-1, 1)  # [B, ] => [B, 1]
                     _isw = self.data_convert(_isw)
                 else:
                     _isw = tf.constant(value=1., dtype=self._tf_data_type)
@@ -189,9 +345,12 @@ def make_off_policy_class(mode: str = 'share'):
 
                 # --------------------------------------burn in隐状态部分
                 if self.use_rnn:
-                    cell_state = self.initial_cell_state()
+                    if self.store_cell_state:
+                        cell_state = tuple(map(tf.convert_to_tensor, batch['cell_states']))
+                    else:
+                        cell_state = self.initial_cell_state()
                     if self.burn_in_time_step > 0:
-                        _s, _visual_s = self.data.get_burn_in_states()
+                        _s, _visual_s = batch['burn_in_states']
                         cell_state = self.get_burn_in_feature(_s, _visual_s, cell_state)
                 else:
                     cell_state = (None,)
@@ -208,7 +367,9 @@ def make_off_policy_class(mode: str = 'share'):
                 # --------------------------------------优先经验回放的更新部分
                 if self.use_priority:
                     td_error = np.squeeze(td_error.numpy())
-                    self.data.update(td_error, self.train_step)
+                    with self._buffer_lock:     # applied in the order of batches
+                        self.data.update(td_error, self.train_step, index=batch['index'])
+                        self._priority_updates += 1
                 # --------------------------------------
 
                 # --------------------------------------target网络的更新部分
@@ -217,6 +378,12 @@ def make_off_policy_class(mode: str = 'share'):
 
                 # --------------------------------------更新summary
                 self.summaries.update(_summary)
+                if self._prefetcher is not None:
+                    self.summaries['PREFETCH/queue_depth'] = self._prefetcher.depth
+                if self._prefetcher is not None or self._dataset_iter is not None:
+                    self.summaries['PREFETCH/wait_time_ms'] = self._data_wait_time * 1e3
+                    if self.use_priority:   # PER updates that happened between sampling and training of this batch
+                        self.summaries['PREFETCH/priority_staleness'] = self._priority_updates - 1 - batch['priority_updates']
                 # --------------------------------------
 
                 # --------------------------------------写summary到tensorboard
@@ -73,6 +73,7 @@ def make_on_policy_class(mode: str = 'share'):
             '''
             _cal_stics = function_dict.get('calculate_statistics', lambda *args: None)
             _train = function_dict.get('train_function', lambda *args: None)    # 训练过程
+            _train_epochs = function_dict.get('train_epochs_function', None)    # 整个rollout只转换一次, 多个epoch的乱序minibatch在一个tf.function内完成
             _train_data_list = function_dict.get('train_data_list', ['s', 'visual_s', 'a', 'discounted_reward', 'log_prob', 'gae_adv'])
             _summary = function_dict.get('summary_dict', {})    # 记录输出到tensorboard的词典
 
@@ -93,21 +94,25 @@ def make_on_policy_class(mode: str = 'share'):
 
             _cal_stics()
 
-            if self.use_rnn:
-                all_data = self.data.sample_generater_rnn(self.rnn_time_step, _train_data_list)
+            if _train_epochs is not None and not self.use_rnn:
+                data = list(map(self.data_convert, self.data.get_flatten_data(_train_data_list)))
+                summaries = _train_epochs(data, crsty_loss, (None,))
             else:
-                all_data = self.data.sample_generater(self.batch_size, _train_data_list)
-
-            for data in all_data:
-                data = list(map(self.data_convert, data))
                 if self.use_rnn:
-                    cell_state = self.initial_cell_state(batch=self.n_agents)
-                    # if self.burn_in_time_step:
-                    #     pass
+                    all_data = self.data.sample_generater_rnn(self.rnn_time_step, _train_data_list)
                 else:
-                    cell_state = (None,)
+                    all_data = self.data.sample_generater(self.batch_size, _train_data_list)
+
+                for data in all_data:
+                    data = list(map(self.data_convert, data))
+                    if self.use_rnn:
+                        cell_state = self.initial_cell_state(batch=self.n_agents)
+                        # if self.burn_in_time_step:
+                        #     pass
+                    else:
+                        cell_state = (None,)
 
-                summaries = _train(data, crsty_loss, cell_state)
+                    summaries = _train(data, crsty_loss, cell_state)
 
             self.summaries.update(summaries)
             self.summaries.update(_summary)
@@ -116,4 +121,20 @@ def make_on_policy_class(mode: str = 'share'):
 
             self.clear()
 
+        def shuffle_minibatches(self, data: List[tf.Tensor]):
+            '''
+            shuffle the rollout for one epoch, use it inside tf.function.
+            return:
+                idxs: permutation of all rows
+                batches: number of minibatches of `batch_size` rows, the last one may be smaller
+            '''
+            rows = tf.shape(data[0])[0]
+            idxs = tf.random.shuffle(tf.range(rows))
+            batches = (rows + self.batch_size - 1) // self.batch_size
+            return idxs, batches
+
+        def get_minibatch(self, data: List[tf.Tensor], idxs: tf.Tensor, i: tf.Tensor) -> List[tf.Tensor]:
+            idxs = idxs[i * self.batch_size:(i + 1) * self.batch_size]
+            return [tf.gather(x, idxs) for x in data]
+
     return On_Policy
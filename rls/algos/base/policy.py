@@ -24,6 +24,8 @@ from rls.utils.vector_runing_average import \
 
 
 class Policy(Base):
+    keeps_env_states = False    # True if choose_action keeps a state for every env, i.e. options of OC, so it can not act on a subset of envs
+
     def __init__(self,
                  s_dim: Union[int, np.ndarray],
                  visual_sources: Union[int, np.ndarray],
@@ -206,13 +206,14 @@ class SharedPolicy(Policy):
             _, cell_state = self.rnn_net(s, *cell_state)
             return cell_state
 
-    def _cnn_rnn_get_burn_in_feature(self, s, visual_s) -> Tuple[tf.Tensor]:
+    def _cnn_rnn_get_burn_in_feature(self, s, visual_s,
+                                     cell_state: Tuple[Optional[tf.Tensor]]) -> Tuple[tf.Tensor]:
         s, visual_s = self._tf_data_cast(s, visual_s)    # [B, T, N]
         batch_size = tf.shape(s)[0]
         with tf.device(self.device):
             s = tf.reshape(s, [-1, tf.shape(s)[-1]])    # [B*T, N]
-            visual_s = tf.reshape(visual_s, [-1, tf.shape(visual_s)[-1]])   # [B*T, N]
+            visual_s = tf.reshape(visual_s, [-1, *tf.shape(visual_s)[2:]])   # [B*T, ...]
             feature = self.visual_net(s, visual_s)  # [B*T, N]
             feature = tf.reshape(feature, [batch_size, -1, tf.shape(feature)[-1]])  # [B*T, N] => [B, T, N]
-            _, cell_state = self.rnn_net(feature)
+            _, cell_state = self.rnn_net(feature, *cell_state)
             return cell_state
@@ -21,6 +21,8 @@ class IOC(make_off_policy_class(mode='share')):
     Options of Interest: Temporal Abstraction with Interest Functions, http://arxiv.org/abs/2001.00271
     '''
 
+    keeps_env_states = True    # options and last_options of every env
+
     def __init__(self,
                  s_dim,
                  visual_sources,
@@ -54,6 +56,7 @@ class IOC(make_off_policy_class(mode='share')):
             a_dim=a_dim,
             is_continuous=is_continuous,
             **kwargs)
+        assert not self.store_cell_state, 'fields after done are options, they cannot be stored together with cell states'
         self.assign_interval = assign_interval
         self.options_num = options_num
         self.termination_regularizer = termination_regularizer
@@ -153,7 +156,7 @@ class IOC(make_off_policy_class(mode='share')):
                 'train_function': self.train,
                 'update_function': _update,
                 'sample_data_list': ['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done', 'last_options', 'options'],
-                'train_data_list': ['ss', 'vvss', 'a', 'r', 'done', 'last_options', 'options'],
+                'train_data_list': ['ss', 'vvss', 'a', 'r', 'done', 'last_options', 'options', 'discount'],
                 'summary_dict': dict([
                     ['LEARNING_RATE/q_lr', self.q_lr(self.train_step)],
                     ['LEARNING_RATE/intra_option_lr', self.intra_option_lr(self.train_step)],
@@ -164,7 +167,7 @@ class IOC(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done, last_options, options = memories
+        ss, vvss, a, r, done, last_options, options, discount = memories
         last_options = tf.cast(last_options, tf.int32)
         options = tf.cast(options, tf.int32)
         with tf.device(self.device):
@@ -188,7 +191,7 @@ class IOC(make_off_policy_class(mode='share')):
                 else:
                     q_s_max = tf.reduce_max(q_next, axis=-1, keepdims=True)   # [B, 1]
                 u_target = (1 - beta_s_) * q_s_ + beta_s_ * q_s_max   # [B, 1]
-                qu_target = tf.stop_gradient(r + self.gamma * (1 - done) * u_target)
+                qu_target = tf.stop_gradient(r + discount * (1 - done) * u_target)
                 td_error = qu_target - qu_eval     # gradient : q
                 q_loss = tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss        # [B, 1] => 1
 
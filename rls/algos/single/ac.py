@@ -120,12 +120,12 @@ class AC(make_off_policy_class(mode='share')):
                     ['LEARNING_RATE/critic_lr', self.critic_lr(self.train_step)]
                 ]),
                 'sample_data_list': ['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done', 'old_log_prob'],
-                'train_data_list': ['ss', 'vvss', 'a', 'r', 'done', 'old_log_prob']
+                'train_data_list': ['ss', 'vvss', 'a', 'r', 'done', 'old_log_prob', 'discount']
             })
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done, old_log_prob = memories
+        ss, vvss, a, r, done, old_log_prob, discount = memories
         with tf.device(self.device):
             with tf.GradientTape() as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
@@ -138,7 +138,7 @@ class AC(make_off_policy_class(mode='share')):
                     max_a_one_hot = tf.one_hot(max_a, self.a_dim, dtype=tf.float32)
                     max_q_next = tf.stop_gradient(self.critic_net(feat_, max_a_one_hot))
                 q = self.critic_net(feat, a)
-                td_error = q - (r + self.gamma * (1 - done) * max_q_next)
+                td_error = q - (r + discount * (1 - done) * max_q_next)
                 critic_loss = tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
             critic_grads = tape.gradient(critic_loss, self.critic_tv)
             self.optimizer_critic.apply_gradients(
@@ -175,7 +175,7 @@ class AC(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done, old_log_prob = memories
+        ss, vvss, a, r, done, old_log_prob, discount = memories
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
@@ -197,7 +197,7 @@ class AC(make_off_policy_class(mode='share')):
                 q = self.critic_net(feat, a)
                 ratio = tf.stop_gradient(tf.exp(log_prob - old_log_prob))
                 q_value = tf.stop_gradient(q)
-                td_error = q - (r + self.gamma * (1 - done) * max_q_next)
+                td_error = q - (r + discount * (1 - done) * max_q_next)
                 critic_loss = tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
                 actor_loss = -tf.reduce_mean(ratio * log_prob * q_value)
             critic_grads = tape.gradient(critic_loss, self.critic_tv)
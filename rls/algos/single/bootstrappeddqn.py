@@ -86,7 +86,7 @@ class BootstrappedDQN(make_off_policy_class(mode='share')):
 
     def choose_action(self, s, visual_s, evaluation=False):
         if np.random.uniform() < self.expl_expt_mng.get_esp(self.train_step, evaluation=evaluation):
-            a = np.random.randint(0, self.a_dim, self.n_agents)
+            a = np.random.randint(0, self.a_dim, s.shape[0])
         else:
             q, self.cell_state = self._get_action(s, visual_s, self.cell_state)
             q = q.numpy()
@@ -115,7 +115,7 @@ class BootstrappedDQN(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -123,7 +123,7 @@ class BootstrappedDQN(make_off_policy_class(mode='share')):
                 q = self.q_net(feat)    # [H, B, A]
                 q_next = self.q_target_net(feat_)   # [H, B, A]
                 q_eval = tf.reduce_sum(tf.multiply(q, a), axis=-1, keepdims=True)    # [H, B, A] * [B, A] => [H, B, 1]
-                q_target = tf.stop_gradient(r + self.gamma * (1 - done) * tf.reduce_max(q_next, axis=-1, keepdims=True))
+                q_target = tf.stop_gradient(r + discount * (1 - done) * tf.reduce_max(q_next, axis=-1, keepdims=True))
                 td_error = q_eval - q_target    # [H, B, 1]
                 td_error = tf.reduce_sum(td_error, axis=-1)  # [H, B]
 
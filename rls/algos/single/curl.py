@@ -244,7 +244,7 @@ class CURL(make_off_policy_class(mode='no_share')):
                     ['LEARNING_RATE/critic_lr', self.critic_lr(self.train_step)],
                     ['LEARNING_RATE/alpha_lr', self.alpha_lr(self.train_step)]
                 ]),
-                'train_data_list': ['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done', 'pos'],
+                'train_data_list': ['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done', 'pos', 'discount'],
                 'pre_process_function': _pre_process
             })
 
@@ -254,7 +254,7 @@ class CURL(make_off_policy_class(mode='no_share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        s, visual_s, a, r, s_, visual_s_, done, pos = memories
+        s, visual_s, a, r, s_, visual_s_, done, pos, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
@@ -276,8 +276,8 @@ class CURL(make_off_policy_class(mode='no_share')):
                     target_pi = tf.one_hot(target_pi, self.a_dim, dtype=tf.float32)
                 q1, q2 = self.critic_net(feat, a)
                 q1_target, q2_target = self.critic_target_net(feat_, target_pi)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * (q1_target - self.alpha * target_log_pi))
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * (q2_target - self.alpha * target_log_pi))
+                dc_r_q1 = tf.stop_gradient(r + discount * (1 - done) * (q1_target - self.alpha * target_log_pi))
+                dc_r_q2 = tf.stop_gradient(r + discount * (1 - done) * (q2_target - self.alpha * target_log_pi))
                 td_error1 = q1 - dc_r_q1
                 td_error2 = q2 - dc_r_q2
                 q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
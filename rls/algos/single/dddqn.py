@@ -81,7 +81,7 @@ class DDDQN(make_off_policy_class(mode='share')):
 
     def choose_action(self, s, visual_s, evaluation=False):
         if np.random.uniform() < self.expl_expt_mng.get_esp(self.train_step, evaluation=evaluation):
-            a = np.random.randint(0, self.a_dim, self.n_agents)
+            a = np.random.randint(0, self.a_dim, s.shape[0])
         else:
             a, self.cell_state = self._get_action(s, visual_s, self.cell_state)
             a = a.numpy()
@@ -109,7 +109,7 @@ class DDDQN(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         with tf.device(self.device):
             with tf.GradientTape() as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
@@ -124,7 +124,7 @@ class DDDQN(make_off_policy_class(mode='share')):
                 q_target_next_max = tf.reduce_sum(
                     tf.multiply(q_target, next_max_action_one_hot),
                     axis=1, keepdims=True)
-                q_target = tf.stop_gradient(r + self.gamma * (1 - done) * q_target_next_max)
+                q_target = tf.stop_gradient(r + discount * (1 - done) * q_target_next_max)
                 td_error = q_eval - q_target
                 q_loss = tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
             grads = tape.gradient(q_loss, self.critic_tv)
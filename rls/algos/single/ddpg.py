@@ -127,7 +127,7 @@ class DDPG(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -145,7 +145,7 @@ class DDPG(make_off_policy_class(mode='share')):
                     action_target = _pi_diff + _pi
                 q = self.q_net(feat, a)
                 q_target = self.q_target_net(feat_, action_target)
-                dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                 td_error = q - dc_r
                 q_loss = 0.5 * tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
             q_grads = tape.gradient(q_loss, self.critic_tv)
@@ -178,7 +178,7 @@ class DDPG(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
@@ -202,7 +202,7 @@ class DDPG(make_off_policy_class(mode='share')):
                     mu = _pi_diff + _pi
                 q = self.q_net(feat, a)
                 q_target = self.q_target_net(feat_, action_target)
-                dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                 td_error = q - dc_r
                 q_loss = 0.5 * tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
 
@@ -110,7 +110,7 @@ class DPG(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -127,7 +127,7 @@ class DPG(make_off_policy_class(mode='share')):
                     _pi_diff = tf.stop_gradient(_pi_true_one_hot - _pi)
                     action_target = _pi_diff + _pi
                 q_target = self.q_net(feat_, action_target)
-                dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                 q = self.q_net(feat, a)
                 td_error = q - dc_r
                 q_loss = 0.5 * tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
@@ -161,7 +161,7 @@ class DPG(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
@@ -184,7 +184,7 @@ class DPG(make_off_policy_class(mode='share')):
                     _pi_diff = tf.stop_gradient(_pi_true_one_hot - _pi)
                     mu = _pi_diff + _pi
                 q_target = self.q_net(feat_, action_target)
-                dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                 q = self.q_net(feat, a)
                 td_error = q - dc_r
                 q_loss = 0.5 * tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
@@ -86,7 +86,7 @@ class DQN(make_off_policy_class(mode='share')):
                       visual_s: np.ndarray,
                       evaluation: bool = False) -> np.ndarray:
         if np.random.uniform() < self.expl_expt_mng.get_esp(self.train_step, evaluation=evaluation):
-            a = np.random.randint(0, self.a_dim, self.n_agents)
+            a = np.random.randint(0, self.a_dim, s.shape[0])
         else:
             a, self.cell_state = self._get_action(s, visual_s, self.cell_state)
             a = a.numpy()
@@ -114,14 +114,14 @@ class DQN(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         with tf.device(self.device):
             with tf.GradientTape() as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
                 q = self.q_net(feat)
                 q_next = self.q_target_net(feat_)
                 q_eval = tf.reduce_sum(tf.multiply(q, a), axis=1, keepdims=True)
-                q_target = tf.stop_gradient(r + self.gamma * (1 - done) * tf.reduce_max(q_next, axis=1, keepdims=True))
+                q_target = tf.stop_gradient(r + discount * (1 - done) * tf.reduce_max(q_next, axis=1, keepdims=True))
                 td_error = q_eval - q_target
                 q_loss = tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
             grads = tape.gradient(q_loss, self.critic_tv)
@@ -90,7 +90,7 @@ class MAXSQN(make_off_policy_class(mode='share')):
 
     def choose_action(self, s, visual_s, evaluation=False):
         if self.use_epsilon and np.random.uniform() < self.expl_expt_mng.get_esp(self.train_step, evaluation=evaluation):
-            a = np.random.randint(0, self.a_dim, self.n_agents)
+            a = np.random.randint(0, self.a_dim, s.shape[0])
         else:
             mu, pi, self.cell_state = self._get_action(s, visual_s, self.cell_state)
             a = pi.numpy()
@@ -120,7 +120,7 @@ class MAXSQN(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         with tf.device(self.device):
             with tf.GradientTape() as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
@@ -138,7 +138,7 @@ class MAXSQN(make_off_policy_class(mode='share')):
                 # q2_target_log_max = tf.reduce_max(q2_target_log_probs, axis=1, keepdims=True)
 
                 q_target = tf.minimum(q1_target_max, q2_target_max) + self.alpha * q1_target_entropy
-                dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                 td_error1 = q1_eval - dc_r
                 td_error2 = q2_eval - dc_r
                 q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
@@ -138,12 +138,12 @@ class PD_DDPG(make_off_policy_class(mode='share')):
                     ['LEARNING_RATE/cost_critic_lr', self.cost_critic_lr(self.train_step)]
                 ]),
                 'sample_data_list': ['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done', 'cost'],
-                'train_data_list': ['ss', 'vvss', 'a', 'r', 'done', 'cost'],
+                'train_data_list': ['ss', 'vvss', 'a', 'r', 'done', 'cost', 'discount'],
             })
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done, cost = memories
+        ss, vvss, a, r, done, cost, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -161,7 +161,7 @@ class PD_DDPG(make_off_policy_class(mode='share')):
                     action_target = _pi_diff + _pi
                 q_reward = self.reward_critic_net(feat, a)
                 q_target = self.reward_critic_target_net(feat_, action_target)
-                dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                 td_error_reward = q_reward - dc_r
                 reward_loss = 0.5 * tf.reduce_mean(tf.square(td_error_reward) * isw) + crsty_loss
             q_grads = tape.gradient(reward_loss, self.reward_critic_tv)
@@ -172,7 +172,7 @@ class PD_DDPG(make_off_policy_class(mode='share')):
             with tf.GradientTape() as tape:
                 q_cost = self.cost_critic_net(feat, a)
                 q_target = self.cost_critic_target_net(feat_, action_target)
-                dc_r = tf.stop_gradient(cost + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(cost + discount * q_target * (1 - done))
                 td_error_cost = q_cost - dc_r
                 cost_loss = 0.5 * tf.reduce_mean(tf.square(td_error_cost) * isw) + crsty_loss
             q_grads = tape.gradient(cost_loss, self.cost_critic_net.trainable_variables)
@@ -222,7 +222,7 @@ class PD_DDPG(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, cost, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
@@ -246,13 +246,13 @@ class PD_DDPG(make_off_policy_class(mode='share')):
                     mu = _pi_diff + _pi
                 q_reward = self.reward_critic_net(feat, a)
                 q_target = self.reward_critic_target_net(feat_, action_target)
-                dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                 td_error_reward = q_reward - dc_r
                 reward_loss = 0.5 * tf.reduce_mean(tf.square(td_error_reward) * isw) + crsty_loss
 
                 q_cost = self.cost_critic_net(tf.stop_gradient(feat), a)
                 q_target = self.cost_critic_target_net(feat_, action_target)
-                dc_r = tf.stop_gradient(cost + self.gamma * q_target * (1 - done))
+                dc_r = tf.stop_gradient(cost + discount * q_target * (1 - done))
                 td_error_cost = q_cost - dc_r
                 cost_loss = 0.5 * tf.reduce_mean(tf.square(td_error_cost) * isw) + crsty_loss
 
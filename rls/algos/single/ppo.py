@@ -264,6 +264,29 @@ class PPO(make_on_policy_class(mode='share')):
             ])
             return summaries
 
+        def _train_epochs(data, crsty_loss, cell_state):
+            actor_loss, critic_loss, entropy, kl, early_step = self.train_epochs(
+                data,
+                self.kl_coef,
+                crsty_loss,
+                cell_state
+            )
+
+            if kl > self.kl_high:
+                self.kl_coef *= self.kl_alpha
+            elif kl < self.kl_low:
+                self.kl_coef /= self.kl_alpha
+
+            summaries = dict([
+                ['LOSS/actor_loss', actor_loss],
+                ['LOSS/critic_loss', critic_loss],
+                ['Statistics/kl', kl],
+                ['Statistics/kl_coef', self.kl_coef],
+                ['Statistics/early_step', early_step],
+                ['Statistics/entropy', entropy]
+            ])
+            return summaries
+
         if self.share_net:
             summary_dict = dict([['LEARNING_RATE/lr', self.lr(self.train_step)]])
         else:
@@ -275,10 +298,53 @@ class PPO(make_on_policy_class(mode='share')):
         self._learn(function_dict={
             'calculate_statistics': self.calculate_statistics,
             'train_function': _train,
+            'train_epochs_function': _train_epochs,
             'train_data_list': ['s', 'visual_s', 'a', 'discounted_reward', 'log_prob', 'gae_adv', 'value'],
             'summary_dict': summary_dict
         })
 
+    @tf.function(experimental_relax_shapes=True)
+    def train_epochs(self, memories, kl_coef, crsty_loss, cell_state):
+        '''
+        `policy_epoch` epochs over the whole rollout, reshuffled into minibatches every epoch, stop all remaining epochs
+        once the kl of a minibatch exceeds `kl_stop`. without a shared net, the critic is then trained for `value_epoch` epochs.
+        '''
+        s, visual_s, a, dc_r, old_log_prob, advantage, old_value = memories
+        actor_loss = critic_loss = entropy = kl = tf.zeros((), dtype=self._tf_data_type)
+        early_step = tf.constant(0)
+        for i in tf.range(self.policy_epoch):
+            idxs, batches = self.shuffle_minibatches(memories)
+            for j in tf.range(batches):
+                if self.share_net:
+                    actor_loss, critic_loss, entropy, kl = self.train_share(
+                        self.get_minibatch(memories, idxs, j),
+                        kl_coef,
+                        crsty_loss,
+                        cell_state
+                    )
+                else:
+                    actor_loss, entropy, kl = self.train_actor(
+                        self.get_minibatch((s, visual_s, a, old_log_prob, advantage), idxs, j),
+                        kl_coef,
+                        cell_state
+                    )
+                if kl > self.kl_stop:
+                    break
+            if kl > self.kl_stop:
+                early_step = i
+                break
+
+        if not self.share_net:
+            for _ in tf.range(self.value_epoch):
+                idxs, batches = self.shuffle_minibatches(memories)
+                for j in tf.range(batches):
+                    critic_loss = self.train_critic(
+                        self.get_minibatch((s, visual_s, dc_r, old_value), idxs, j),
+                        crsty_loss,
+                        cell_state
+                    )
+        return actor_loss, critic_loss, entropy, kl, early_step
+
     @tf.function(experimental_relax_shapes=True)
     def train_share(self, memories, kl_coef, crsty_loss, cell_state):
         s, visual_s, a, dc_r, old_log_prob, advantage, old_value = memories
@@ -15,6 +15,8 @@ class QS:
     Q-learning/Sarsa/Expected Sarsa.
     '''
 
+    keeps_env_states = True    # next actions of sarsa, and random actions drawn for every env
+
     def __init__(self,
                  s_dim,
                  visual_sources,
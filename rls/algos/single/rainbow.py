@@ -93,7 +93,7 @@ class RAINBOW(make_off_policy_class(mode='share')):
 
     def choose_action(self, s, visual_s, evaluation=False):
         if np.random.uniform() < self.expl_expt_mng.get_esp(self.train_step, evaluation=evaluation):
-            a = np.random.randint(0, self.a_dim, self.n_agents)
+            a = np.random.randint(0, self.a_dim, s.shape[0])
         else:
             a, self.cell_state = self._get_action(s, visual_s, self.cell_state)
             a = a.numpy()
@@ -121,7 +121,7 @@ class RAINBOW(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -135,7 +135,7 @@ class RAINBOW(make_off_policy_class(mode='share')):
                 target_q_dist = self.rainbow_target_net(feat_)  # [B, A, N]
                 target_q_dist = tf.gather_nd(target_q_dist, tf.concat([indexs, a_], axis=-1))   # [B, N]
                 target = tf.tile(r, tf.constant([1, self.atoms])) \
-                    + self.gamma * tf.multiply(self.z,   # [1, N]
+                    + discount * tf.multiply(self.z,   # [1, N]
                                                (1.0 - tf.tile(done, tf.constant([1, self.atoms]))))  # [B, N], [1, N]* [B, N] = [B, N]
                 target = tf.clip_by_value(target, self.v_min, self.v_max)  # [B, N]
                 b = (target - self.v_min) / self.delta_z  # [B, N]
@@ -172,7 +172,7 @@ class SAC(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -189,8 +189,8 @@ class SAC(make_off_policy_class(mode='share')):
                     target_pi = tf.one_hot(target_pi, self.a_dim, dtype=tf.float32)
                 q1, q2 = self.critic_net(feat, a)
                 q1_target, q2_target = self.critic_target_net(feat_, target_pi)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * (q1_target - self.alpha * target_log_pi))
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * (q2_target - self.alpha * target_log_pi))
+                dc_r_q1 = tf.stop_gradient(r + discount * (1 - done) * (q1_target - self.alpha * target_log_pi))
+                dc_r_q2 = tf.stop_gradient(r + discount * (1 - done) * (q2_target - self.alpha * target_log_pi))
                 td_error1 = q1 - dc_r_q1
                 td_error2 = q2 - dc_r_q2
                 q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
@@ -263,7 +263,7 @@ class SAC(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
@@ -295,8 +295,8 @@ class SAC(make_off_policy_class(mode='share')):
                 q1, q2 = self.critic_net(feat, a)
                 q1_target, q2_target = self.critic_target_net(feat_, target_pi)
                 q_s_pi = self.critic_net.get_min(feat, pi)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * (q1_target - self.alpha * target_log_pi))
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * (q2_target - self.alpha * target_log_pi))
+                dc_r_q1 = tf.stop_gradient(r + discount * (1 - done) * (q1_target - self.alpha * target_log_pi))
+                dc_r_q2 = tf.stop_gradient(r + discount * (1 - done) * (q2_target - self.alpha * target_log_pi))
                 td_error1 = q1 - dc_r_q1
                 td_error2 = q2 - dc_r_q2
                 q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
@@ -339,7 +339,7 @@ class SAC(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_discrete(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         with tf.device(self.device):
             with tf.GradientTape() as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
@@ -353,8 +353,8 @@ class SAC(make_off_policy_class(mode='share')):
                 def v_target_function(x): return tf.reduce_sum(tf.exp(target_log_probs) * (x - self.alpha * target_log_probs), axis=-1, keepdims=True)  # [B, 1]
                 v1_target = v_target_function(q1_target)
                 v2_target = v_target_function(q2_target)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * v1_target)
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * v2_target)
+                dc_r_q1 = tf.stop_gradient(r + discount * (1 - done) * v1_target)
+                dc_r_q2 = tf.stop_gradient(r + discount * (1 - done) * v2_target)
                 td_error1 = q1 - dc_r_q1
                 td_error2 = q2 - dc_r_q2
                 q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
@@ -177,7 +177,7 @@ class SAC_V(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -196,7 +196,7 @@ class SAC_V(make_off_policy_class(mode='share')):
                 q_pi = self.q_net.get_min(feat, pi)
                 v = self.v_net(feat)
                 v_target = self.v_target_net(feat_)
-                dc_r = tf.stop_gradient(r + self.gamma * v_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * v_target * (1 - done))
                 v_from_q_stop = tf.stop_gradient(q_pi - self.alpha * log_pi)
                 td_v = v - v_from_q_stop
                 td_error1 = q1 - dc_r
@@ -271,7 +271,7 @@ class SAC_V(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
@@ -295,7 +295,7 @@ class SAC_V(make_off_policy_class(mode='share')):
                 v = self.v_net(feat)
                 q1_pi, q2_pi = self.q_net(feat, pi)
                 v_target = self.v_target_net(feat_)
-                dc_r = tf.stop_gradient(r + self.gamma * v_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * v_target * (1 - done))
                 v_from_q_stop = tf.stop_gradient(tf.minimum(q1_pi, q2_pi) - self.alpha * log_pi)
                 td_v = v - v_from_q_stop
                 td_error1 = q1 - dc_r
@@ -343,7 +343,7 @@ class SAC_V(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_discrete(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         with tf.device(self.device):
             with tf.GradientTape() as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
@@ -355,7 +355,7 @@ class SAC_V(make_off_policy_class(mode='share')):
                 logp_all = tf.nn.log_softmax(logits)  # [B, A]
                 v = self.v_net(feat)  # [B, 1]
                 v_target = self.v_target_net(feat_)  # [B, 1]
-                dc_r = tf.stop_gradient(r + self.gamma * v_target * (1 - done))
+                dc_r = tf.stop_gradient(r + discount * v_target * (1 - done))
                 td_v = v - tf.stop_gradient(tf.minimum(
                     tf.reduce_sum(tf.exp(logp_all) * q1_all, axis=-1),
                     tf.reduce_sum(tf.exp(logp_all) * q2_all, axis=-1)
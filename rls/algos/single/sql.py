@@ -110,7 +110,7 @@ class SQL(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         with tf.device(self.device):
             with tf.GradientTape() as tape:
                 feat, feat_ = self.get_feature(ss, vvss, cell_state=cell_state, s_and_s_=True)
@@ -118,7 +118,7 @@ class SQL(make_off_policy_class(mode='share')):
                 q_next = self.q_target_net(feat_)
                 v_next = self.get_v(q_next)
                 q_eval = tf.reduce_sum(tf.multiply(q, a), axis=1, keepdims=True)
-                q_target = tf.stop_gradient(r + self.gamma * (1 - done) * v_next)
+                q_target = tf.stop_gradient(r + discount * (1 - done) * v_next)
                 td_error = q_eval - q_target
                 q_loss = tf.reduce_mean(tf.square(td_error) * isw) + crsty_loss
             grads = tape.gradient(q_loss, self.critic_tv)
@@ -161,7 +161,7 @@ class TAC(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape() as tape:
@@ -178,8 +178,8 @@ class TAC(make_off_policy_class(mode='share')):
                     target_pi = tf.one_hot(target_pi, self.a_dim, dtype=tf.float32)
                 q1, q2 = self.critic_net(feat, a)
                 q1_target, q2_target = self.critic_target_net(feat_, target_pi)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * (q1_target - self.alpha * target_log_pi))
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * (q2_target - self.alpha * target_log_pi))
+                dc_r_q1 = tf.stop_gradient(r + discount * (1 - done) * (q1_target - self.alpha * target_log_pi))
+                dc_r_q2 = tf.stop_gradient(r + discount * (1 - done) * (q2_target - self.alpha * target_log_pi))
                 td_error1 = q1 - dc_r_q1
                 td_error2 = q2 - dc_r_q2
                 q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
@@ -249,7 +249,7 @@ class TAC(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             with tf.GradientTape(persistent=True) as tape:
@@ -281,8 +281,8 @@ class TAC(make_off_policy_class(mode='share')):
                 q1, q2 = self.critic_net(feat, a)
                 q1_target, q2_target = self.critic_target_net(feat_, target_pi)
                 q_s_pi = self.critic_net.get_min(feat, pi)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * (q1_target - self.alpha * target_log_pi))
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * (q2_target - self.alpha * target_log_pi))
+                dc_r_q1 = tf.stop_gradient(r + discount * (1 - done) * (q1_target - self.alpha * target_log_pi))
+                dc_r_q2 = tf.stop_gradient(r + discount * (1 - done) * (q2_target - self.alpha * target_log_pi))
                 td_error1 = q1 - dc_r_q1
                 td_error2 = q2 - dc_r_q2
                 q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
@@ -137,7 +137,7 @@ class TD3(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             for _ in range(self.delay_num):
@@ -156,7 +156,7 @@ class TD3(make_off_policy_class(mode='share')):
                         action_target = _pi_diff + _pi
                     q1, q2 = self.critic_net(feat, a)
                     q_target = self.critic_target_net.get_min(feat_, action_target)
-                    dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                    dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                     td_error1 = q1 - dc_r
                     td_error2 = q2 - dc_r
                     q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
@@ -192,7 +192,7 @@ class TD3(make_off_policy_class(mode='share')):
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, memories, isw, crsty_loss, cell_state):
-        ss, vvss, a, r, done = memories
+        ss, vvss, a, r, done, discount = memories
         batch_size = tf.shape(a)[0]
         with tf.device(self.device):
             for _ in range(2):
@@ -218,7 +218,7 @@ class TD3(make_off_policy_class(mode='share')):
                     q1, q2 = self.critic_net(feat, a)
                     q_target = self.critic_target_net.get_min(feat_, action_target)
                     q1_actor = self.critic_net.Q1(feat, mu)
-                    dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
+                    dc_r = tf.stop_gradient(r + discount * q_target * (1 - done))
                     td_error1 = q1 - dc_r
                     td_error2 = q2 - dc_r
                     q1_loss = tf.reduce_mean(tf.square(td_error1) * isw)
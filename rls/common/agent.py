@@ -115,26 +115,29 @@ class Agent:
 
                 self.buffer_args['EpisodeER']['burn_in_time_step'] = self.algo_args.get('burn_in_time_step', 0)
                 self.buffer_args['EpisodeER']['train_time_step'] = self.algo_args.get('train_time_step', 0)
+                self.buffer_args['EpisodeER']['store_cell_state'] = self.algo_args.get('store_cell_state', False)
             else:
                 self.buffer_args['batch_size'] = self.algo_args.get('batch_size', 0)
                 self.buffer_args['buffer_size'] = self.algo_args.get('buffer_size', 0)
 
                 _use_priority = self.algo_args.get('use_priority', False)
                 _n_step = self.algo_args.get('n_step', False)
+                _use_memmap = bool(self.buffer_args.get('use_memmap', False))
+                _use_shared_memory = bool(self.buffer_args.get('use_shared_memory', False))
+                assert not (_use_shared_memory and _n_step), 'shared memory buffers do not support n_step, pending n-step transitions are kept by every process'
+                _prefix = 'Shared' if _use_shared_memory else ('Memmap' if _use_memmap else '')
                 if _use_priority and _n_step:
-                    self.buffer_args['type'] = 'NstepPER'
-                    self.buffer_args['NstepPER']['max_train_step'] = self.train_args['max_train_step']
-                    self.buffer_args['NstepPER']['gamma'] = self.algo_args['gamma']
-                    self.algo_args['gamma'] = pow(self.algo_args['gamma'], self.buffer_args['NstepPER']['n'])  # update gamma for n-step training.
+                    self.buffer_args['type'] = _prefix + 'NstepPER'
+                    self.buffer_args[self.buffer_args['type']]['max_train_step'] = self.train_args['max_train_step']
+                    self.buffer_args[self.buffer_args['type']]['gamma'] = self.algo_args['gamma']    # transitions carry their own discount gamma**k for n-step training.
                 elif _use_priority:
-                    self.buffer_args['type'] = 'PER'
-                    self.buffer_args['PER']['max_train_step'] = self.train_args['max_train_step']
+                    self.buffer_args['type'] = _prefix + 'PER'
+                    self.buffer_args[self.buffer_args['type']]['max_train_step'] = self.train_args['max_train_step']
                 elif _n_step:
-                    self.buffer_args['type'] = 'NstepER'
-                    self.buffer_args['NstepER']['gamma'] = self.algo_args['gamma']
-                    self.algo_args['gamma'] = pow(self.algo_args['gamma'], self.buffer_args['NstepER']['n'])
+                    self.buffer_args['type'] = _prefix + 'NstepER'
+                    self.buffer_args[self.buffer_args['type']]['gamma'] = self.algo_args['gamma']
                 else:
-                    self.buffer_args['type'] = 'ER'
+                    self.buffer_args['type'] = _prefix + 'ER'
         else:
             self.buffer_args['type'] = 'None'
             self.train_args['pre_fill_steps'] = 0  # if on-policy, prefill experience replay is no longer needed.
@@ -151,6 +154,14 @@ class Agent:
             # buffer ------------------------------
             if 'Nstep' in self.buffer_args['type'] or 'Episode' in self.buffer_args['type']:
                 self.buffer_args[self.buffer_args['type']]['agents_num'] = self.env_args['env_num']
+            if 'Memmap' in self.buffer_args['type']:
+                self.buffer_args[self.buffer_args['type']]['path'] = os.path.join(self.model_args.base_dir, 'buffer')
+            # dedup_frames is the former name of dedup_obs, which deduplicated visual observations only
+            _dedup_obs = self.buffer_args.get('dedup_obs', False) or (self.buffer_args.get('dedup_frames', False) and self.env.obs_type == 'visual')
+            if self.buffer_args['type'] == 'ER' and _dedup_obs:
+                self.buffer_args['type'] = 'TrajectoryER'
+                self.buffer_args['TrajectoryER']['agents_num'] = self.env_args['env_num']
+                self.buffer_args['TrajectoryER'][f'{self.env.obs_type}_stack'] = self.env.obs_stack
             buffer = get_buffer(self.buffer_args)
             # buffer ------------------------------
 
@@ -169,6 +180,8 @@ class Agent:
             self.model = Model(**self.algo_args)
             self.model.set_buffer(buffer)
             self.model.init_or_restore(self.train_args['load_model_path'])
+            if getattr(self.model, 'buffer_restored', False):
+                self.train_args['pre_fill_steps'] = 0   # the restored replay buffer is filled already
             # model -------------------------------
 
             _train_info = self.model.get_init_training_info()
@@ -194,6 +207,8 @@ class Agent:
 
                 if 'Nstep' in self.buffer_args['type'] or 'Episode' in self.buffer_args['type']:
                     self.buffer_args[self.buffer_args['type']]['agents_num'] = self.env_args['env_num']
+                if 'Memmap' in self.buffer_args['type']:
+                    self.buffer_args[self.buffer_args['type']]['path'] = os.path.join(self.model_args.base_dir, 'buffer')
                 buffer = get_buffer(self.buffer_args)
 
                 self.algo_args.update({
@@ -236,6 +251,8 @@ class Agent:
                         os.path.join(self.train_args['load_model_path'], b)
                     if 'Nstep' in _bargs['type'] or 'Episode' in _bargs['type']:
                         _bargs[_bargs['type']]['agents_num'] = self.env.brain_agents[i]
+                    if 'Memmap' in _bargs['type']:
+                        _bargs[_bargs['type']]['path'] = os.path.join(_margs.base_dir, 'buffer')
                     buffer = get_buffer(_bargs)
 
                     _margs['seed'] += i * 10  # 0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100
@@ -317,7 +334,9 @@ class Agent:
                     add_noise2buffer_steps=int(self.train_args['add_noise2buffer_steps']),
                     off_policy_eval_interval=int(self.train_args['off_policy_eval_interval']),
                     max_train_step=int(self.train_args['max_train_step']),
-                    max_frame_step=int(self.train_args['max_frame_step'])
+                    max_frame_step=int(self.train_args['max_frame_step']),
+                    rollout_steps=int(self.train_args.get('rollout_steps', 0)),
+                    double_buffered=bool(self.train_args.get('double_buffered', False))
                 )
             finally:
                 self.model.close()
@@ -57,10 +57,50 @@ def gym_train(env, model,
               add_noise2buffer_steps: int,
               off_policy_eval_interval: int,
               max_train_step: int,
-              max_frame_step: int) -> NoReturn:
+              max_frame_step: int,
+              rollout_steps: int = 0,
+              double_buffered: bool = False) -> NoReturn:
     """
     TODO: Annotation
     """
+    if double_buffered:
+        assert policy_mode == 'off-policy', 'double buffered training only supports off-policy algorithms'
+        return gym_double_buffered_train(env, model,
+                                         print_func=print_func,
+                                         begin_train_step=begin_train_step,
+                                         begin_frame_step=begin_frame_step,
+                                         begin_episode=begin_episode,
+                                         save_frequency=save_frequency,
+                                         max_step_per_episode=max_step_per_episode,
+                                         max_train_episode=max_train_episode,
+                                         eval_while_train=eval_while_train,
+                                         max_eval_episode=max_eval_episode,
+                                         off_policy_step_eval_episodes=off_policy_step_eval_episodes,
+                                         off_policy_train_interval=off_policy_train_interval,
+                                         moving_average_episode=moving_average_episode,
+                                         add_noise2buffer=add_noise2buffer,
+                                         add_noise2buffer_episode_interval=add_noise2buffer_episode_interval,
+                                         add_noise2buffer_steps=add_noise2buffer_steps,
+                                         off_policy_eval_interval=off_policy_eval_interval,
+                                         max_train_step=max_train_step,
+                                         max_frame_step=max_frame_step)
+    if policy_mode == 'on-policy' and rollout_steps > 0:
+        return gym_rollout_train(env, model,
+                                 print_func=print_func,
+                                 begin_train_step=begin_train_step,
+                                 begin_frame_step=begin_frame_step,
+                                 begin_episode=begin_episode,
+                                 render=render,
+                                 render_episode=render_episode,
+                                 save_frequency=save_frequency,
+                                 rollout_steps=rollout_steps,
+                                 max_train_episode=max_train_episode,
+                                 eval_while_train=eval_while_train,
+                                 max_step_per_episode=max_step_per_episode,
+                                 max_eval_episode=max_eval_episode,
+                                 moving_average_episode=moving_average_episode,
+                                 max_train_step=max_train_step,
+                                 max_frame_step=max_frame_step)
 
     i, state, new_state = init_variables(env)
     sma = SMA(moving_average_episode)
@@ -96,19 +136,16 @@ def gym_train(env, model,
             state[i] = correct_new_state
 
             if policy_mode == 'off-policy':
-                if total_step % off_policy_train_interval == 0:
-                    model.learn(episode=episode, train_step=train_step)
-                    train_step += 1
-                if train_step % save_frequency == 0:
-                    model.save_checkpoint(train_step=train_step, episode=episode, frame_step=frame_step)
-                if off_policy_eval_interval > 0 and train_step % off_policy_eval_interval == 0:
-                    gym_step_eval(deepcopy(env), model, train_step, off_policy_step_eval_episodes, max_step_per_episode)
+                train_step = _off_policy_learn(env, model, episode, train_step, total_step, frame_step,
+                                               off_policy_train_interval=off_policy_train_interval,
+                                               save_frequency=save_frequency,
+                                               off_policy_eval_interval=off_policy_eval_interval,
+                                               off_policy_step_eval_episodes=off_policy_step_eval_episodes,
+                                               max_step_per_episode=max_step_per_episode)
 
             frame_step += env.n
             total_step += 1
-            if 0 < max_train_step <= train_step or 0 < max_frame_step <= frame_step:
-                model.save_checkpoint(train_step=train_step, episode=episode, frame_step=frame_step)
-                logger.info(f'End Training, learn step: {train_step}, frame_step: {frame_step}')
+            if _reach_max_step(model, train_step, frame_step, episode, max_train_step, max_frame_step):
                 return
 
             if all(dones_flag):
@@ -120,30 +157,316 @@ def gym_train(env, model,
             if step >= max_step_per_episode:
                 break
 
-        sma.update(rets)
         if policy_mode == 'on-policy':
             model.learn(episode=episode, train_step=train_step)
             train_step += 1
-            if train_step % save_frequency == 0:
-                model.save_checkpoint(train_step=train_step, episode=episode, frame_step=frame_step)
-        model.writer_summary(
-            episode,
-            reward_mean=rets.mean(),
-            reward_min=rets.min(),
-            reward_max=rets.max(),
-            step=last_done_step,
-            **sma.rs
-        )
+            _save_by_frequency(model, train_step, save_frequency, episode, frame_step)
+        _end_episode(env, model, sma, episode, step, last_done_step, rets,
+                     print_func=print_func,
+                     add_noise2buffer=add_noise2buffer,
+                     add_noise2buffer_episode_interval=add_noise2buffer_episode_interval,
+                     add_noise2buffer_steps=add_noise2buffer_steps,
+                     eval_while_train=eval_while_train,
+                     max_step_per_episode=max_step_per_episode,
+                     max_eval_episode=max_eval_episode)
+
+
+def gym_double_buffered_train(env, model,
+                              print_func: Callable[[str], None],
+                              begin_train_step: int,
+                              begin_frame_step: int,
+                              begin_episode: int,
+                              save_frequency: int,
+                              max_step_per_episode: int,
+                              max_train_episode: int,
+                              eval_while_train: bool,
+                              max_eval_episode: int,
+                              off_policy_step_eval_episodes: int,
+                              off_policy_train_interval: int,
+                              moving_average_episode: int,
+                              add_noise2buffer: bool,
+                              add_noise2buffer_episode_interval: int,
+                              add_noise2buffer_steps: int,
+                              off_policy_eval_interval: int,
+                              max_train_step: int,
+                              max_frame_step: int) -> NoReturn:
+    """
+    双缓冲训练模式, double buffered training for off-policy algorithms without rnn.
+    the environments are split into two halves that take turns, one half simulates while the policy chooses actions for,
+    and learns after, the other one, so that every step costs about max(simulation, inference) instead of their sum.
+    transitions of both halves are stored together as one batch of env.n, rendering is not supported in this mode.
+    policies that keep a state for every env between choose_action calls, i.e. options of OC/IOC, are not supported either.
+    """
+    assert env.n > 1, 'double buffered training needs at least 2 environments'
+    assert not getattr(model, 'keeps_env_states', False), 'double buffered training does not support policies that keep states of every env'
+    assert not model.use_rnn, 'double buffered training does not support rnn'
+
+    i, state, new_state = init_variables(env)
+    sma = SMA(moving_average_episode)
+    frame_step = begin_frame_step
+    train_step = begin_train_step
+    total_step = 0
+    A, B = np.arange(env.n // 2), np.arange(env.n // 2, env.n)
+    received_A = []    # the step of half A in flight, received early when evaluating needs a copy of env with nothing in flight
+
+    def drop_A():
+        if received_A:
+            received_A.clear()
+        else:
+            env.step_wait()
+
+    for episode in range(begin_episode, max_train_episode):
+        model.reset()
+        state[i] = env.reset()
+        dones_flag = np.zeros(env.n)
+        step = 0
+        rets = np.zeros(env.n)
+        last_done_step = -1
+        action_A = model.choose_action(s=state[0][A], visual_s=state[1][A])
+        env.step_async(action_A, A)
+        while True:
+            step += 1
+            action_B = model.choose_action(s=state[0][B], visual_s=state[1][B])
+            env.step_async(action_B, B)
+            obs_A, reward_A, done_A, _, correct_A = received_A.pop() if received_A else env.step_wait()
+            state_A = [state[0][A], state[1][A]]
+            state_A[i] = correct_A
+            next_action_A = model.choose_action(s=state_A[0], visual_s=state_A[1])
+            env.step_async(next_action_A, A)    # half A simulates the next step while half B is finishing and the model learns
+            obs_B, reward_B, done_B, _, correct_B = env.step_wait()
+
+            action = np.concatenate([action_A, action_B])
+            reward = np.concatenate([reward_A, reward_B])
+            done = np.concatenate([done_A, done_B])
+            new_state[i] = np.concatenate([obs_A, obs_B])
+            correct_new_state = np.concatenate([correct_A, correct_B])
+            rets += (1 - dones_flag) * reward
+            dones_flag = np.sign(dones_flag + done)
+            model.store_data(
+                s=state[0],
+                visual_s=state[1],
+                a=action,
+                r=reward,
+                s_=new_state[0],
+                visual_s_=new_state[1],
+                done=done
+            )
+            state[i] = correct_new_state
+            action_A = next_action_A
+
+            train_step = _off_policy_learn(env, model, episode, train_step, total_step, frame_step,
+                                           off_policy_train_interval=off_policy_train_interval,
+                                           save_frequency=save_frequency,
+                                           off_policy_eval_interval=off_policy_eval_interval,
+                                           off_policy_step_eval_episodes=off_policy_step_eval_episodes,
+                                           max_step_per_episode=max_step_per_episode,
+                                           before_eval=lambda: received_A.append(env.step_wait()))
+
+            frame_step += env.n
+            total_step += 1
+            if _reach_max_step(model, train_step, frame_step, episode, max_train_step, max_frame_step):
+                drop_A()
+                return
+
+            if all(dones_flag):
+                last_done_step = step
+                break
+            if step >= max_step_per_episode:
+                break
+        drop_A()    # drop the step of half A in flight, environments are reset next episode
+
+        _end_episode(env, model, sma, episode, step, last_done_step, rets,
+                     print_func=print_func,
+                     add_noise2buffer=add_noise2buffer,
+                     add_noise2buffer_episode_interval=add_noise2buffer_episode_interval,
+                     add_noise2buffer_steps=add_noise2buffer_steps,
+                     eval_while_train=eval_while_train,
+                     max_step_per_episode=max_step_per_episode,
+                     max_eval_episode=max_eval_episode)
+
+
+def gym_rollout_train(env, model,
+                      print_func: Callable[[str], None],
+                      begin_train_step: int,
+                      begin_frame_step: int,
+                      begin_episode: int,
+                      render: bool,
+                      render_episode: int,
+                      save_frequency: int,
+                      rollout_steps: int,
+                      max_train_episode: int,
+                      eval_while_train: bool,
+                      max_step_per_episode: int,
+                      max_eval_episode: int,
+                      moving_average_episode: int,
+                      max_train_step: int,
+                      max_frame_step: int) -> NoReturn:
+    """
+    固定步长的on-policy训练模式, fixed-horizon rollouts for on-policy algorithms.
+    every update collects `rollout_steps` steps from all `env.n` environments, finished environments are reset by env.step and keep
+    collecting, so no environment waits for the slowest one. the rollout is bootstrapped from the value of the last next state,
+    episodes end only when the environment says done, i.e. by its max_episode_steps, and `episode` counts finished episodes.
+    """
+    i, state, new_state = init_variables(env)
+    sma = SMA(moving_average_episode)
+    frame_step = begin_frame_step
+    train_step = begin_train_step
+    episode = begin_episode
+
+    model.reset()
+    state[i] = env.reset()
+    rets = np.zeros(env.n)
+    steps = np.zeros(env.n, dtype=np.int32)
+    while episode < max_train_episode:
+        done_rets, done_steps = [], []
+        for _ in range(rollout_steps):
+            if render or episode > render_episode:
+                env.render(record=False)
+            action = model.choose_action(s=state[0], visual_s=state[1])
+            new_state[i], reward, done, info, correct_new_state = env.step(action)
+            model.store_data(
+                s=state[0],
+                visual_s=state[1],
+                a=action,
+                r=reward,
+                s_=new_state[0],
+                visual_s_=new_state[1],
+                done=done
+            )
+            model.partial_reset(done)
+            state[i] = correct_new_state
+            rets += reward
+            steps += 1
+            dones_index = np.where(done)[0]
+            if dones_index.shape[0] > 0:
+                done_rets.extend(rets[dones_index])
+                done_steps.extend(steps[dones_index])
+                rets[dones_index] = 0.
+                steps[dones_index] = 0
+            frame_step += env.n
+
+        cs = model.get_cell_state()     # calculating the bootstrap value moves the RNN hidden state, the next rollout continues from here
+        model.learn(episode=episode, train_step=train_step)
+        model.set_cell_state(cs)
+        train_step += 1
+        _save_by_frequency(model, train_step, save_frequency, episode, frame_step)
+
+        done_rets = np.asarray(done_rets)
+        if done_rets.shape[0] > 0:
+            sma.update(done_rets)
+            model.writer_summary(
+                episode,
+                reward_mean=done_rets.mean(),
+                reward_min=done_rets.min(),
+                reward_max=done_rets.max(),
+                step=int(np.mean(done_steps)),
+                **sma.rs
+            )
+            episode += done_rets.shape[0]
         print_func('-' * 40, out_time=True)
-        print_func(f'Episode: {episode:3d} | step: {step:4d} | last_done_step {last_done_step:4d} | rewards: {arrprint(rets, 2)}')
+        print_func(f'Train step: {train_step:4d} | episode: {episode:4d} | finished: {done_rets.shape[0]:3d} | rewards: {arrprint(done_rets, 2)}')
+
+        if _reach_max_step(model, train_step, frame_step, episode, max_train_step, max_frame_step):
+            return
+
+        if done_rets.shape[0] > 0 and _evaluate_if_solved(env, model, done_rets, episode, eval_while_train, max_step_per_episode, max_eval_episode, print_func):
+            model.reset()
+            state[i] = env.reset()
+            rets[:] = 0.
+            steps[:] = 0
+
+
+def _save_by_frequency(model, train_step: int, save_frequency: int, episode: int, frame_step: int) -> NoReturn:
+    if train_step % save_frequency == 0:
+        model.save_checkpoint(train_step=train_step, episode=episode, frame_step=frame_step)
+
+
+def _off_policy_learn(env, model,
+                      episode: int,
+                      train_step: int,
+                      total_step: int,
+                      frame_step: int,
+                      off_policy_train_interval: int,
+                      save_frequency: int,
+                      off_policy_eval_interval: int,
+                      off_policy_step_eval_episodes: int,
+                      max_step_per_episode: int,
+                      before_eval: Callable[[], None] = lambda: None) -> int:
+    '''
+    learn every `off_policy_train_interval` steps, then save checkpoints and evaluate on a copy of env by train steps.
+    return: train step after this step
+    '''
+    if total_step % off_policy_train_interval != 0:
+        return train_step
+    model.learn(episode=episode, train_step=train_step)
+    train_step += 1
+    _save_by_frequency(model, train_step, save_frequency, episode, frame_step)
+    if off_policy_eval_interval > 0 and train_step % off_policy_eval_interval == 0:
+        before_eval()
+        gym_step_eval(deepcopy(env), model, train_step, off_policy_step_eval_episodes, max_step_per_episode)
+    return train_step
+
+
+def _reach_max_step(model, train_step: int, frame_step: int, episode: int, max_train_step: int, max_frame_step: int) -> bool:
+    '''
+    save the last checkpoint and return True if training should end.
+    '''
+    if 0 < max_train_step <= train_step or 0 < max_frame_step <= frame_step:
+        model.save_checkpoint(train_step=train_step, episode=episode, frame_step=frame_step)
+        logger.info(f'End Training, learn step: {train_step}, frame_step: {frame_step}')
+        return True
+    return False
+
+
+def _evaluate_if_solved(env, model,
+                        rets: np.ndarray,
+                        episode: int,
+                        eval_while_train: bool,
+                        max_step_per_episode: int,
+                        max_eval_episode: int,
+                        print_func: Callable[[str], None]) -> bool:
+    '''
+    evaluate once returns reach the reward threshold of env, return whether it evaluated, environments are reset by then.
+    '''
+    if eval_while_train and env.reward_threshold is not None and rets.max() >= env.reward_threshold:
+        print_func(f'-------------------------------------------Evaluate episode: {episode:3d}--------------------------------------------------')
+        gym_evaluate(env, model, max_step_per_episode, max_eval_episode, print_func)
+        return True
+    return False
+
+
+def _end_episode(env, model, sma,
+                 episode: int,
+                 step: int,
+                 last_done_step: int,
+                 rets: np.ndarray,
+                 print_func: Callable[[str], None],
+                 add_noise2buffer: bool,
+                 add_noise2buffer_episode_interval: int,
+                 add_noise2buffer_steps: int,
+                 eval_while_train: bool,
+                 max_step_per_episode: int,
+                 max_eval_episode: int) -> NoReturn:
+    '''
+    bookkeeping after every episode of gym_train and gym_double_buffered_train:
+    summaries, adding noise to the replay buffer and evaluating once solved.
+    '''
+    sma.update(rets)
+    model.writer_summary(
+        episode,
+        reward_mean=rets.mean(),
+        reward_min=rets.min(),
+        reward_max=rets.max(),
+        step=last_done_step,
+        **sma.rs
+    )
+    print_func('-' * 40, out_time=True)
+    print_func(f'Episode: {episode:3d} | step: {step:4d} | last_done_step {last_done_step:4d} | rewards: {arrprint(rets, 2)}')
 
-        if add_noise2buffer and episode % add_noise2buffer_episode_interval == 0:
-            gym_no_op(env, model, pre_fill_steps=add_noise2buffer_steps, print_func=print_func, prefill_choose=False, desc='adding noise')
+    if add_noise2buffer and episode % add_noise2buffer_episode_interval == 0:
+        gym_no_op(env, model, pre_fill_steps=add_noise2buffer_steps, print_func=print_func, prefill_choose=False, desc='adding noise')
 
-        if eval_while_train and env.reward_threshold is not None:
-            if rets.max() >= env.reward_threshold:
-                print_func(f'-------------------------------------------Evaluate episode: {episode:3d}--------------------------------------------------')
-                gym_evaluate(env, model, max_step_per_episode, max_eval_episode, print_func)
+    _evaluate_if_solved(env, model, rets, episode, eval_while_train, max_step_per_episode, max_eval_episode, print_func)
 
 
 def gym_step_eval(env, model,
@@ -182,7 +505,7 @@ def gym_step_eval(env, model,
         eval_ave_step=ave_steps // episodes_num,
     )
     model.set_cell_state(cs)
-    del env
+    env.close()
 
 
 def gym_evaluate(env, model,
@@ -21,22 +21,21 @@ except ImportError:
     pass
 
 import numpy as np
-import platform
-use_ray = False
-if platform.system() != "Windows" and use_ray:
-    from . import ray_wrapper as Asyn
-else:
-    from . import threading_wrapper as Asyn
+import importlib
 
 from typing import Dict
-from copy import deepcopy
+from collections import deque
 
 from rls.utils.np_utils import int2action_index
 from gym.spaces import \
     Box, \
     Discrete, \
     Tuple
-from rls.envs.gym_wrapper.utils import build_env
+from rls.envs.gym_wrapper.utils import \
+    build_env, \
+    preprocess_config
+from rls.envs.gym_wrapper.wrappers import StackEnv
+from rls.envs.gym_wrapper.preprocess import BatchPreprocessor
 
 
 class gym_envs(object):
@@ -53,10 +52,24 @@ class gym_envs(object):
 
         self.info_env = build_env(config)
         self._initialize(env=self.info_env)
+        # grayscale, resize, scale, stack and clip the batch of all environments instead of wrappers of every environment
+        if bool(config.get('batch_preprocess', False)):
+            self.preprocessor = BatchPreprocessor(self.n, self.info_env.observation_space.shape, **preprocess_config(config))
+            if self.obs_type == 'visual':
+                self.visual_resolution = list(self.preprocessor.shape)
+            else:
+                self.s_dim = self.preprocessor.shape[0]
+            self.obs_stack = self.preprocessor.stack
+        else:
+            self.preprocessor = None
         self.info_env.close()
         del self.info_env
 
-        self.envs = Asyn.init_envs(build_env, config, self.n, config['env_seed'])
+        self.env_backend = config.get('env_backend', 'threading')
+        assert self.env_backend in ['threading', 'process', 'ray'], 'env_backend must be threading, process or ray'
+        self.Asyn = self._backend(self.env_backend)
+        self._pending = deque()   # (idxs, handle) of environments being stepped, see step_async
+        self.envs = self.Asyn.init_envs(build_env, config, self.n, config['env_seed'], int(config.get('env_worker_num', 0)))
         self._get_render_index(render_mode)
 
     def _initialize(self, env):
@@ -77,6 +90,7 @@ class gym_envs(object):
             self.obs_type = 'vector'
             self.visual_sources = 0
             self.visual_resolution = []
+        self.obs_stack = self._get_stack(env)
 
         # process action
         ActSpace = env.action_space
@@ -99,6 +113,36 @@ class gym_envs(object):
 
         self.reward_threshold = env.env.spec.reward_threshold  # reward threshold refer to solved
 
+    @staticmethod
+    def _backend(env_backend: str):
+        '''
+        threading: persistent threads in this process, process: subprocesses writing results into shared memory, ray: ray actors
+        '''
+        return importlib.import_module(f'.{env_backend}_wrapper', __package__)
+
+    def __getstate__(self) -> Dict:
+        '''
+        modules cannot be copied, the backend is resolved again by name, i.e. when the environments are deep copied for evaluation.
+        '''
+        state = self.__dict__.copy()
+        state.pop('Asyn', None)
+        return state
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self.Asyn = self._backend(self.env_backend)
+
+    @staticmethod
+    def _get_stack(env) -> int:
+        '''
+        how many frames are concatenated along the last axis of observations by StackEnv, 1 if not stacked.
+        '''
+        while isinstance(env, gym.Wrapper):
+            if isinstance(env, StackEnv):
+                return env._stack
+            env = env.env
+        return 1
+
     @property
     def is_continuous(self):
         return self._is_continuous
@@ -132,49 +176,57 @@ class gym_envs(object):
         '''
         render game windows.
         '''
-        Asyn.op_func([self.envs[i] for i in self.render_index], Asyn.OP.RENDER)
+        self.Asyn.op_func(self.envs, self.Asyn.OP.RENDER, record, idxs=self.render_index)
 
     def close(self):
         '''
         close all environments.
         '''
-        Asyn.op_func(self.envs, Asyn.OP.CLOSE)
+        self.Asyn.op_func(self.envs, self.Asyn.OP.CLOSE)
 
     def sample_actions(self):
         '''
         generate random actions for all training environment.
         '''
-        return np.asarray(Asyn.op_func(self.envs, Asyn.OP.SAMPLE))
+        return np.asarray(self.Asyn.op_func(self.envs, self.Asyn.OP.SAMPLE))
 
     def reset(self):
-        obs = np.asarray(Asyn.op_func(self.envs, Asyn.OP.RESET))
+        obs = self.Asyn.op_func(self.envs, self.Asyn.OP.RESET)
+        if self.preprocessor is not None:
+            obs = self.preprocessor.reset(obs)
         if self.obs_type == 'visual':
             obs = obs[:, np.newaxis, ...]
         return obs
 
     def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions, idxs=None):
+        '''
+        start stepping environments `idxs`, all environments if None, without waiting for them.
+        several disjoint groups of environments could be stepping at the same time, their results are returned by step_wait in order.
+        '''
         actions = np.array(actions)
         if not self.is_continuous:
             actions = int2action_index(actions, self.discrete_action_dim_list)
             if self.action_type == 'discrete':
                 actions = actions.reshape(-1,)
             elif self.action_type == 'Tuple(Discrete)':
-                actions = actions.reshape(self.n, -1).tolist()
-        results = Asyn.op_func(self.envs, Asyn.OP.STEP, actions)
-        obs, reward, done, info = [np.asarray(e) for e in zip(*results)]
+                actions = actions.reshape(actions.shape[0], -1).tolist()
+        self._pending.append((idxs, self.Asyn.op_send(self.envs, self.Asyn.OP.STEP, actions, idxs)))
+
+    def step_wait(self):
+        '''
+        wait for the earliest step_async, return obs, reward, done, info, correct_new_obs of its environments.
+        finished environments are reset by their workers, correct_new_obs holds the first observations of their new episodes.
+        '''
+        idxs, handle = self._pending.popleft()
+        obs, reward, done, info, correct_new_obs = self.Asyn.op_recv(self.envs, handle)
+        if self.preprocessor is not None:
+            obs, reward, correct_new_obs = self.preprocessor.step(obs, reward, done, correct_new_obs, idxs)
         reward = reward.astype('float32')
-        dones_index = np.where(done)[0]
-        if dones_index.shape[0] > 0:
-            correct_new_obs = self.partial_reset(obs, dones_index)
-        else:
-            correct_new_obs = obs
         if self.obs_type == 'visual':
             obs = obs[:, np.newaxis, ...]
             correct_new_obs = correct_new_obs[:, np.newaxis, ...]
         return obs, reward, done, info, correct_new_obs
-
-    def partial_reset(self, obs, dones_index):
-        correct_new_obs = deepcopy(obs)
-        partial_obs = np.asarray(Asyn.op_func([self.envs[i] for i in dones_index], Asyn.OP.RESET))
-        correct_new_obs[dones_index] = partial_obs
-        return correct_new_obs
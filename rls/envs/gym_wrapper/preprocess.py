@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import numpy as np
+
+from typing import \
+    List, \
+    Optional, \
+    Tuple
+
+from rls.utils.frame_ring import FrameRing
+
+logger = logging.getLogger('rls.envs.gym_wrapper.preprocess')
+try:
+    import cv2
+    cv2.ocl.setUseOpenCL(False)
+except ImportError:
+    cv2 = None
+    logger.warning('opencv-python is not installed, batched preprocessing falls back to numpy.')
+
+CV_CN_MAX = 512     # max number of channels of an image in opencv
+
+
+def area_weights(src: int, dst: int) -> np.ndarray:
+    '''
+    [dst, src] matrix, row i averages the input pixels covered by output pixel i, the same as cv2.INTER_AREA when shrinking.
+    '''
+    scale = src / dst
+    begin = np.arange(dst)[:, None] * scale
+    edges = np.arange(src + 1)[None, :]
+    overlap = np.clip(np.minimum(edges[:, 1:], begin + scale) - np.maximum(edges[:, :-1], begin), 0, None)
+    return (overlap / scale).astype(np.float32)
+
+
+class BatchPreprocessor(object):
+    '''
+    Preprocesses observations of all environments of gym_envs at once, instead of GrayResizeEnv, ScaleEnv, StackEnv, ClipRewardEnv
+    and DtypeEnv inside every environment:
+        visual: grayscale -> resize -> stack -> scale, frames stay uint8 until scaling
+        vector: float32 -> stack
+    Intermediate results and the latest frames, kept in a FrameRing, are written into buffers allocated once,
+    only the stacked observations returned are new arrays, because callers keep them as states of transitions.
+    '''
+
+    def __init__(self,
+                 n: int,
+                 obs_shape: Tuple,
+                 grayscale: bool = False,
+                 resize: Optional[List[int]] = None,
+                 scale: bool = False,
+                 stack: int = 1,
+                 clip_rewards: bool = False):
+        '''
+        inputs:
+            obs_shape: shape of raw observations, [H, W, C] or [dim]
+            resize: [width, height] or None
+        '''
+        self.n = n
+        self.visual = len(obs_shape) == 3
+        self.grayscale = grayscale and self.visual
+        self.resize = resize if self.visual else None
+        self.scale = scale and self.visual
+        self.stack = stack
+        self.clip_rewards = clip_rewards
+        if self.visual:
+            H, W, C = obs_shape
+            if self.grayscale:
+                C = 1
+            h, w = (resize[-1], resize[0]) if self.resize else (H, W)
+            self.frame_shape = (h, w, C)
+            self.shape = (h, w, C * stack)
+            frame_dtype = np.uint8
+            if self.grayscale:
+                self._gray = np.empty((n, H, W), dtype=np.uint8)
+                if cv2 is None:
+                    self._gray32 = np.empty((2, n, H, W), dtype=np.uint32)
+            if self.resize:
+                if cv2 is not None:
+                    self._channels_last = np.empty((H, W, n * C), dtype=np.uint8)     # [n, H, W, C] => [H, W, n*C] for one cv2.resize
+                    self._resized = np.empty((h, w, n * C), dtype=np.uint8)
+                else:
+                    self._wy, self._wx = area_weights(H, h), np.ascontiguousarray(area_weights(W, w).T)
+                    self._src32 = np.empty((n, C, H, W), dtype=np.float32)
+                    self._rows32 = np.empty((n, C, h, W), dtype=np.float32)
+                    self._cols32 = np.empty((n, C, h, w), dtype=np.float32)
+                    self._resized = np.empty((n, h, w, C), dtype=np.uint8)
+        else:
+            self.frame_shape = tuple(obs_shape)
+            self.shape = (obs_shape[0] * stack,)
+            frame_dtype = np.float32
+        self._ring = FrameRing(n, stack, self.frame_shape, frame_dtype)    # the latest `stack` frames of every env
+        self.dtype = np.float32 if (self.scale or not self.visual) else np.uint8
+
+    def _to_gray(self, obs: np.ndarray) -> np.ndarray:
+        m = obs.shape[0]
+        gray = self._gray[:m]
+        if cv2 is not None:
+            H, W = obs.shape[1:3]
+            cv2.cvtColor(np.ascontiguousarray(obs).reshape(m * H, W, 3), cv2.COLOR_RGB2GRAY, dst=gray.reshape(m * H, W))
+        else:
+            # fixed-point coefficients of cv2.COLOR_RGB2GRAY
+            acc, tmp = self._gray32[:, :m]
+            np.multiply(obs[..., 0], np.uint32(4899), out=acc)
+            acc += np.multiply(obs[..., 1], np.uint32(9617), out=tmp)
+            acc += np.multiply(obs[..., 2], np.uint32(1868), out=tmp)
+            acc += np.uint32(8192)
+            np.right_shift(acc, 14, out=acc, casting='unsafe')
+            np.copyto(gray, acc, casting='unsafe')
+        return gray[..., np.newaxis]
+
+    def _resize(self, obs: np.ndarray) -> np.ndarray:
+        m, H, W, C = obs.shape
+        h, w = self.frame_shape[:2]
+        if cv2 is not None:
+            src = self._channels_last[..., :m * C].reshape(H, W, m, C)
+            np.copyto(src, obs.transpose(1, 2, 0, 3))
+            src = src.reshape(H, W, m * C)
+            dst = self._resized[..., :m * C]
+            for k in range(0, m * C, CV_CN_MAX):
+                dst[..., k:k + CV_CN_MAX] = cv2.resize(src[..., k:k + CV_CN_MAX], (w, h), interpolation=cv2.INTER_AREA).reshape(h, w, -1)
+            return dst.reshape(h, w, m, C).transpose(2, 0, 1, 3)
+        x = self._src32[:m]
+        np.copyto(x, obs.transpose(0, 3, 1, 2))
+        rows = np.matmul(self._wy, x, out=self._rows32[:m])    # [m, C, h, W]
+        cols = np.matmul(rows, self._wx, out=self._cols32[:m])     # [m, C, h, w]
+        np.rint(cols, out=cols)
+        dst = self._resized[:m]
+        np.copyto(dst, cols.transpose(0, 2, 3, 1), casting='unsafe')
+        return dst
+
+    def frames(self, obs: np.ndarray) -> np.ndarray:
+        '''
+        grayscale and resize a batch of raw observations, or cast them to float32 if they are vectors.
+        '''
+        obs = np.asarray(obs)
+        if not self.visual:
+            return obs.astype(np.float32, copy=False)
+        if self.grayscale:
+            obs = self._to_gray(obs)
+        if self.resize:
+            obs = self._resize(obs)
+        return obs
+
+    def _output(self, idxs=None) -> np.ndarray:
+        '''
+        stacked observations of environments idxs, all if None, copied once from the frame ring into a new array.
+        '''
+        if not self.scale:
+            return self._ring.stacked(idxs)
+        out = self._ring.stacked(idxs, dtype=np.float32)
+        out *= np.float32(1. / 255)
+        return out
+
+    def reset(self, obs: np.ndarray, idxs=None) -> np.ndarray:
+        '''
+        fill the stacks of environments idxs, all if None, with their first frames.
+        '''
+        self._ring.fill(self.frames(obs), idxs)
+        return self._output(idxs)
+
+    def step(self,
+             obs: np.ndarray,
+             reward: np.ndarray,
+             done: np.ndarray,
+             correct_new_obs: np.ndarray,
+             idxs=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        push new frames of environments idxs, all if None, finished environments are restacked with the first frames of their new episodes.
+        return:
+            obs, reward, correct_new_obs
+        '''
+        self._ring.push(self.frames(obs), idxs)
+        obs = self._output(idxs)
+        dones_index = np.where(done)[0]
+        if dones_index.shape[0] > 0:
+            new_obs = obs.copy()
+            new_obs[dones_index] = self.reset(np.asarray(correct_new_obs)[dones_index], dones_index if idxs is None else np.asarray(idxs)[dones_index])
+        else:
+            new_obs = obs
+        if self.clip_rewards:
+            reward = np.sign(reward)
+        return obs, reward, new_obs
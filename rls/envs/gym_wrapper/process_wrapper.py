@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import traceback
+import numpy as np
+import multiprocessing
+
+from enum import Enum
+from typing import \
+    Any, \
+    Callable, \
+    Dict, \
+    List, \
+    NoReturn, \
+    Optional, \
+    Tuple
+
+from rls.utils.shared_arrays import SharedArrays
+
+logger = logging.getLogger('rls.envs.gym_wrapper.process_wrapper')
+
+
+class OP(Enum):
+    RESET = 0
+    STEP = 1
+    CLOSE = 2
+    RENDER = 3
+    SAMPLE = 4
+
+
+def _worker(remote, parent_remote, func: Callable, config: Dict, seeds: List[int], begin: int) -> NoReturn:
+    '''
+    hosts len(seeds) environments, writes observations, rewards and dones of them into rows [begin, begin + len(seeds))
+    of the shared arrays, only infos, random actions and errors are sent back through the pipe.
+    finished environments are reset at once, the first observations of their new episodes are written into reset_obs.
+    '''
+    parent_remote.close()
+    envs = [func(config) for _ in seeds]
+    [env.seed(s) for env, s in zip(envs, seeds)]
+    obs = np.asarray(envs[0].reset())
+    remote.send((obs.shape, obs.dtype.str))
+    shared = remote.recv()
+    obs, reset_obs, reward, done = shared['obs'], shared['reset_obs'], shared['reward'], shared['done']
+    try:
+        while True:
+            seq, op, idxs, args = remote.recv()
+            try:
+                ret = None
+                if op == OP.STEP:
+                    ret = []
+                    for k, j in enumerate(idxs):
+                        obs[begin + j], reward[begin + j], done[begin + j], info = envs[j].step(args[k])
+                        if done[begin + j]:
+                            reset_obs[begin + j] = envs[j].reset()
+                        ret.append(info)
+                elif op == OP.RESET:
+                    for j in idxs:
+                        obs[begin + j] = envs[j].reset()
+                elif op == OP.SAMPLE:
+                    ret = [envs[j].action_sample() for j in idxs]
+                elif op == OP.RENDER:
+                    for j in idxs:
+                        if args:
+                            envs[j].render(filename=r'videos/{0}-{1}.mp4'.format(envs[j].env.spec.id, begin + j))
+                        else:
+                            envs[j].render()
+                elif op == OP.CLOSE:
+                    [env.close() for env in envs]
+                    remote.send((seq, None))
+                    break
+                remote.send((seq, ret))
+            except Exception:
+                remote.send((seq, RuntimeError(f'env worker {os.getpid()} failed:\n{traceback.format_exc()}')))
+    except (KeyboardInterrupt, EOFError):
+        [env.close() for env in envs]
+    finally:
+        shared.close()
+        remote.close()
+
+
+class ProcessEnvPool(object):
+    '''
+    environments hosted by `worker_num` subprocesses, environment i belongs to worker i * worker_num // n.
+    observations, rewards and dones are read from multiprocessing.shared_memory, so that stepping all environments
+    costs one small message per worker and one wait for their replies, without pickling observations.
+    send() returns at once, so that several operations on different environments could be in flight, recv() collects them.
+    rows of the shared arrays are overwritten by the next operation on the same environments.
+    '''
+
+    def __init__(self, func: Callable, config: Dict, n: int, seed: int, worker_num: int = 0, start_method: str = 'spawn'):
+        self.func = func
+        self.config = config
+        self.n = n
+        self.seed = seed
+        self.worker_num = min(worker_num or os.cpu_count() or 1, n)
+        self.start_method = start_method
+        owner = np.arange(n) * self.worker_num // n
+        self._owner = owner.tolist()
+        self._local = (np.arange(n) - np.searchsorted(owner, owner)).tolist()
+        ctx = multiprocessing.get_context(start_method)
+        self.remotes, self.processes = [], []
+        for w in range(self.worker_num):
+            rows = np.where(owner == w)[0]
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=_worker,
+                                  args=(work_remote, remote, func, config, [seed + i for i in rows], int(rows[0])),
+                                  name=f'rls-env-worker-{w}',
+                                  daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        shape, dtype = self.remotes[0].recv()
+        for remote in self.remotes[1:]:
+            remote.recv()
+        self.shared = SharedArrays()
+        self.obs = self.shared.create('obs', (n, *shape), dtype)
+        self.reset_obs = self.shared.create('reset_obs', (n, *shape), dtype)
+        self.reward = self.shared.create('reward', (n,), np.float32)
+        self.done = self.shared.create('done', (n,), bool)
+        for remote in self.remotes:
+            remote.send(self.shared)
+        self._all = self._group(range(n))
+        self._seq = 0
+        self._stash = {}    # (worker id, sequence number) => results that arrived before the ones being waited for
+        self.closed = False
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _group(self, idxs) -> Dict[int, List[List[int]]]:
+        '''
+        worker id => [local indexes, positions in idxs]
+        '''
+        groups = {}
+        for p, i in enumerate(idxs):
+            local, pos = groups.setdefault(self._owner[i], [[], []])
+            local.append(self._local[i])
+            pos.append(p)
+        return groups
+
+    def send(self, op: OP, args: Any = None, idxs: Optional[List[int]] = None) -> Tuple:
+        groups = self._all if idxs is None else self._group(idxs)
+        self._seq += 1
+        for w, (local, pos) in groups.items():
+            if op == OP.STEP:
+                self.remotes[w].send((self._seq, op, local, [args[p] for p in pos]))
+            else:
+                self.remotes[w].send((self._seq, op, local, args))
+        return self._seq, groups, (self.n if idxs is None else len(idxs))
+
+    def _result(self, w: int, seq: int) -> Any:
+        if (w, seq) in self._stash:
+            return self._stash.pop((w, seq))
+        while True:
+            _seq, ret = self.remotes[w].recv()
+            if _seq == seq:
+                return ret
+            self._stash[(w, _seq)] = ret
+
+    def recv(self, handle: Tuple) -> List:
+        seq, groups, num = handle
+        out = [None] * num
+        error = None
+        for w, (_, pos) in groups.items():
+            ret = self._result(w, seq)
+            if isinstance(ret, Exception):
+                error = ret
+            elif ret is not None:
+                for p, r in zip(pos, ret):
+                    out[p] = r
+        if error is not None:
+            raise error
+        return out
+
+    def run(self, op: OP, args: Any = None, idxs: Optional[List[int]] = None) -> List:
+        return self.recv(self.send(op, args, idxs))
+
+    def close(self) -> NoReturn:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.run(OP.CLOSE)
+        except (BrokenPipeError, EOFError, RuntimeError):
+            logger.warning('some env workers exited before closing.')
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for remote in self.remotes:
+            remote.close()
+        self.shared.close()
+
+    def __deepcopy__(self, memo):
+        '''
+        workers cannot be copied, a new pool of freshly built environments is created instead.
+        '''
+        return ProcessEnvPool(self.func, self.config, self.n, self.seed, self.worker_num, self.start_method)
+
+
+def init_envs(func, config, n, seed, worker_num=0):
+    return ProcessEnvPool(func, config, n, seed, worker_num, config.get('start_method', 'spawn'))
+
+
+def op_send(envs: ProcessEnvPool, op: OP, _args=None, idxs=None):
+    '''
+    same as rls.envs.gym_wrapper.threading_wrapper.op_send
+    '''
+    return op, idxs, envs.send(op, _args, idxs)
+
+
+def op_recv(envs: ProcessEnvPool, handle):
+    '''
+    same as rls.envs.gym_wrapper.threading_wrapper.op_recv, observations are copied out of the shared arrays.
+    '''
+    op, idxs, handle = handle
+    results = envs.recv(handle)
+    if op == OP.RESET:
+        return envs.obs.copy() if idxs is None else envs.obs[idxs]
+    if op == OP.STEP:
+        if idxs is None:
+            obs, reward, done = envs.obs.copy(), envs.reward.copy(), envs.done.copy()
+        else:
+            obs, reward, done = envs.obs[idxs], envs.reward[idxs], envs.done[idxs]
+        dones_index = np.where(done)[0]
+        if dones_index.shape[0] > 0:
+            correct_new_obs = obs.copy()
+            correct_new_obs[dones_index] = envs.reset_obs[dones_index if idxs is None else np.asarray(idxs)[dones_index]]
+        else:
+            correct_new_obs = obs
+        return obs, reward, done, results, correct_new_obs
+    return results
+
+
+def op_func(envs: ProcessEnvPool, op: OP, _args=None, idxs=None):
+    '''
+    same as rls.envs.gym_wrapper.threading_wrapper.op_func
+    '''
+    if op == OP.CLOSE:
+        return envs.close()
+    if op == OP.RENDER:
+        envs.run(op, _args, idxs)
+        return None
+    return op_recv(envs, op_send(envs, op, _args, idxs))
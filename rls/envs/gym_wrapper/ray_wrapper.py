@@ -1,9 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import ray
+import numpy as np
+
 from enum import Enum
-from typing import Dict
+from typing import \
+    Any, \
+    Callable, \
+    Dict, \
+    List, \
+    NoReturn, \
+    Optional, \
+    Tuple
+
+from rls.envs.gym_wrapper.threading_wrapper import step_and_reset
 
 
 class OP(Enum):
@@ -15,51 +27,176 @@ class OP(Enum):
 
 
 @ray.remote
-class RayEnv:
-    def __init__(self, env_func, config: Dict):
-        self.env = env_func(config)
+class RayEnvs:
+    '''
+    ray actor that owns several environments and returns stacked numpy arrays,
+    which are shared from the local object store without copying when they are large enough.
+    '''
 
-    def seed(self, s):
-        self.env.seed(s)
+    def __init__(self, env_func: Callable, config: Dict, seeds: List[int], ids: List[int]):
+        '''
+        inputs:
+            ids: global indexes of the environments in the pool, used to name their videos
+        '''
+        self.envs = [env_func(config) for _ in seeds]
+        self.ids = ids
+        [env.seed(s) for env, s in zip(self.envs, seeds)]
 
-    def reset(self):
-        return self.env.reset()
+    def reset(self, idxs: List[int]) -> np.ndarray:
+        return np.asarray([self.envs[j].reset() for j in idxs])
 
-    def step(self, action):
-        return self.env.step(action)
+    def step(self, idxs: List[int], actions: List) -> Tuple:
+        '''
+        finished environments are reset at once, see rls.envs.gym_wrapper.threading_wrapper.step_and_reset
+        return:
+            obs, reward, done, info, correct_new_obs of environments idxs
+        '''
+        obs, reward, done, info, reset_obs = zip(*[step_and_reset(self.envs[j], a) for j, a in zip(idxs, actions)])
+        obs = np.asarray(obs)
+        done = np.asarray(done)
+        dones_index = np.where(done)[0]
+        if dones_index.shape[0] > 0:
+            correct_new_obs = obs.copy()
+            correct_new_obs[dones_index] = np.asarray([reset_obs[i] for i in dones_index])
+        else:
+            correct_new_obs = obs
+        return obs, np.asarray(reward, dtype=np.float32), done, list(info), correct_new_obs
 
-    def render(self):
-        self.env.render()
+    def sample(self, idxs: List[int]) -> List:
+        return [self.envs[j].action_sample() for j in idxs]
 
-    def close(self):
-        self.env.close()
+    def render(self, idxs: List[int], record: bool) -> NoReturn:
+        for j in idxs:
+            if record:
+                self.envs[j].render(filename=r'videos/{0}-{1}.mp4'.format(self.envs[j].env.spec.id, self.ids[j]))
+            else:
+                self.envs[j].render()
 
-    def sample(self):
-        return self.env.action_sample()
+    def close(self) -> NoReturn:
+        [env.close() for env in self.envs]
 
 
-def init_envs(func, config, n, seed):
-    ray.init()
-    envs = [RayEnv.remote(func, config) for i in range(n)]
-    seeds = [seed + i for i in range(n)]  # [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
-    [env.seed.remote(s) for env, s in zip(envs, seeds)]
-    return envs
+class RayEnvPool(object):
+    '''
+    environments hosted by `worker_num` ray actors on this machine, environment i belongs to actor i * worker_num // n.
+    every operation costs one actor call per involved actor, several operations on different environments could be in flight.
+    arrays read from the object store without copying are read-only.
+    '''
 
+    def __init__(self, func: Callable, config: Dict, n: int, seed: int, worker_num: int = 0):
+        self.func = func
+        self.config = config
+        self.n = n
+        self.seed = seed
+        self.worker_num = min(worker_num or os.cpu_count() or 1, n)
+        self._init_ray = not ray.is_initialized()
+        if self._init_ray:
+            ray.init(local_mode=False, include_dashboard=False)
+        owner = np.arange(n) * self.worker_num // n
+        self._owner = owner.tolist()
+        self._local = (np.arange(n) - np.searchsorted(owner, owner)).tolist()
+        self.actors = []
+        for w in range(self.worker_num):
+            ids = np.where(owner == w)[0].tolist()
+            self.actors.append(RayEnvs.remote(func, config, [seed + i for i in ids], ids))
+        self._all = self._group(range(n))
+        self.closed = False
 
-def op_func(envs, op: OP, _args=None):
-    if op == OP.RESET:
-        return ray.get([env.reset.remote() for env in envs])
-    if op == OP.STEP:
-        return ray.get([env.step.remote(action) for env, action in zip(envs, _args)])
-    if op == OP.SAMPLE:
-        return ray.get([env.sample.remote() for env in envs])
-    if op == OP.RENDER:
-        if _args:  # record
-            [env.render.remote(filename=r'videos/{0}-{1}.mp4'.format(env.env.spec.id, i)) for i, env in enumerate(envs)]
-        else:
-            [env.render.remote() for env in envs]
-        return None
+    def __len__(self) -> int:
+        return self.n
+
+    def _group(self, idxs) -> Dict[int, List[List[int]]]:
+        '''
+        worker id => [local indexes, positions in idxs]
+        '''
+        groups = {}
+        for p, i in enumerate(idxs):
+            local, pos = groups.setdefault(self._owner[i], [[], []])
+            local.append(self._local[i])
+            pos.append(p)
+        return groups
+
+    def send(self, op: OP, args: Any = None, idxs: Optional[List[int]] = None) -> Tuple:
+        groups = self._all if idxs is None else self._group(idxs)
+        futures = []
+        for w, (local, pos) in groups.items():
+            if op == OP.RESET:
+                futures.append(self.actors[w].reset.remote(local))
+            elif op == OP.STEP:
+                futures.append(self.actors[w].step.remote(local, [args[p] for p in pos]))
+            elif op == OP.SAMPLE:
+                futures.append(self.actors[w].sample.remote(local))
+            elif op == OP.RENDER:
+                futures.append(self.actors[w].render.remote(local, args))
+            elif op == OP.CLOSE:
+                futures.append(self.actors[w].close.remote())
+        return op, groups, idxs is None, futures
+
+    @staticmethod
+    def _stack(parts: List[np.ndarray], perm: Optional[np.ndarray]) -> np.ndarray:
+        x = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        if perm is None:
+            return x
+        out = np.empty_like(x)
+        out[perm] = x
+        return out
+
+    def recv(self, handle: Tuple) -> Any:
+        op, groups, in_order, futures = handle
+        results = ray.get(futures)
+        if op in [OP.RENDER, OP.CLOSE]:
+            return None
+        perm = None if in_order else np.concatenate([pos for _, pos in groups.values()])
+        if op == OP.RESET:
+            return self._stack(results, perm)
+        if op == OP.STEP:
+            obs, reward, done, info, correct_new_obs = zip(*results)
+            info = [i for part in info for i in part]
+            if perm is not None:
+                info = [info[k] for k in np.argsort(perm)]
+            return (self._stack(obs, perm), self._stack(reward, perm), self._stack(done, perm),
+                    info, self._stack(correct_new_obs, perm))
+        actions = [a for part in results for a in part]
+        return actions if perm is None else [actions[k] for k in np.argsort(perm)]
+
+    def close(self) -> NoReturn:
+        if self.closed:
+            return
+        self.closed = True
+        self.recv(self.send(OP.CLOSE))
+        [ray.kill(actor) for actor in self.actors]
+        if self._init_ray:
+            ray.shutdown()
+
+    def __deepcopy__(self, memo):
+        '''
+        actors cannot be copied, a new pool of freshly built environments is created instead.
+        '''
+        return RayEnvPool(self.func, self.config, self.n, self.seed, self.worker_num)
+
+
+def init_envs(func, config, n, seed, worker_num=0):
+    return RayEnvPool(func, config, n, seed, worker_num)
+
+
+def op_send(envs: RayEnvPool, op: OP, _args=None, idxs=None):
+    '''
+    same as rls.envs.gym_wrapper.threading_wrapper.op_send
+    '''
+    return envs.send(op, _args, idxs)
+
+
+def op_recv(envs: RayEnvPool, handle):
+    '''
+    same as rls.envs.gym_wrapper.threading_wrapper.op_recv, observations are stacked by the actors.
+    '''
+    return envs.recv(handle)
+
+
+def op_func(envs: RayEnvPool, op: OP, _args=None, idxs=None):
+    '''
+    same as rls.envs.gym_wrapper.threading_wrapper.op_func
+    '''
     if op == OP.CLOSE:
-        ray.get([env.close.remote() for env in envs])
-        ray.shutdown()
-        return None
+        return envs.close()
+    return op_recv(envs, op_send(envs, op, _args, idxs))
@@ -1,8 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import queue
 import threading
+import numpy as np
+
 from enum import Enum
+from typing import \
+    Any, \
+    Dict, \
+    List, \
+    NoReturn, \
+    Optional, \
+    Tuple
 
 
 class OP(Enum):
@@ -13,54 +24,235 @@ class OP(Enum):
     SAMPLE = 4
 
 
-class FakeMultiThread(threading.Thread):
+def step_and_reset(env, action) -> Tuple:
+    '''
+    step an environment and reset it at once if done.
+    return:
+        obs, reward, done, info, and the observation of the new episode if done else None
+    '''
+    obs, reward, done, info = env.step(action)
+    return obs, reward, done, info, (env.reset() if done else None)
+
+
+def _execute(env, op: OP, arg: Any = None) -> Any:
+    if op == OP.RESET:
+        return env.reset()
+    elif op == OP.STEP:
+        return step_and_reset(env, arg)
+    elif op == OP.CLOSE:
+        return env.close()
+    elif op == OP.SAMPLE:
+        return env.action_sample()
+
+
+class EnvWorker(threading.Thread):
+    '''
+    long-lived thread that owns a fixed subset of environments, executes commands on several of them in order
+    and puts (sequence number, results) into its own result queue.
+    '''
+
+    def __init__(self, wid: int, envs: List):
+        super().__init__(name=f'rls-env-worker-{wid}', daemon=True)
+        self.wid = wid
+        self.envs = envs
+        self.commands = queue.SimpleQueue()
+        self.results = queue.SimpleQueue()
+
+    def run(self) -> NoReturn:
+        while True:
+            cmd = self.commands.get()
+            if cmd is None:
+                return
+            seq, op, idxs, args = cmd
+            try:
+                ret = [_execute(self.envs[j], op, None if args is None else args[k]) for k, j in enumerate(idxs)]
+            except Exception as e:
+                ret = e
+            self.results.put((seq, ret))
+
+
+class EnvPool(object):
+    '''
+    environments hosted by `worker_num` persistent threads, environment i belongs to worker i * worker_num // n.
+    every operation costs one command per involved worker and one wait for their results.
+    send() returns at once, so that several operations on different environments could be in flight, recv() collects them.
+    '''
 
-    def __init__(self, func, args=()):
-        super().__init__()
-        self.func = func
-        self.args = args
+    def __init__(self, envs: List, worker_num: int = 0):
+        self.envs = envs
+        self.n = len(envs)
+        self.worker_num = min(worker_num or os.cpu_count() or 1, self.n)
+        owner = np.arange(self.n) * self.worker_num // self.n
+        self._owner = owner.tolist()
+        self._local = (np.arange(self.n) - np.searchsorted(owner, owner)).tolist()   # index of every env inside its worker
+        self.workers = [EnvWorker(w, [envs[i] for i in np.where(owner == w)[0]]) for w in range(self.worker_num)]
+        for worker in self.workers:
+            worker.start()
+        self._all = self._group(range(self.n))
+        self._seq = 0
+        self._stash = {}    # (worker id, sequence number) => results that arrived before the ones being waited for
 
-    def run(self):
-        self.result = self.func(*self.args)
+    def __len__(self) -> int:
+        return self.n
 
-    def get_result(self):
-        try:
-            return self.result
-        except Exception:
-            return None
+    def _group(self, idxs) -> Dict[int, List[List[int]]]:
+        '''
+        worker id => [local indexes, positions in idxs]
+        '''
+        groups = {}
+        for p, i in enumerate(idxs):
+            local, pos = groups.setdefault(self._owner[i], [[], []])
+            local.append(self._local[i])
+            pos.append(p)
+        return groups
 
+    def send(self, op: OP, args: Optional[List] = None, idxs: Optional[List[int]] = None) -> Tuple:
+        groups = self._all if idxs is None else self._group(idxs)
+        self._seq += 1
+        for w, (local, pos) in groups.items():
+            self.workers[w].commands.put((self._seq, op, local, None if args is None else [args[p] for p in pos]))
+        return self._seq, groups, (self.n if idxs is None else len(idxs))
 
-def init_envs(func, config, n, seed):
+    def _result(self, w: int, seq: int) -> Any:
+        if (w, seq) in self._stash:
+            return self._stash.pop((w, seq))
+        while True:
+            _seq, ret = self.workers[w].results.get()
+            if _seq == seq:
+                return ret
+            self._stash[(w, _seq)] = ret
+
+    def recv(self, handle: Tuple) -> List:
+        seq, groups, num = handle
+        out = [None] * num
+        error = None
+        for w, (_, pos) in groups.items():
+            ret = self._result(w, seq)
+            if isinstance(ret, Exception):
+                error = ret
+                continue
+            for p, r in zip(pos, ret):
+                out[p] = r
+        if error is not None:
+            raise error
+        return out
+
+    def run(self, op: OP, args: Optional[List] = None, idxs: Optional[List[int]] = None) -> List:
+        return self.recv(self.send(op, args, idxs))
+
+    def close(self) -> NoReturn:
+        self.run(OP.CLOSE)
+        for worker in self.workers:
+            worker.commands.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def __deepcopy__(self, memo):
+        from copy import deepcopy
+        return EnvPool(deepcopy(self.envs, memo), self.worker_num)
+
+
+def init_envs(func, config, n, seed, worker_num=0):
     envs = [func(config) for _ in range(n)]
     seeds = [seed + i for i in range(n)]  # [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
     [env.seed(s) for env, s in zip(envs, seeds)]
-    return envs
-
-
-def op_func(envs, op: OP, _args=None):
-    threadpool = []
-    for i, env in enumerate(envs):
-        if op == OP.RESET:
-            th = FakeMultiThread(env.reset, args=())
-        elif op == OP.STEP:
-            th = FakeMultiThread(env.step, args=(_args[i],))
-        elif op == OP.CLOSE:
-            th = FakeMultiThread(env.close, args=())
-        elif op == OP.RENDER:
-            render(envs, _args)
-            return
-        elif op == OP.SAMPLE:
-            th = FakeMultiThread(env.action_sample, args=())
-        threadpool.append(th)
-    for th in threadpool:
-        th.start()
-    for th in threadpool:
-        threading.Thread.join(th)
-    return [threadpool[i].get_result() for i in range(len(envs))]
-
-
-def render(envs, record):
+    return EnvPool(envs, worker_num)
+
+
+def op_send(envs: EnvPool, op: OP, _args=None, idxs=None):
+    '''
+    start an operation without waiting for it, only OP.RESET, OP.STEP and OP.SAMPLE.
+    inputs:
+        envs: environments created by init_envs
+        _args: actions for OP.STEP, one per selected environment
+        idxs: indexes of environments that execute this operation, all environments if None
+    return:
+        handle to be passed to op_recv
+    '''
+    return op, envs.send(op, _args, idxs)
+
+
+def op_recv(envs: EnvPool, handle):
+    '''
+    wait for an operation started by op_send.
+    return:
+        OP.RESET: batched observations
+        OP.STEP: batched observations, rewards, dones, list of infos and batched observations where finished environments
+            are replaced by the first observations of their new episodes
+        OP.SAMPLE: list of random actions
+    '''
+    op, handle = handle
+    results = envs.recv(handle)
+    if op == OP.RESET:
+        return np.asarray(results)
+    if op == OP.STEP:
+        return batch_step_results(results)
+    return results
+
+
+def batch_step_results(results: List[Tuple]) -> Tuple:
+    '''
+    [(obs, reward, done, info, reset obs or None), ...] => obs, reward, done, info, correct_new_obs
+    '''
+    obs, reward, done, info, reset_obs = zip(*results)
+    obs = np.asarray(obs)
+    done = np.asarray(done)
+    dones_index = np.where(done)[0]
+    if dones_index.shape[0] > 0:
+        correct_new_obs = obs.copy()
+        correct_new_obs[dones_index] = np.asarray([reset_obs[i] for i in dones_index])
+    else:
+        correct_new_obs = obs
+    return obs, np.asarray(reward), done, list(info), correct_new_obs
+
+
+def op_func(envs: EnvPool, op: OP, _args=None, idxs=None):
+    '''
+    execute an operation and wait for it, see op_send and op_recv.
+    _args is whether to record videos for OP.RENDER
+    '''
+    if op == OP.RENDER:
+        ids = list(idxs if idxs is not None else range(envs.n))
+        render([envs.envs[i] for i in ids], _args, ids)
+        return None
+    if op == OP.CLOSE:
+        return envs.close()
+    return op_recv(envs, op_send(envs, op, _args, idxs))
+
+
+def render(envs, record, ids=None):
+    '''
+    ids: global indexes of envs, used to name their videos
+    '''
     if record:
-        [env.render(filename=r'videos/{0}-{1}.mp4'.format(env.env.spec.id, i)) for i, env in enumerate(envs)]
+        [env.render(filename=r'videos/{0}-{1}.mp4'.format(env.env.spec.id, i)) for i, env in zip(ids or range(len(envs)), envs)]
     else:
         [env.render() for env in envs]
+
+
+if __name__ == "__main__":
+    import time
+
+    class TrivialEnv:
+        def seed(self, s):
+            pass
+
+        def reset(self):
+            return np.zeros(4, dtype=np.float32)
+
+        def step(self, action):
+            return np.zeros(4, dtype=np.float32), 0., False, {}
+
+        def close(self):
+            pass
+
+    n, steps = 64, 500
+    actions = np.zeros(n)
+    for worker_num in [1, 4, n]:
+        envs = init_envs(lambda config: TrivialEnv(), {}, n, 0, worker_num)
+        op_func(envs, OP.RESET)
+        t = time.perf_counter()
+        for _ in range(steps):
+            op_func(envs, OP.STEP, actions)
+        print(f'{n} envs, {worker_num:2d} workers: {(time.perf_counter() - t) / steps * 1e6:8.1f} us per step')
+        op_func(envs, OP.CLOSE)
@@ -33,24 +33,32 @@ def get_env_type(env_id):
     return env_type
 
 
-def make_atari(env, config: Dict):
+def load_atari_config() -> Dict:
+    from rls.common.yaml_ops import load_yaml
+    return load_yaml(f'{os.path.dirname(__file__)}/config.yaml')['atari']
+
+
+def make_atari(env, config: Dict, batch_preprocess: bool = False):
     max_episode_steps = config.get('max_episode_steps', None)
     env = NoopResetEnv(env, noop_max=int(config.get('noop_max', 30)))
     env = MaxAndSkipEnv(env, skip=int(config.get('skip', 4)))
     if max_episode_steps is not None:
         env = TimeLimit(env, max_episode_steps=int(max_episode_steps))
 
-    env = wrap_deepmind(env, config)
+    env = wrap_deepmind(env, config, batch_preprocess)
     return env
 
 
-def wrap_deepmind(env, config: Dict):
+def wrap_deepmind(env, config: Dict, batch_preprocess: bool = False):
     """Configure environment for DeepMind-style Atari.
+    observations and rewards are left as they are if batch_preprocess, see preprocess_config.
     """
     if bool(config.get('episode_life', True)):
         env = EpisodicLifeEnv(env)
     if 'FIRE' in env.unwrapped.get_action_meanings():
         env = FireResetEnv(env)
+    if batch_preprocess:
+        return env
     env = GrayResizeEnv(env, resize=bool(config.get('resize', True)), grayscale=bool(config.get('grayscale', True)),
                         width=int(config.get('width', 84)), height=int(config.get('height', 84)))
     if bool(config.get('scale', False)):
@@ -62,6 +70,25 @@ def wrap_deepmind(env, config: Dict):
     return env
 
 
+def preprocess_config(config: Dict) -> Dict:
+    '''
+    arguments of rls.envs.gym_wrapper.preprocess.BatchPreprocessor, which does the same as the observation and reward wrappers
+    that build_env skips when batch_preprocess is true.
+    '''
+    if get_env_type(config['env_name']) == 'atari':
+        atari_config = load_atari_config()
+        return dict(grayscale=bool(atari_config.get('grayscale', True)),
+                    resize=[int(atari_config.get('width', 84)), int(atari_config.get('height', 84))] if bool(atari_config.get('resize', True)) else None,
+                    scale=bool(atari_config.get('scale', False)),
+                    stack=int(atari_config.get('stack', 4)) if bool(atari_config.get('frame_stack', True)) else 1,
+                    clip_rewards=bool(atari_config.get('clip_rewards', True)))
+    return dict(grayscale=bool(config.get('obs_grayscale', False)),
+                resize=config.get('resize', [84, 84]) if bool(config.get('obs_resize', False)) else None,
+                scale=bool(config.get('obs_scale', False)),
+                stack=int(config.get('stack', 4)) if bool(config.get('obs_stack', False)) else 1,
+                clip_rewards=False)
+
+
 def build_env(config: Dict):
     gym_env_name = config['env_name']
     action_skip = bool(config.get('action_skip', False))
@@ -76,6 +103,7 @@ def build_env(config: Dict):
     resize = config.get('resize', [84, 84])
     obs_scale = bool(config.get('obs_scale', False))
     max_episode_steps = config.get('max_episode_steps', None)
+    batch_preprocess = bool(config.get('batch_preprocess', False))
 
     env_type = get_env_type(gym_env_name)
     env = gym.make(gym_env_name)
@@ -83,10 +111,7 @@ def build_env(config: Dict):
 
     if env_type == 'atari':
         assert 'NoFrameskip' in env.spec.id
-        from rls.common.yaml_ops import load_yaml
-
-        default_config = load_yaml(f'{os.path.dirname(__file__)}/config.yaml')['atari']
-        env = make_atari(env, default_config)
+        env = make_atari(env, load_atari_config(), batch_preprocess)
     else:
         if gym_env_name.split('-')[0] == 'MiniGrid':
             env = gym_minigrid.wrappers.RGBImgPartialObsWrapper(env)  # Get pixel observations, or RGBImgObsWrapper
@@ -95,7 +120,10 @@ def build_env(config: Dict):
             env = NoopResetEnv(env, noop_max=noop_max)
         if action_skip:
             env = MaxAndSkipEnv(env, skip=4)
-        if isinstance(env.observation_space, Box):
+        if batch_preprocess:
+            if not isinstance(env.observation_space, Box):
+                env = OneHotObsEnv(env)
+        elif isinstance(env.observation_space, Box):
             if len(env.observation_space.shape) == 3:
                 if obs_grayscale or obs_resize:
                     env = GrayResizeEnv(env, resize=obs_resize, grayscale=obs_grayscale, width=resize[0], height=resize[-1])
@@ -110,6 +138,6 @@ def build_env(config: Dict):
     if isinstance(env.action_space, Box) and len(env.action_space.shape) == 1:
         env = BoxActEnv(env)
 
-    if not (isinstance(env.observation_space, Box) and len(env.observation_space.shape) == 3):
+    if not batch_preprocess and not (isinstance(env.observation_space, Box) and len(env.observation_space.shape) == 3):
         env = DtypeEnv(env)
     return env
@@ -21,13 +21,12 @@ except:
 
 import numpy as np
 
-from collections import deque
 from gym.spaces import \
     Box, \
     Discrete, \
     Tuple
 
-from rls.utils.LazyFrames import LazyFrames
+from rls.utils.frame_ring import FrameRing
 
 
 class BaseEnv(gym.Wrapper):
@@ -162,7 +161,7 @@ class StackEnv(gym.Wrapper):
     def __init__(self, env, stack=4):
         super().__init__(env)
         self._stack = stack
-        self.obss = deque([], maxlen=self._stack)
+        self._ring = None   # frames of the current episode, FrameRing of one env, created at the first reset
         assert isinstance(env.observation_space, Box)
         if len(env.observation_space.shape) == 1 or len(env.observation_space.shape) == 3:
             low = np.tile(env.observation_space.low, stack)
@@ -172,15 +171,16 @@ class StackEnv(gym.Wrapper):
                                      dtype=env.observation_space.dtype)
 
     def reset(self, **kwargs):
-        obs = self.env.reset(**kwargs)
-        for _ in range(self._stack):
-            self.obss.append(obs)
-        return LazyFrames(list(self.obss))
+        obs = np.asarray(self.env.reset(**kwargs))
+        if self._ring is None:
+            self._ring = FrameRing(1, self._stack, obs.shape, obs.dtype)
+        self._ring.fill(obs[np.newaxis])
+        return self._ring.stacked()[0]
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
-        self.obss.append(obs)
-        return LazyFrames(list(self.obss)), reward, done, info
+        self._ring.push(np.asarray(obs)[np.newaxis])
+        return self._ring.stacked()[0], reward, done, info
 
 
 class OneHotObsEnv(gym.ObservationWrapper):
@@ -14,22 +14,56 @@ from rls.utils.np_utils import \
 class DataBuffer(object):
     '''
     On-policy 算法的经验池
+    Every key is kept in a typed [capacity, n_agents, ...] array that is allocated on the first add and doubled when an episode outgrows it,
+    so that adding a step is one row assignment per key, derived columns are written in place, and sampling only takes views of the filled rows.
     '''
 
-    def __init__(self, dict_keys=['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done'], n_agents=1):
+    def __init__(self, dict_keys=['s', 'visual_s', 'a', 'r', 's_', 'visual_s_', 'done'], n_agents=1, capacity=128):
         assert n_agents > 0
+        assert capacity > 0
         self.dict_keys = dict_keys
-        self.buffer = dict([
-            [n, []] for n in dict_keys
-        ])
         self.n_agents = n_agents
+        self.capacity = capacity
+        self._columns = {}  # key => [capacity, n_agents, ...]
         self.eps_len = 0
 
+    @property
+    def buffer(self):
+        '''
+        views of filled steps, key => [eps_len, n_agents, ...]
+        '''
+        return {k: col[:self.eps_len] for k, col in self._columns.items()}
+
+    def _grow(self):
+        self.capacity *= 2
+        for k, col in self._columns.items():
+            new = np.empty((self.capacity, *col.shape[1:]), dtype=col.dtype)
+            new[:self.eps_len] = col[:self.eps_len]
+            self._columns[k] = new
+
+    def _put(self, key, data):
+        '''
+        write [eps_len, n_agents, ...] into the column of `key`, the column is (re)allocated if it does not fit
+        '''
+        data = np.asarray(data)
+        col = self._columns.get(key)
+        if col is None or col.shape[1:] != data.shape[1:] or col.dtype != data.dtype:
+            col = self._columns[key] = np.empty((self.capacity, *data.shape[1:]), dtype=data.dtype)
+        col[:self.eps_len] = data
+
     def add(self, *args):
         '''
         添加数据
         '''
-        [self.buffer[k].append(arg) for k, arg in zip(self.dict_keys, args)]
+        if self.eps_len == self.capacity:
+            self._grow()
+        t = self.eps_len
+        for k, arg in zip(self.dict_keys, args):
+            arg = np.asarray(arg)
+            col = self._columns.get(k)
+            if col is None or (t == 0 and (col.shape[1:] != arg.shape or col.dtype != arg.dtype)):
+                col = self._columns[k] = np.empty((self.capacity, *arg.shape), dtype=arg.dtype)
+            col[t] = arg
         self.eps_len += 1
 
     def cal_dc_r(self, gamma, init_value, normalize=False):
@@ -38,17 +72,17 @@ class DataBuffer(object):
         param gamma: 折扣因子 gamma \in [0, 1)
         param init_value: 序列最后状态的值
         '''
-        dc_r = discounted_sum(self.buffer['r'], gamma, init_value, self.buffer['done'])
+        dc_r = discounted_sum(self['r'], gamma, init_value, self['done'])
         if normalize:
             dc_r -= np.mean(dc_r)
             dc_r /= np.std(dc_r)
-        self.buffer['discounted_reward'] = list(dc_r)
+        self._put('discounted_reward', dc_r)
 
     def cal_tr(self, init_value):
         '''
         计算总奖励
         '''
-        self.buffer['total_reward'] = self.cal_dc_r(1., init_value)
+        self._put('total_reward', discounted_sum(self['r'], 1., init_value, self['done']))
 
     def cal_td_error(self, gamma, init_value):
         '''
@@ -56,13 +90,13 @@ class DataBuffer(object):
         TD = r + gamma * (1- done) * v(s') - v(s)
         '''
         assert 'value' in self.buffer.keys()
-        self.buffer['td_error'] = discounted_sum_minus(
-            self.buffer['r'],
+        self._put('td_error', discounted_sum_minus(
+            self['r'],
             gamma,
             init_value,
-            self.buffer['done'],
-            self.buffer['value']
-        )
+            self['done'],
+            self['value']
+        ))
 
     def cal_gae_adv(self, lambda_, gamma):
         '''
@@ -70,27 +104,27 @@ class DataBuffer(object):
         adv = td(s) + gamma * lambda * (1 - done) * td(s')
         '''
         assert 'td_error' in self.buffer.keys()
-        adv = np.asarray(discounted_sum(
-            self.buffer['td_error'],
+        adv = discounted_sum(
+            self['td_error'],
             lambda_ * gamma,
             0,
-            self.buffer['done']
-        ))
-        self.buffer['gae_adv'] = list(standardization(adv))
+            self['done']
+        )
+        self._put('gae_adv', standardization(adv))
 
     def last_s(self):
         '''
         获取序列末尾的状态，即s_[-1]
         '''
         assert 's_' in self.buffer.keys()
-        return self.buffer['s_'][-1]
+        return self['s_'][-1]
 
     def last_visual_s(self):
         '''
         获取序列末尾的图像，即visual_s_[-1]
         '''
         assert 'visual_s_' in self.buffer.keys()
-        return self.buffer['visual_s_'][-1]
+        return self['visual_s_'][-1]
 
     def sample_generater(self, batch_size, keys=None):
         '''
@@ -103,11 +137,24 @@ class DataBuffer(object):
             sampled data.
         '''
         keys = keys or self.buffer.keys()
-        keys_shape = self.calculate_dim_before_sample(keys)
-        all_data = [np.vstack(self.buffer[k]).reshape(self.eps_len * self.n_agents, *keys_shape[k]).astype(np.float32) for k in keys]
+        all_data = self._flatten(keys)
         for i in range(0, self.eps_len * self.n_agents, batch_size * self.n_agents):
             yield [data[i:i + batch_size] for data in all_data]
 
+    def get_flatten_data(self, keys=None):
+        '''
+        the whole rollout at once, every column shaped [eps_len * n_agents, ...], i.e. to be converted to tensors only once and
+        shuffled into minibatches on device.
+        '''
+        return self._flatten(keys or self.buffer.keys())
+
+    def _flatten(self, keys):
+        '''
+        [eps_len, n_agents, ...] => [eps_len * n_agents, ...], float32 columns are reshaped without copying
+        '''
+        keys_shape = self.calculate_dim_before_sample(keys)
+        return [self[k].reshape(self.eps_len * self.n_agents, *keys_shape[k]).astype(np.float32, copy=False) for k in keys]
+
     def sample_generater_rnn(self, time_step, keys=None):
         '''
         create rnn sampling data iterator.
@@ -122,7 +169,7 @@ class DataBuffer(object):
         '''
         keys = keys or self.buffer.keys()
         keys_shape = self.calculate_dim_before_sample(keys)
-        all_data = [np.vstack(self.buffer[k]).reshape(self.eps_len, self.n_agents, -1).astype(np.float32) for k in keys]
+        all_data = [self[k].reshape(self.eps_len, self.n_agents, -1).astype(np.float32, copy=False) for k in keys]
         all_data = [np.transpose(data, (1, 0, 2)) for data in all_data]
         all_data = [np.reshape(data, (self.n_agents, self.eps_len, *keys_shape[k])) if k in ['s', 's_', 'visual_s', 'visual_s_']
                     else np.reshape(data, (self.n_agents * self.eps_len, *keys_shape[k]))
@@ -139,45 +186,44 @@ class DataBuffer(object):
         for k in keys:
             if k not in self.buffer.keys():
                 raise Exception('Buffer does not has key {k}.')
-        keys_shape = self.calculate_dim_before_sample(keys)
-        all_data = [np.vstack(self.buffer[k]).reshape(self.eps_len * self.n_agents, *keys_shape[k]).astype(np.float32) for k in keys]
-        return all_data
+        return self._flatten(keys)
 
     def convert_action2one_hot(self, a_counts):
         '''
         用于在训练前将buffer中的离散动作的索引转换为one_hot类型
         '''
         if 'a' in self.buffer.keys():
-            self.buffer['a'] = [int2one_hot(a.astype(np.int32), a_counts) for a in self.buffer['a']]
+            self._put('a', int2one_hot(self['a'].astype(np.int32), a_counts).reshape(self.eps_len, self.n_agents, a_counts))
 
     def clear(self):
         '''
         清空临时存储经验池
         '''
-        self.eps_len = 0
-        for k in self.buffer.keys():
-            self.buffer[k].clear()
+        self.eps_len = 0    # columns are kept and overwritten by the next episode
 
     def __getattr__(self, name):
         '''
         TODO: Annotation
         '''
-        return self.buffer[name]
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
 
     def __getitem__(self, name):
         '''
         TODO: Annotation
         '''
-        return self.buffer[name]
+        return self._columns[name][:self.eps_len]
 
     def normalize_vector_obs(self, func):
         '''
         TODO: Annotation
         '''
-        if 's' in self.buffer.keys():
-            self.buffer['s'] = [func(s) for s in self.buffer['s']]
-        if 's_' in self.buffer.keys():
-            self.buffer['s_'] = [func(s) for s in self.buffer['s_']]
+        for k in ['s', 's_']:
+            if k in self.buffer.keys():
+                if not np.issubdtype(self._columns[k].dtype, np.floating):    # i.e. observations of Discrete spaces, normalized values would be truncated
+                    self._put(k, self[k].astype(np.float32))
+                self[k][:] = func(self[k])
 
     def calculate_dim_before_sample(self, keys=None):
         '''
@@ -192,5 +238,5 @@ class DataBuffer(object):
             keys_shape: a dict that include all dimension info of each key in data buffer
         '''
         keys = keys or self.buffer.keys()
-        keys_shape = {k: self.buffer[k][0].shape[1:] if len(self.buffer[k][0].shape[1:]) > 0 else (-1,) for k in keys}
+        keys_shape = {k: self._columns[k].shape[2:] if len(self._columns[k].shape[2:]) > 0 else (-1,) for k in keys}
         return keys_shape
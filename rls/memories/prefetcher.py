@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import logging
+import threading
+
+from typing import \
+    Any, \
+    Callable, \
+    NoReturn
+
+logger = logging.getLogger("rls.memories.prefetcher")
+
+
+class Prefetcher(object):
+    '''
+    Keeps up to `capacity` ready batches in a bounded queue, filled by a daemon worker thread that calls `produce` repeatedly,
+    so that assembling the next batches overlaps with training on the current one.
+    `produce` must be safe to call concurrently with the thread that consumes batches, i.e. guard the replay buffer with a lock.
+    '''
+
+    _STOP = object()
+
+    def __init__(self, produce: Callable[[], Any], capacity: int = 2):
+        assert capacity > 0, 'capacity of prefetcher must larger than zero'
+        self._produce = produce
+        self._queue = queue.Queue(maxsize=capacity)
+        self._stop = threading.Event()
+        self._error = None
+        self.last_wait_time = 0.    # seconds that the last get() blocked
+        self._thread = threading.Thread(target=self._worker, name='rls-prefetcher', daemon=True)
+        self._thread.start()
+
+    def _worker(self) -> NoReturn:
+        while not self._stop.is_set():
+            try:
+                item = self._produce()
+            except Exception as e:
+                logger.exception('prefetching failed.')
+                self._error = e
+                item = self._STOP
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if item is self._STOP:
+                return
+
+    def get(self) -> Any:
+        start = time.perf_counter()
+        item = self._queue.get()
+        self.last_wait_time = time.perf_counter() - start
+        if item is self._STOP:
+            self._queue.put(item)   # keep failing for later calls
+            raise RuntimeError('prefetching worker stopped.') from self._error
+        return item
+
+    @property
+    def depth(self) -> int:
+        '''
+        number of ready batches
+        '''
+        return self._queue.qsize()
+
+    def close(self) -> NoReturn:
+        self._stop.set()
+        self._thread.join()
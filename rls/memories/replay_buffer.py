@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import copy
+import threading
+import multiprocessing
 import numpy as np
-import tensorflow as tf
 
 from abc import ABC, abstractmethod
 from typing import \
     Any, \
+    Dict, \
     NoReturn, \
     Union, \
     List, \
     Tuple, \
     Optional
 
-from rls.memories.sum_tree import Sum_Tree
+from rls.memories.sum_tree import \
+    Sum_Tree, \
+    Min_Tree, \
+    Max_Tree
+from rls.memories.storage import \
+    make_storage, \
+    MemmapStorage, \
+    SharedMemoryStorage, \
+    TrajectoryStorage
+from rls.memories.sampler import uniform_sample_index
+from rls.memories.snapshot import Snapshot
+from rls.utils.shared_arrays import SharedArrays
 
 # [s, visual_s, a, r, s_, visual_s_, done] must be this format.
 
@@ -42,23 +56,61 @@ class ReplayBuffer(ABC):
     def update(self, *args) -> Any:
         pass
 
+    def save(self, path: str) -> NoReturn:
+        '''
+        snapshot the buffer into `path`, repeated saves into the same path only rewrite chunks that changed, see Snapshot.
+        '''
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is None or snapshot.path != path:
+            snapshot = self._snapshot = Snapshot(path)
+        self._save(snapshot)
+        snapshot.commit()
+
+    def load(self, path: str) -> bool:
+        '''
+        restore the buffer from a snapshot in `path`
+        return: whether a snapshot exists
+        '''
+        snapshot = Snapshot(path)
+        if not snapshot.exists:
+            return False
+        snapshot.read()
+        self._load(snapshot)
+        self._snapshot = snapshot
+        return True
+
+    @abstractmethod
+    def _save(self, snapshot: Snapshot) -> NoReturn:
+        pass
+
+    @abstractmethod
+    def _load(self, snapshot: Snapshot) -> NoReturn:
+        pass
+
 
 class ExperienceReplay(ReplayBuffer):
     def __init__(self,
                  batch_size: int,
-                 capacity: int):
+                 capacity: int,
+                 storage: str = 'object'):
+        '''
+        inputs:
+            storage: 'object' stores every transition as a python list, 'columnar' stores one typed, preallocated array per field.
+        '''
         super().__init__(batch_size, capacity)
         self._data_pointer = 0
-        self._buffer = np.empty(capacity, dtype=object)
+        self._buffer = make_storage(storage, capacity)
 
     def add(self, *args) -> NoReturn:
         '''
-        change [s, s],[a, a],[r, r] to [s, a, r],[s, a, r] and store every item in it.
+        args: [ss, visual_ss, as, rs, s_s, visual_s_s, dones, ...], write the whole batch into the storage at once.
         '''
-        [self._store_op(data) for data in zip(*args)]
+        num = len(args[0])
+        self._buffer.put(self._data_pointer, *args)
+        self.update_rb_after_add(num)
 
     def _store_op(self, data: Union[List, np.ndarray]) -> NoReturn:
-        self._buffer[self._data_pointer] = data
+        self._buffer.put(self._data_pointer, *[np.asarray(d)[np.newaxis] for d in data])
         self.update_rb_after_add()
 
     def sample(self) -> List[np.ndarray]:
@@ -66,18 +118,24 @@ class ExperienceReplay(ReplayBuffer):
         change [[s, a, r],[s, a, r]] to [[s, s],[a, a],[r, r]]
         '''
         n_sample = self.batch_size if self.is_lg_batch_size else self._size
-        t = np.random.choice(self._buffer[:self._size], size=n_sample, replace=False)
-        return [np.asarray(e) for e in zip(*t)]
+        idxs = uniform_sample_index(self._size, n_sample)
+        return self._buffer.get(idxs)
 
     def get_all(self) -> List[np.ndarray]:
-        return [np.asarray(e) for e in zip(*self._buffer[:self._size])]
+        return self._buffer.get(np.arange(self._size))
+
+    def update_rb_after_add(self, num: int = 1) -> NoReturn:
+        self._data_pointer = (self._data_pointer + num) % self.capacity  # replace when exceed the capacity
+        self._size = min(self._size + num, self.capacity)
+
+    def _save(self, snapshot: Snapshot) -> NoReturn:
+        self._buffer.save(snapshot, 'storage')
+        snapshot.state.update(data_pointer=self._data_pointer, size=self._size)
 
-    def update_rb_after_add(self) -> NoReturn:
-        self._data_pointer += 1
-        if self._data_pointer >= self.capacity:  # replace when exceed the capacity
-            self._data_pointer = 0
-        if self._size < self.capacity:
-            self._size += 1
+    def _load(self, snapshot: Snapshot) -> NoReturn:
+        self._buffer.load(snapshot, 'storage')
+        self._data_pointer = snapshot.state['data_pointer']
+        self._size = snapshot.state['size']
 
     @property
     def is_full(self) -> bool:
@@ -91,16 +149,15 @@ class ExperienceReplay(ReplayBuffer):
     def is_lg_batch_size(self) -> bool:
         return self._size > self.batch_size
 
-    @property
     def show_rb(self) -> NoReturn:
         print('RB size: ', self._size)
         print('RB capacity: ', self.capacity)
-        print(self._buffer[:, np.newaxis])
+        print(self._buffer)
 
 
 class PrioritizedExperienceReplay(ReplayBuffer):
     '''
-    This PER will introduce some bias, 'cause when the experience with the minimum probability has been collected, the min_p that be updated may become inaccuracy.
+    A min-tree and a max-tree are maintained alongside the sum-tree, so that min_p and max_p stay exact after low or high priority experiences are overwritten.
     '''
 
     def __init__(self,
@@ -110,14 +167,16 @@ class PrioritizedExperienceReplay(ReplayBuffer):
                  alpha: float,
                  beta: float,
                  epsilon: float,
-                 global_v: bool):
+                 global_v: bool,
+                 storage: str = 'object'):
         '''
         inputs:
             max_train_step: use for calculating the decay interval of beta
             alpha: control sampling rule, alpha -> 0 means uniform sampling, alpha -> 1 means complete td_error sampling
             beta: control importance sampling ratio, beta -> 0 means no IS, beta -> 1 means complete IS.
             epsilon: a small positive number that prevents td-error of 0 from never being replayed.
-            global_v: whether using the global
+            global_v: whether using the global minimum priority or the minimum priority of the batch to normalize IS weights
+            storage: where the payloads live, the sum tree itself only keeps priorities of slot ids.
         '''
         assert epsilon > 0, 'episode must larger than zero'
         super().__init__(batch_size, capacity)
@@ -125,29 +184,38 @@ class PrioritizedExperienceReplay(ReplayBuffer):
         self.beta = beta
         self.beta_interval = (1 - beta) / max_train_step
         self.tree = Sum_Tree(capacity)
+        self.min_tree = Min_Tree(capacity)
+        self.max_tree = Max_Tree(capacity)
+        self._buffer = make_storage(storage, capacity)
         self.epsilon = epsilon
         self.IS_w = 1   # weights of variables by using Importance Sampling
-        self.min_p = 1
-        self.max_p = epsilon
         self.global_v = global_v
 
+    @property
+    def min_p(self) -> float:
+        return self.min_tree.min
+
+    @property
+    def max_p(self) -> float:
+        '''
+        priority of new experiences, the maximum priority in the buffer
+        '''
+        return self.max_tree.max if self._size > 0 else self.epsilon
+
     def add(self, *args) -> NoReturn:
         '''
         input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones]
         '''
-        self.add_batch(list(zip(*args)))
-        # [self._store_op(data) for data in zip(*args)]
+        num = len(args[0])
+        p = np.full(num, self.max_p)
+        self._buffer.put(self.tree.now, *args)
+        idxs = self.tree.add_batch(p)
+        self.min_tree.update(idxs, p)
+        self.max_tree.update(idxs, p)
+        self._size = min(self._size + num, self.capacity)
 
     def _store_op(self, data: Union[List, np.ndarray]) -> NoReturn:
-        self.tree.add(self.max_p, data)
-        if self._size < self.capacity:
-            self._size += 1
-
-    def add_batch(self, data: List) -> NoReturn:
-        data = list(data)
-        num = len(data)
-        self.tree.add_batch(np.full(num, self.max_p), data)
-        self._size = min(self._size + num, self.capacity)
+        self.add(*[np.asarray(d)[np.newaxis] for d in data])
 
     def sample(self, return_index: bool = False) -> Union[List, Tuple]:
         '''
@@ -156,7 +224,8 @@ class PrioritizedExperienceReplay(ReplayBuffer):
         n_sample = self.batch_size if self.is_lg_batch_size else self._size
         all_intervals = np.linspace(0, self.tree.total, n_sample + 1)
         ps = np.random.uniform(all_intervals[:-1], all_intervals[1:])
-        idxs, data_indx, p, data = self.tree.get_batch_parallel(ps)
+        idxs, p = self.tree.get_batch_parallel(ps)
+        data = self._buffer.get(idxs)
         self.last_indexs = idxs
         _min_p = self.min_p if self.global_v else p.min()
         self.IS_w = np.power(_min_p / p, self.beta)
@@ -165,6 +234,10 @@ class PrioritizedExperienceReplay(ReplayBuffer):
         else:
             return data
 
+    @property
+    def size(self) -> int:
+        return self._size
+
     @property
     def is_lg_batch_size(self) -> bool:
         return self._size > self.batch_size
@@ -181,16 +254,259 @@ class PrioritizedExperienceReplay(ReplayBuffer):
         assert len(priority) == len(idxs), 'length between priority and last_indexs must equal'
         self.beta += self.beta_interval * episode
         priority = np.power(np.abs(priority) + self.epsilon, self.alpha)
-        self.min_p = min(self.min_p, priority.min())
-        self.max_p = max(self.max_p, priority.max())
-        self.tree._updatetree_batch(idxs, priority)
-        # [self.tree._updatetree(idx, p) for idx, p in zip(idxs, priority)]
+        self.tree.update(idxs, priority)
+        self.min_tree.update(idxs, priority)
+        self.max_tree.update(idxs, priority)
 
     def get_IS_w(self) -> np.ndarray:
         return self.IS_w
 
+    def _save(self, snapshot: Snapshot) -> NoReturn:
+        self._buffer.save(snapshot, 'storage')
+        for name in ['tree', 'min_tree', 'max_tree']:
+            snapshot.save_array(name, getattr(self, name).tree)
+        snapshot.state.update(now=int(self.tree.now), size=self._size, beta=self.beta)
+
+    def _load(self, snapshot: Snapshot) -> NoReturn:
+        self._buffer.load(snapshot, 'storage')
+        for name in ['tree', 'min_tree', 'max_tree']:
+            snapshot.load_array(name, out=getattr(self, name).tree)
+        self.tree.now = snapshot.state['now']
+        self._size = snapshot.state['size']
+        self.beta = snapshot.state['beta']
+
+
+class MemmapExperienceReplay(ExperienceReplay):
+    '''
+    ER whose columns are memory-mapped files under `path`, for capacities larger than RAM, i.e. Atari-style visual tasks.
+    '''
+
+    def __init__(self,
+                 batch_size: int,
+                 capacity: int,
+                 path: str,
+                 hot_window: int = 0):
+        '''
+        inputs:
+            path: the directory that stores memory-mapped columns
+            hot_window: how many latest experiences are also kept in memory
+        '''
+        super().__init__(batch_size, capacity, storage=MemmapStorage(capacity, path, hot_window))
+
+
+class MemmapPrioritizedExperienceReplay(PrioritizedExperienceReplay):
+    '''
+    PER whose columns are memory-mapped files under `path`, the sum/min/max trees stay in memory.
+    '''
+
+    def __init__(self,
+                 batch_size: int,
+                 capacity: int,
+                 max_train_step: int,
+                 alpha: float,
+                 beta: float,
+                 epsilon: float,
+                 global_v: bool,
+                 path: str,
+                 hot_window: int = 0):
+        super().__init__(batch_size, capacity, max_train_step, alpha, beta, epsilon, global_v,
+                         storage=MemmapStorage(capacity, path, hot_window))
+
+
+class _SharedState:
+    '''
+    Keeps the write pointer and the size of a buffer in shared memory, so that all processes that hold the buffer agree on them.
+    '''
+
+    def _init_shared_state(self, start_method: Optional[str]) -> NoReturn:
+        self._shared = SharedArrays()
+        self._shared.create('meta', (2,), np.int64, fill=0)  # [data pointer, size]
+        self.lock = multiprocessing.get_context(start_method).RLock()   # must match the start method of the processes that receive the buffer
+
+    @property
+    def _data_pointer(self) -> int:
+        return int(self._shared['meta'][0])
+
+    @_data_pointer.setter
+    def _data_pointer(self, value: int) -> NoReturn:
+        self._shared['meta'][0] = value
+
+    @property
+    def _size(self) -> int:
+        return int(self._shared['meta'][1])
+
+    @_size.setter
+    def _size(self, value: int) -> NoReturn:
+        self._shared['meta'][1] = value
+
+    def close(self) -> NoReturn:
+        '''
+        detach from shared memory, the creating process also releases it.
+        '''
+        self._buffer.close()
+        self._shared.close()
+
+
+class SharedExperienceReplay(_SharedState, ExperienceReplay):
+    '''
+    ER whose columns, pointer and size live in multiprocessing.shared_memory, see SharedMemoryStorage.
+    Pass it to other local processes, i.e. through the arguments of multiprocessing.Process, then every process could add transitions
+    and a learner process samples from the same memory. Every operation holds `lock`, a multiprocessing.RLock.
+    '''
+
+    def __init__(self,
+                 batch_size: int,
+                 capacity: int,
+                 specs: Optional[List[Tuple[tuple, np.dtype]]] = None,
+                 start_method: Optional[str] = None):
+        '''
+        inputs:
+            specs: [(shape, dtype), ...] of [s, visual_s, a, r, s_, visual_s_, done], required if the buffer is shared before the first add
+            start_method: fork, spawn or forkserver, how processes that share the buffer are started, the default one if None
+        '''
+        self._init_shared_state(start_method)
+        super().__init__(batch_size, capacity, storage=SharedMemoryStorage(capacity, specs))
+
+    def add(self, *args) -> NoReturn:
+        with self.lock:
+            super().add(*args)
+
+    def _store_op(self, data: Union[List, np.ndarray]) -> NoReturn:
+        with self.lock:
+            super()._store_op(data)
+
+    def sample(self) -> List[np.ndarray]:
+        with self.lock:
+            return super().sample()
+
+    def get_all(self) -> List[np.ndarray]:
+        with self.lock:
+            return super().get_all()
+
+
+class SharedPrioritizedExperienceReplay(_SharedState, PrioritizedExperienceReplay):
+    '''
+    PER whose columns, pointer, size and sum/min/max trees live in multiprocessing.shared_memory.
+    beta, IS_w and last_indexs stay local to every process, since only the learner samples and updates priorities.
+    '''
+
+    def __init__(self,
+                 batch_size: int,
+                 capacity: int,
+                 max_train_step: int,
+                 alpha: float,
+                 beta: float,
+                 epsilon: float,
+                 global_v: bool,
+                 specs: Optional[List[Tuple[tuple, np.dtype]]] = None,
+                 start_method: Optional[str] = None):
+        self._init_shared_state(start_method)
+        super().__init__(batch_size, capacity, max_train_step, alpha, beta, epsilon, global_v,
+                         storage=SharedMemoryStorage(capacity, specs))
+        for key, tree in self._trees.items():
+            tree.tree = self._shared.create(key, tree.tree.shape, tree.tree.dtype, fill=tree.neutral)
+
+    @property
+    def _trees(self) -> Dict:
+        return {'tree': self.tree, 'min_tree': self.min_tree, 'max_tree': self.max_tree}
+
+    def add(self, *args) -> NoReturn:
+        with self.lock:
+            self.tree.now = self._data_pointer  # other processes may have added since
+            super().add(*args)
+            self._data_pointer = self.tree.now
+
+    def _store_op(self, data: Union[List, np.ndarray]) -> NoReturn:
+        self.add(*[np.asarray(d)[np.newaxis] for d in data])
+
+    def sample(self, return_index: bool = False) -> Union[List, Tuple]:
+        with self.lock:
+            return super().sample(return_index)
+
+    def update(self,
+               priority: Union[List, np.ndarray],
+               episode: int,
+               index: Optional[Union[List, np.ndarray]] = None) -> NoReturn:
+        with self.lock:
+            super().update(priority, episode, index)
+
+    def _save(self, snapshot: Snapshot) -> NoReturn:
+        with self.lock:
+            self.tree.now = self._data_pointer
+            super()._save(snapshot)
+
+    def _load(self, snapshot: Snapshot) -> NoReturn:
+        with self.lock:
+            super()._load(snapshot)
+            self._data_pointer = self.tree.now
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        for key, tree in self._trees.items():   # nodes are attached from shared memory instead of being pickled
+            state[key] = copy.copy(tree)
+            state[key].tree = None
+        return state
+
+    def __setstate__(self, state: Dict) -> NoReturn:
+        self.__dict__.update(state)
+        for key, tree in self._trees.items():
+            tree.tree = self._shared[key]
+
+
+class TrajectoryExperienceReplay(ExperienceReplay):
+    '''
+    ER that stores s_ and visual_s_ by reference to the next step of the same env, see TrajectoryStorage.
+    Every add must contain one transition of each env, so it could not be wrapped by NStepWrapper.
+    '''
+
+    def __init__(self,
+                 batch_size: int,
+                 capacity: int,
+                 agents_num: int,
+                 vector_stack: int = 0,
+                 visual_stack: int = 0,
+                 margin: float = 0.125):
+        '''
+        inputs:
+            agents_num: number of envs
+            vector_stack: how many frames are stacked in one vector observation, 0 means storing s and s_ as they are
+            visual_stack: how many frames are stacked in one visual observation, 0 means storing visual_s and visual_s_ as they are
+            margin: ratio of extra frames that cover the whole observations pushed at episode starts
+        '''
+        pairs = []
+        if vector_stack > 0:
+            pairs.append((0, 4, vector_stack))
+        if visual_stack > 0:
+            pairs.append((1, 5, visual_stack))
+        super().__init__(batch_size, capacity, storage=TrajectoryStorage(capacity, agents_num, pairs, margin))
+
+    @property
+    def packed_pairs(self) -> List[Tuple[int, int, tuple]]:
+        return self._buffer.packed_pairs
+
+    def sample(self, packed: bool = False) -> List[np.ndarray]:
+        '''
+        packed: sample deduplicated observations as the frames shared with their next observations, see TrajectoryStorage.get
+        '''
+        n_sample = self.batch_size if self.is_lg_batch_size else self._size
+        idxs = uniform_sample_index(self._size, n_sample)
+        invalid = ~self._buffer.is_valid(idxs)
+        while invalid.any():    # frames of the oldest transitions may be overwritten when episodes are short, resample them
+            idxs[invalid] = np.random.randint(0, self._size, invalid.sum())
+            invalid[invalid] = ~self._buffer.is_valid(idxs[invalid])
+        return self._buffer.get(idxs, packed=packed)
+
 
 class NStepWrapper:
+    '''
+    Accumulates n-step transitions of all envs in an [n, agents_num, ...] ring with numpy ops,
+    and flushes completed ones into the wrapped buffer with a single batched add.
+    Sequences cut short by done or by truncation, i.e. a new episode that begins without done, are flushed as they are rather than dropped.
+    Fields after done, i.e. options of OC/IOC or cost of PD-DDPG, are carried from the first step of a sequence like the action.
+    done is kept as it is, and a trailing `discount` field holds gamma**k of every flushed transition,
+    where k is the true number of accumulated steps, so that algorithms bootstrap with r + discount * (1 - done) * V.
+    '''
+
     def __init__(self,
                  buffer: ReplayBuffer,
                  gamma: float,
@@ -205,47 +521,62 @@ class NStepWrapper:
         self.n = n
         self.gamma = gamma
         self.agents_num = agents_num
-        self.queue = [[] for _ in range(agents_num)]
+        self._head = 0  # slot of the next step
+        self._queue = None  # s, visual_s, a and fields after done of pending transitions, [n, agents_num, ...]
+        self._ret = np.zeros((n, agents_num, 1))  # discounted rewards accumulated so far
+        self._k = np.zeros((n, agents_num), dtype=np.int64)  # accumulated steps, 0 means the slot is empty
+        self._next = None   # s_, visual_s_, done of the latest step, shared by all pending transitions of an env
 
     def add(self, *args) -> NoReturn:
         '''
-        change [s, s],[a, a],[r, r] to [s, a, r],[s, a, r] and store every item in it.
+        args: [ss, visual_ss, as, rs, s_s, visual_s_s, dones, *others], one transition per env.
         '''
-        [self._per_store(i, list(data)) for i, data in enumerate(zip(*args))]
-
-    def _per_store(self, i: int, data: List) -> NoReturn:
+        args = [np.asarray(x) for x in args]
+        s, visual_s, a, r, s_, visual_s_, done = args[:7]
+        carried = [s, visual_s, a] + args[7:]
+        num = len(s)
+        assert num == self.agents_num, 'every add must contain exactly one transition per env'
+        if self._queue is None:
+            self._queue = [np.empty((self.n, *x.shape), dtype=x.dtype) for x in carried]
+        flushed = []
+
+        if self._next is not None:  # 如果截断了，非常规done，把Nstep临时经验池中已存在的经验按实际步数存进去
+            truncated = (s.reshape(num, -1) != self._next[0].reshape(num, -1)).any(axis=-1) \
+                | (visual_s.reshape(num, -1) != self._next[1].reshape(num, -1)).any(axis=-1)
+            flushed.append(self._pop((self._k > 0) & truncated[np.newaxis]))
+
+        h = self._head
+        for q, x in zip(self._queue, carried):
+            q[h] = x
+        self._ret[h] = 0.
+        self._k[h] = 0
+        pending = self._k > 0
+        pending[h] = True
+        self._ret += np.where(pending[..., np.newaxis], np.power(self.gamma, self._k)[..., np.newaxis] * r.reshape(1, num, 1), 0.)
+        self._k += pending
+        self._next = [np.array(x) for x in [s_, visual_s_, done.reshape(num, 1)]]
+        self._head = (h + 1) % self.n
+
+        # 满n步的经验，以及done的环境中所有的经验
+        flushed.append(self._pop((self._k == self.n) | (pending & self._next[2].astype(bool).any(axis=-1)[np.newaxis])))
+        flushed = [f for f in flushed if f is not None]
+        if flushed:
+            self.buffer.add(*[np.concatenate(x) for x in zip(*flushed)])
+
+    def _pop(self, mask: np.ndarray) -> Optional[List[np.ndarray]]:
         '''
-        data:
-            0   s           -7
-            1   visual_s    -6
-            2   a           -5
-            3   r           -4
-            4   s_          -3
-            5   visual_s_   -2
-            6   done        -1
+        mask: [n, agents_num], pending transitions to flush
+        return: [ss, visual_ss, as, rs, s_s, visual_s_s, dones, *others, discounts] of the flushed transitions, or None
         '''
-        q = self.queue[i]
-        if len(q) == 0:  # 如果Nstep临时经验池为空，就直接添加
-            q.append(data)
-            return
-        if (q[-1][4] != data[0]).any() or (q[-1][5] != data[1]).any():    # 如果截断了，非常规done，把Nstep临时经验池中已存在的经验都存进去，临时经验池清空
-            if len(q) == self.n:
-                self._store_op(q.pop(0))
-            else:
-                q.clear()   # 保证经验池中不存在不足N长度的序列，有done的除外，因为（1-done）为0，导致gamma的次方计算不准确也没有关系。
-            q.append(data)
-            return
-
-        if len(q) == self.n:  # 如果Nstep临时经验池满了，就把最早的一条经验存到经验池
-            self._store_op(q.pop(0))
-        _len = len(q)
-        for j in range(_len):   # 然后再存入一条最新的经验到Nstep临时经验池
-            q[j][3] += data[3] * (self.gamma ** (_len - j))
-            q[j][4:] = data[4:]
-        q.append(data)
-        if data[6]:  # done or not # 如果新数据是done，就清空临时经验池
-            while q:    # (1-done)会清零不正确的n-step
-                self._store_op(q.pop())
+        slot, env = np.where(mask)
+        if len(slot) == 0:
+            return None
+        k = self._k[slot, env]
+        s_, visual_s_, done = [x[env] for x in self._next]
+        s, visual_s, a, *others = [q[slot, env] for q in self._queue]
+        discount = np.power(self.gamma, k)[:, np.newaxis].astype(np.float32)
+        self._k[slot, env] = 0
+        return [s, visual_s, a, self._ret[slot, env], s_, visual_s_, done, *others, discount]
 
     def __getattr__(self, name):
         return getattr(self.buffer, name)
@@ -254,7 +585,7 @@ class NStepWrapper:
 class NStepExperienceReplay(NStepWrapper):
     '''
     Replay Buffer + NStep
-    [s, visual_s, a, r, s_, visual_s_, done] must be this format.
+    [s, visual_s, a, r, s_, visual_s_, done, *others] must be this format, a `discount` field is appended to sampled transitions.
     '''
 
     def __init__(self,
@@ -262,9 +593,10 @@ class NStepExperienceReplay(NStepWrapper):
                  capacity: int,
                  gamma: float,
                  n: int,
-                 agents_num: int):
+                 agents_num: int,
+                 storage: str = 'object'):
         super().__init__(
-            buffer=ExperienceReplay(batch_size, capacity),
+            buffer=ExperienceReplay(batch_size, capacity, storage),
             gamma=gamma, n=n, agents_num=agents_num
         )
 
@@ -272,7 +604,7 @@ class NStepExperienceReplay(NStepWrapper):
 class NStepPrioritizedExperienceReplay(NStepWrapper):
     '''
     PER + NStep
-    [s, visual_s, a, r, s_, visual_s_, done] must be this format.
+    [s, visual_s, a, r, s_, visual_s_, done, *others] must be this format, a `discount` field is appended to sampled transitions.
     '''
 
     def __init__(self,
@@ -285,76 +617,183 @@ class NStepPrioritizedExperienceReplay(NStepWrapper):
                  global_v: bool,
                  gamma: float,
                  n: int,
-                 agents_num: int):
+                 agents_num: int,
+                 storage: str = 'object'):
+        super().__init__(
+            buffer=PrioritizedExperienceReplay(batch_size, capacity, max_train_step, alpha, beta, epsilon, global_v, storage),
+            gamma=gamma, n=n, agents_num=agents_num
+        )
+
+
+class MemmapNStepExperienceReplay(NStepWrapper):
+    '''
+    MemmapER + NStep
+    '''
+
+    def __init__(self,
+                 batch_size: int,
+                 capacity: int,
+                 gamma: float,
+                 n: int,
+                 agents_num: int,
+                 path: str,
+                 hot_window: int = 0):
         super().__init__(
-            buffer=PrioritizedExperienceReplay(batch_size, capacity, max_train_step, alpha, beta, epsilon, global_v),
+            buffer=MemmapExperienceReplay(batch_size, capacity, path, hot_window),
             gamma=gamma, n=n, agents_num=agents_num
         )
 
 
+class MemmapNStepPrioritizedExperienceReplay(NStepWrapper):
+    '''
+    MemmapPER + NStep
+    '''
+
+    def __init__(self,
+                 batch_size: int,
+                 capacity: int,
+                 max_train_step: int,
+                 alpha: float,
+                 beta: float,
+                 epsilon: float,
+                 global_v: bool,
+                 gamma: float,
+                 n: int,
+                 agents_num: int,
+                 path: str,
+                 hot_window: int = 0):
+        super().__init__(
+            buffer=MemmapPrioritizedExperienceReplay(batch_size, capacity, max_train_step, alpha, beta, epsilon, global_v, path, hot_window),
+            gamma=gamma, n=n, agents_num=agents_num
+        )
+
+
+class ThreadSafeWrapper:
+    '''
+    Makes any replay buffer safe to be shared between threads, i.e. a collector thread that adds batches
+    and a learner thread that samples and updates priorities at the same time.
+    Every method call of the wrapped buffer runs under one re-entrant lock, so that a batched add lands atomically and sample
+    never sees a half written transition or a half updated tree. `lock` is exposed for compound operations,
+    i.e. sampling and reading last_indexs/IS_w of PER together.
+    '''
+
+    def __init__(self, buffer: ReplayBuffer):
+        self.buffer = buffer
+        self.lock = threading.RLock()
+
+    def add(self, *args) -> NoReturn:
+        args = [np.asarray(x) for x in args]    # conversion runs outside the lock
+        with self.lock:
+            self.buffer.add(*args)
+
+    def __getattr__(self, name):
+        with self.lock:     # properties, i.e. size and IS_w, are evaluated under the lock as well
+            attr = getattr(self.buffer, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                return attr(*args, **kwargs)
+        return locked
+
+
 class EpisodeExperienceReplay(ReplayBuffer):
+    '''
+    Sequence replay for RNN training.
+    Transitions are written into preallocated, time-major [rows, agents_num, ...] arrays, so that the trajectory of every env is contiguous
+    along the first axis, and the beginning step of the episode is kept for every cell.
+    Ends of valid [burn_in + train] windows are recorded in order when they are written: every step that is at least `timestep` steps
+    into its episode, and the last step of episodes shorter than that. Sampling gathers fixed-length windows with one fancy-index per field,
+    and steps before the beginning of episodes are masked as padding, i.e. zeros and done=1.
+    With store_cell_state, fields after done are the cell states of the actor after every step, and the one right before a window
+    is returned by get_cell_states(), so that training starts from it with a short or even no burn-in.
+    '''
 
     def __init__(self,
                  batch_size: int,
                  capacity: int,
                  agents_num: int,
                  burn_in_time_step: int,
-                 train_time_step: int):
+                 train_time_step: int,
+                 store_cell_state: bool = False):
+        '''
+        inputs:
+            batch_size: number of windows per batch
+            capacity: how many windows of burn_in_time_step + train_time_step steps worth of transitions are kept
+            agents_num: number of envs, every add must contain one transition per env
+            store_cell_state: whether fields after done are cell states of the RNN, i.e. (h, c) of LSTM
+        '''
         super().__init__(batch_size, capacity)
         self.agents_num = agents_num
         self.burn_in_time_step = burn_in_time_step
         self.train_time_step = train_time_step
         self.timestep = burn_in_time_step + train_time_step
-        self.queue = [[] for _ in range(agents_num)]
-        self._data_pointer = 0
-        self._buffer = np.empty(capacity, dtype=object)
+        self.store_cell_state = store_cell_state
+        self.rows = max(int(np.ceil(capacity * self.timestep / agents_num)), self.timestep)
+        self._columns = None    # [rows, agents_num, ...] for every field
+        self._begin = np.zeros((self.rows, agents_num), dtype=np.int64)  # beginning step of the episode of every cell
+        self._t = 0     # steps written
+        self._episode_begin = np.zeros(agents_num, dtype=np.int64)
+        self._ended = np.ones(agents_num, dtype=bool)   # the last step of an env is done
+        self._last = None   # s_, visual_s_ of the last step, used to detect truncation
+        self._ends = np.zeros((self.rows * agents_num, 2), dtype=np.int64)    # (step, env) of window ends, each cell ends at most one window
+        self._ends_tail = 0     # number of window ends ever dropped
+        self._ends_head = 0     # number of window ends ever written
 
     def add(self, *args) -> NoReturn:
         '''
-        change [s, s],[a, a],[r, r] to [s, a, r],[s, a, r] and store every item in it.
+        args: [ss, visual_ss, as, rs, s_s, visual_s_s, dones, ...], one transition per env.
         '''
-        [self._per_store(i, list(data)) for i, data in enumerate(zip(*args))]
+        num = len(args[0])
+        assert num == self.agents_num, 'every add must contain exactly one transition per env'
+        args = [np.asarray(x) for x in args]
+        t = self._t
+        if self._columns is None:
+            self._columns = [np.zeros((self.rows, *x.shape), dtype=x.dtype) for x in args]
+
+        # row t % rows is going to be overwritten, windows that end there are no longer available
+        live = self._ends_head - self._ends_tail
+        if live > 0:
+            steps = self._ends[(self._ends_tail + np.arange(min(live, 2 * num))) % len(self._ends), 0]
+            self._ends_tail += int((steps <= t - self.rows).sum())
+
+        ends = []
+        if self._last is not None:  # 如果截断了，非常规done，短于一个窗口的上一回合作为一个窗口保存
+            mismatch = (args[0].reshape(num, -1) != self._last[0].reshape(num, -1)).any(axis=-1) \
+                | (args[1].reshape(num, -1) != self._last[1].reshape(num, -1)).any(axis=-1)
+            truncated = np.where(mismatch & ~self._ended & (t - self._episode_begin < self.timestep))[0]
+            ends.append(np.stack([np.full_like(truncated, t - 1), truncated], axis=-1))
+            new_episode = self._ended | mismatch
+        else:
+            new_episode = self._ended
+        self._episode_begin[new_episode] = t
 
-    def _per_store(self, i: int, data: List) -> NoReturn:
-        '''
-        data:
-            0   s           -7
-            1   visual_s    -6
-            2   a           -5
-            3   r           -4
-            4   s_          -3
-            5   visual_s_   -2
-            6   done        -1
-            7   other       -
-        '''
-        q = self.queue[i]
-        if len(q) == 0:
-            q.append(data)
-            return
-        if (q[-1][4] != data[0]).any() or (q[-1][5] != data[1]).any():
-            self._store_op(q.copy())
-            q.clear()
-            q.append(data)
-            return
-        if data[6]:
-            q.append(data)
-            self._store_op(q.copy())
-            q.clear()
-            return
-        q.append(data)
+        row = t % self.rows
+        for col, x in zip(self._columns, args):
+            col[row] = x
+        self._begin[row] = self._episode_begin
 
-    def _store_op(self, data: List) -> NoReturn:
-        self._buffer[self._data_pointer] = data
-        self.update_rb_after_add()
+        done = args[6].reshape(num, -1).any(axis=-1)
+        valid = np.where((t - self._episode_begin + 1 >= self.timestep) | done)[0]
+        ends.append(np.stack([np.full_like(valid, t), valid], axis=-1))
+        ends = np.concatenate(ends)
+        self._ends[(self._ends_head + np.arange(len(ends))) % len(self._ends)] = ends
+        self._ends_head += len(ends)
 
-    def update_rb_after_add(self) -> NoReturn:
-        self._data_pointer += 1
-        if self._data_pointer >= self.capacity:  # replace when exceed the capacity
-            self._data_pointer = 0
-        if self._size < self.capacity:
-            self._size += 1
+        self._ended = done
+        self._last = [args[4].copy(), args[5].copy()]
+        self._t += 1
+        self._size = self._ends_head - self._ends_tail
 
-    def sample(self) -> List[List[Union[np.ndarray, tf.Tensor]]]:
+    def _window_first_step(self, end: np.ndarray, env: np.ndarray) -> np.ndarray:
+        return np.maximum(self._begin[end % self.rows, env], end - self.timestep + 1)
+
+    def _is_overwritten(self, end: np.ndarray, env: np.ndarray) -> np.ndarray:
+        oldest = self._window_first_step(end, env) - int(self.store_cell_state)    # the stored cell state comes from the previous step
+        return oldest < self._t - self.rows
+
+    def sample(self) -> List[np.ndarray]:
         '''
         data:
             0   s           -7
@@ -368,26 +807,30 @@ class EpisodeExperienceReplay(ReplayBuffer):
         [B, (s, a, r, s', d)] => [B*time_step, N]
         '''
         n_sample = self.batch_size if self.is_lg_batch_size else self._size
-        trajs = np.random.choice(self._buffer[:self._size], size=n_sample, replace=False)   # 选n_sample条轨迹
-        experience_type_num = len(trajs[0][0])  # 获取经验的类型种类 ， 如 <s, a, r> 即为3
-
-        def truncate(traj):
-            idx = np.random.randint(max(1, len(traj) - self.timestep + 1))  # [min, max)
-            return traj[idx:idx + self.timestep]
-
-        truncated_trajs = list(map(truncate, trajs))
-
-        data_list = [[] for _ in range(experience_type_num)]    # [s, visual_s, a, r, s_, visual_s_, done, others...]
-        for traj in truncated_trajs:    # traj即为1条轨迹 [(s,a,r,s_,done), (s,a,r,s_,done),...]
-            data = [exps for exps in zip(*traj)]    # s [T, N], s_ [T, N]
-            [dl.append(exps) for dl, exps in zip(data_list, data)]  # [B, T, NStep]
-
-        def f(v, l):    # [B, T, N]
-            return lambda x: tf.keras.preprocessing.sequence.pad_sequences(x, padding='pre', dtype='float32', value=v, maxlen=l, truncating='pre')
-        data_list[:6] = map(f(v=0., l=self.timestep), data_list[:6])   # [B, T, N]
-        data_list[6] = f(v=1., l=self.timestep)(data_list[6])  # done [B, T, N]
-        if experience_type_num > 7:
-            data_list[7:] = map(f(v=0., l=self.timestep), data_list[7:])   # padding 后的 [B, T, N]
+        pos = uniform_sample_index(self._size, n_sample)
+        end, env = self._ends[(self._ends_tail + pos) % len(self._ends)].T
+        invalid = self._is_overwritten(end, env)
+        while invalid.any():    # beginnings of the oldest windows may be overwritten already, resample them
+            pos[invalid] = np.random.randint(0, self._size, invalid.sum())
+            end[invalid], env[invalid] = self._ends[(self._ends_tail + pos[invalid]) % len(self._ends)].T
+            invalid[invalid] = self._is_overwritten(end[invalid], env[invalid])
+
+        first = self._window_first_step(end, env)
+        columns = self._columns
+        if self.store_cell_state:   # 窗口开始前一步的隐状态，回合开始的窗口使用零初始化
+            columns, cs_columns = columns[:7], columns[7:]
+            rows = (first - 1) % self.rows
+            from_begin = first == self._begin[end % self.rows, env]
+            self.cell_states = [np.where(from_begin[:, np.newaxis], 0., col[rows, env]).astype(np.float32) for col in cs_columns]
+
+        steps = end[:, np.newaxis] + np.arange(1 - self.timestep, 1)    # [B, T]
+        padding = steps < first[:, np.newaxis]  # pad before the beginning of episodes
+        rows, env = steps % self.rows, env[:, np.newaxis]
+        data_list = []
+        for i, col in enumerate(columns):
+            x = col[rows, env]  # [B, T, N]
+            x[padding] = 1 if i == 6 else 0
+            data_list.append(x)
 
         self.burn_in_states = list(map(lambda x: x[:, :self.burn_in_time_step], data_list[:2]))
         data_list = list(map(lambda x: x[:, self.burn_in_time_step:], data_list))   # s: [B, T, N]
@@ -401,9 +844,45 @@ class EpisodeExperienceReplay(ReplayBuffer):
         s, visual_s = self.burn_in_states
         return s, visual_s
 
+    def _save(self, snapshot: Snapshot) -> NoReturn:
+        if self._columns is None:
+            return
+        for i, col in enumerate(self._columns):
+            snapshot.save_ring(f'column_{i}', col, self._t)
+        snapshot.save_ring('begin', self._begin, self._t)
+        snapshot.save_ring('ends', self._ends, self._ends_head)
+        snapshot.save_array('episode_begin', self._episode_begin)
+        snapshot.save_array('ended', self._ended)
+        if self._last is not None:
+            snapshot.save_array('last_s_', self._last[0])
+            snapshot.save_array('last_visual_s_', self._last[1])
+        snapshot.state.update(columns=len(self._columns), t=self._t, ends_tail=self._ends_tail, ends_head=self._ends_head,
+                              has_last=self._last is not None)
+
+    def _load(self, snapshot: Snapshot) -> NoReturn:
+        if 'columns' not in snapshot.state:
+            return
+        self._columns = [snapshot.load_ring(f'column_{i}') for i in range(snapshot.state['columns'])]
+        snapshot.load_ring('begin', out=self._begin)
+        snapshot.load_ring('ends', out=self._ends)
+        snapshot.load_array('episode_begin', out=self._episode_begin)
+        snapshot.load_array('ended', out=self._ended)
+        if snapshot.state['has_last']:
+            self._last = [snapshot.load_array('last_s_'), snapshot.load_array('last_visual_s_')]
+        self._t = snapshot.state['t']
+        self._ends_tail = snapshot.state['ends_tail']
+        self._ends_head = snapshot.state['ends_head']
+        self._size = self._ends_head - self._ends_tail
+
+    def get_cell_states(self) -> List[np.ndarray]:
+        '''
+        return: stored cell states right before the sampled windows, [(B, units), ...]
+        '''
+        return self.cell_states
+
     @property
     def is_full(self) -> bool:
-        return self._size == self.capacity
+        return self._t >= self.rows
 
     @property
     def size(self) -> int:
@@ -413,35 +892,31 @@ class EpisodeExperienceReplay(ReplayBuffer):
     def is_lg_batch_size(self) -> bool:
         return self._size > self.batch_size
 
-    @property
     def show_rb(self) -> NoReturn:
         print('RB size: ', self._size)
         print('RB capacity: ', self.capacity)
-        print(self._buffer)
+        print(self._columns)
 
 
 if __name__ == "__main__":
-    buff = EpisodeExperienceReplay(4, 10, 2)
-
-    s = [np.zeros(2), np.ones(2)]
-    visual_s = [np.zeros(2), np.ones(2)]
-    a = [np.zeros(2), np.ones(2)]
-    r = [np.array([1]), np.array([1])]
-    s_ = [np.zeros(2), np.ones(2)]
-    visual_s_ = [np.zeros(2), np.ones(2)]
-    done = [np.array([False]), np.array([False])]
-    done_ = [np.array([True]), np.array([True])]
-    done1 = [np.array([False]), np.array([True])]
-    done2 = [np.array([True]), np.array([False])]
-
-    buff.add(s, visual_s, a, r, s_, visual_s_, done)
-    buff.add(s, visual_s, a, r, s_, visual_s_, done)
-    buff.add(s, visual_s, a, r, s_, visual_s_, done)
-    buff.add(s, visual_s, a, r, s_, visual_s_, done1)   # done 1, 4
-    buff.add(s, visual_s, a, r, s_, visual_s_, done2)   # done 2, 5
-    buff.add(s, visual_s, a, r, s_, visual_s_, done)
-    buff.add(s, visual_s, a, r, s_, visual_s_, done)
-    buff.add(s, visual_s, a, r, s_, visual_s_, done_)   # done 3, 4     done 4, 3
-    # print(buff._buffer[1])
-    # buff.show_rb
-    # buff.sample()
+    buff = EpisodeExperienceReplay(4, 10, 2, burn_in_time_step=1, train_time_step=2)
+
+    s = np.asarray([np.zeros(2), np.ones(2)])
+    visual_s = np.zeros((2, 0))
+    a = np.asarray([np.zeros(2), np.ones(2)])
+    r = np.asarray([[1], [1]])
+    done = np.asarray([[False], [False]])
+    done_ = np.asarray([[True], [True]])
+    done1 = np.asarray([[False], [True]])
+    done2 = np.asarray([[True], [False]])
+
+    buff.add(s, visual_s, a, r, s, visual_s, done)
+    buff.add(s, visual_s, a, r, s, visual_s, done)
+    buff.add(s, visual_s, a, r, s, visual_s, done)
+    buff.add(s, visual_s, a, r, s, visual_s, done1)   # done 1, 4
+    buff.add(s, visual_s, a, r, s, visual_s, done2)   # done 2, 5
+    buff.add(s, visual_s, a, r, s, visual_s, done)
+    buff.add(s, visual_s, a, r, s, visual_s, done)
+    buff.add(s, visual_s, a, r, s, visual_s, done_)   # done 3, 4     done 4, 3
+    buff.show_rb()
+    print(buff.sample())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import pickle
+import numpy as np
+
+from typing import \
+    Any, \
+    Dict, \
+    NoReturn, \
+    Optional, \
+    Tuple, \
+    Union
+
+from rls.utils.sundry_utils import check_or_create
+
+
+class Snapshot(object):
+    '''
+    Incremental snapshot of a replay buffer in a directory, i.e. model/buffer.
+    Ring arrays are split into chunks of `chunk_rows` rows along one axis, and only chunks that contain rows written since the last save
+    are rewritten. Small arrays, i.e. sum trees, are rewritten as a whole. Scalars go into `state`, which is dumped to state.json at the
+    end of commit(), so that a snapshot only counts once state.json has been replaced.
+    Files are never overwritten: every save writes new files named after its generation, i.e. name/chunk_k.3.npy, and state.json refers
+    to the files of its generation, so an interrupted save leaves the previous snapshot intact. Files no longer referenced are removed after commit.
+    Restoring maps every chunk with np.load(mmap_mode='r') and copies it into the buffer, which is bounded by disk bandwidth.
+    '''
+
+    def __init__(self, path: str, chunk_rows: int = 65536):
+        assert chunk_rows > 0, 'chunk_rows must larger than zero'
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.state = {}
+        self._written = {}  # name of ring => rows persisted, counted since the buffer was created
+        self.generation = self._read_state().get('generation', -1) + 1 if self.exists else 0    # files of committed snapshots are kept
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, 'state.json'))
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, *name.split('/'))
+
+    def _new_file(self, name: str, ext: str) -> str:
+        '''
+        relative name of a file written by the current generation
+        '''
+        filename = f'{name}.{self.generation}.{ext}'
+        os.makedirs(os.path.dirname(self._file(filename)), exist_ok=True)
+        return filename
+
+    def _save(self, name: str, array: np.ndarray) -> str:
+        filename = self._new_file(name, 'npy')
+        np.save(self._file(filename), array)
+        return filename
+
+    @staticmethod
+    def _slice(axis: int, begin: int, end: int) -> Tuple:
+        return (slice(None),) * axis + (slice(begin, end),)
+
+    def save_ring(self, name: str, array: np.ndarray, written: Union[int, np.ndarray], axis: int = 0) -> NoReturn:
+        '''
+        inputs:
+            array: ring buffer whose row `i` along `axis` holds the i-th written row modulo its length
+            written: number of rows ever written, or one counter per ring when rings are stacked along the other axes, i.e. per env
+        '''
+        written = np.asarray(written)
+        high, low = int(written.max()), int(written.min())
+        rows = array.shape[axis]
+        chunks = int(np.ceil(rows / self.chunk_rows))
+        last = self._written.get(name)
+        files = list(self.state.get(f'{name}/chunks', []))
+        if last is None or high - last >= rows or len(files) != chunks:
+            dirty = range(chunks)
+            files = [None] * chunks
+        else:
+            dirty = np.unique((np.arange(last, high) % rows) // self.chunk_rows)
+        for k in dirty:
+            index = self._slice(axis, k * self.chunk_rows, (k + 1) * self.chunk_rows)
+            files[k] = self._save(f'{name}/chunk_{k}', array[index])
+        self._written[name] = low
+        self.state[f'{name}/chunks'] = files
+        self.state[f'{name}/shape'] = list(array.shape)
+        self.state[f'{name}/dtype'] = array.dtype.str
+        self.state[f'{name}/axis'] = axis
+        self.state[f'{name}/chunk_rows'] = self.chunk_rows
+        self.state[f'{name}/written'] = low
+
+    def spec(self, name: str) -> Tuple[tuple, np.dtype]:
+        '''
+        shape and dtype of a saved ring
+        '''
+        return tuple(self.state[f'{name}/shape']), np.dtype(self.state[f'{name}/dtype'])
+
+    def load_ring(self, name: str, out: Optional[np.ndarray] = None) -> np.ndarray:
+        shape, dtype = self.spec(name)
+        axis, chunk_rows = self.state[f'{name}/axis'], self.state[f'{name}/chunk_rows']
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        assert out.shape == shape, f'shape of {name} does not match the snapshot, {out.shape} vs {shape}'
+        for k, filename in enumerate(self.state[f'{name}/chunks']):
+            out[self._slice(axis, k * chunk_rows, (k + 1) * chunk_rows)] = np.load(self._file(filename), mmap_mode='r')
+        self._written[name] = self.state[f'{name}/written']
+        return out
+
+    def save_array(self, name: str, array: np.ndarray) -> NoReturn:
+        self.state[f'{name}/file'] = self._save(name, np.asarray(array))
+
+    def load_array(self, name: str, out: Optional[np.ndarray] = None) -> np.ndarray:
+        x = np.load(self._file(self.state[f'{name}/file']), mmap_mode='r')
+        if out is None:
+            return np.array(x)
+        out[...] = x
+        return out
+
+    def save_object(self, name: str, obj: Any) -> NoReturn:
+        '''
+        pickle an arbitrary object as a whole, i.e. transitions of ObjectStorage
+        '''
+        filename = self._new_file(name, 'pkl')
+        with open(self._file(filename), 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.state[f'{name}/file'] = filename
+
+    def load_object(self, name: str) -> Any:
+        with open(self._file(self.state[f'{name}/file']), 'rb') as f:
+            return pickle.load(f)
+
+    def _referenced(self) -> set:
+        files = set()
+        for key, value in self.state.items():
+            if key.endswith('/chunks'):
+                files.update(value)
+            elif key.endswith('/file'):
+                files.add(value)
+        return {os.path.normpath(self._file(f)) for f in files}
+
+    def commit(self) -> NoReturn:
+        check_or_create(self.path, 'replay buffer snapshot')
+        self.state['generation'] = self.generation
+        filename = os.path.join(self.path, 'state.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(filename + '.tmp', filename)
+        self.generation += 1
+        referenced = self._referenced()
+        for root, _, files in os.walk(self.path):    # superseded files, and files of interrupted saves
+            for f in files:
+                path = os.path.normpath(os.path.join(root, f))
+                if f.endswith(('.npy', '.pkl')) and path not in referenced:
+                    os.remove(path)
+
+    def _read_state(self) -> Dict[str, Any]:
+        with open(os.path.join(self.path, 'state.json'), 'r') as f:
+            return json.load(f)
+
+    def read(self) -> Dict[str, Any]:
+        self.state = self._read_state()
+        self.generation = self.state.get('generation', -1) + 1
+        return self.state
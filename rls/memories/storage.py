@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+
+from typing import \
+    Dict, \
+    List, \
+    NoReturn, \
+    Optional, \
+    Tuple, \
+    Union
+
+from rls.utils.sundry_utils import check_or_create
+from rls.utils.frame_ring import FrameRing
+from rls.utils.shared_arrays import SharedArrays
+from rls.memories.snapshot import Snapshot
+
+
+class ObjectStorage(object):
+    '''
+    Stores every transition as a python object, i.e. [s, visual_s, a, r, s_, visual_s_, done], inside an object array.
+    Slow and memory hungry, but tolerates ragged or irregular payloads.
+    '''
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.empty(capacity, dtype=object)
+
+    def put(self, start: int, *args) -> NoReturn:
+        '''
+        write a batch of transitions into the ring, beginning at slot `start`.
+        args: [ss, visual_ss, as, rs, s_s, visual_s_s, dones, ...], each item has shape [B, ...]
+        '''
+        for i, data in enumerate(zip(*args)):
+            self._data[(start + i) % self.capacity] = data
+
+    def get(self, idxs: Union[List, np.ndarray]) -> List[np.ndarray]:
+        '''
+        change [[s, a, r],[s, a, r]] to [[s, s],[a, a],[r, r]]
+        '''
+        return [np.asarray(e) for e in zip(*self._data[idxs])]
+
+    def save(self, snapshot: Snapshot, name: str) -> NoReturn:
+        '''
+        transitions are pickled as a whole on every save, use columnar storage for large buffers.
+        '''
+        snapshot.save_object(f'{name}/data', self._data)
+
+    def load(self, snapshot: Snapshot, name: str) -> NoReturn:
+        if f'{name}/data/file' not in snapshot.state:
+            return
+        data = snapshot.load_object(f'{name}/data')
+        assert len(data) == self.capacity, 'capacity must be consistent with the snapshot'
+        self._data = data
+
+    def __repr__(self):
+        return repr(self._data[:, np.newaxis])
+
+
+class ColumnarStorage(object):
+    '''
+    Struct-of-arrays storage, one typed and preallocated ndarray per field, i.e. s: [capacity, N], a: [capacity, A], r: [capacity, 1].
+    Columns are allocated lazily from the first batch, so that shapes and dtypes follow the data.
+    Batched writes become at most two slice assignments per column, and reads become one fancy-index gather per column.
+    '''
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._columns = None
+        self._written = 0   # total number of transitions written
+
+    @property
+    def columns(self) -> List[np.ndarray]:
+        return self._columns
+
+    def _allocate(self, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        '''
+        allocate one column, subclasses could override this to place columns elsewhere, i.e. on disk.
+        '''
+        return np.empty((self.capacity, *shape), dtype=dtype)
+
+    def _lazy_init(self, args) -> NoReturn:
+        self._columns = []
+        for x in args:
+            x = np.asarray(x)
+            self._columns.append(self._allocate(x.shape[1:], x.dtype))
+
+    def put(self, start: int, *args) -> NoReturn:
+        '''
+        write a batch of transitions into the ring, beginning at slot `start`.
+        args: [ss, visual_ss, as, rs, s_s, visual_s_s, dones, ...], each item has shape [B, ...]
+        '''
+        if self._columns is None:
+            self._lazy_init(args)
+        assert len(args) == len(self._columns), 'the number of fields must be consistent with the first add'
+        num = len(args[0])
+        self._written += num
+        if num > self.capacity:     # only the latest `capacity` transitions survive
+            start = (start + num - self.capacity) % self.capacity
+            args = [x[-self.capacity:] for x in args]
+            num = self.capacity
+        end = start + num
+        for col, x in zip(self._columns, args):
+            if end <= self.capacity:
+                col[start:end] = x
+            else:
+                first = self.capacity - start
+                col[start:] = x[:first]
+                col[:end - self.capacity] = x[first:]
+
+    def get(self, idxs: Union[List, np.ndarray]) -> List[np.ndarray]:
+        return [col[idxs] for col in self._columns]
+
+    def save(self, snapshot: Snapshot, name: str) -> NoReturn:
+        '''
+        write columns into the snapshot, only chunks with transitions written since the last save are rewritten.
+        '''
+        if self._columns is None:
+            return
+        for i, col in enumerate(self._columns):
+            snapshot.save_ring(f'{name}/column_{i}', col, self._written)
+        snapshot.state[f'{name}/columns'] = len(self._columns)
+        snapshot.state[f'{name}/written'] = self._written
+
+    def load(self, snapshot: Snapshot, name: str) -> NoReturn:
+        n = snapshot.state.get(f'{name}/columns', 0)
+        if n == 0:
+            return
+        if self._columns is None:
+            self._columns = []
+            for i in range(n):
+                shape, dtype = snapshot.spec(f'{name}/column_{i}')
+                self._columns.append(self._allocate(shape[1:], dtype))
+        assert len(self._columns) == n, 'the number of fields must be consistent with the snapshot'
+        for i, col in enumerate(self._columns):
+            snapshot.load_ring(f'{name}/column_{i}', out=col)
+        self._written = snapshot.state[f'{name}/written']
+
+    def __repr__(self):
+        return repr(self._columns)
+
+
+class MemmapStorage(ColumnarStorage):
+    '''
+    Columnar storage whose columns are np.memmap files, i.e. `path`/column_0.npy, so that the capacity is no longer bounded by RAM.
+    Samples are gathered directly from the mapped pages. The latest `hot_window` transitions are mirrored in memory as well,
+    so that recent experiences never have to be paged back in from disk.
+    '''
+
+    def __init__(self, capacity: int, path: str, hot_window: int = 0):
+        super().__init__(capacity)
+        self.path = path
+        self.hot_window = min(int(hot_window), capacity)
+        self._hot = None
+        self._head = 0  # next slot to write
+
+    def _allocate(self, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        check_or_create(self.path, 'replay buffer')
+        filename = os.path.join(self.path, f'column_{len(self._columns)}.npy')
+        return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(self.capacity, *shape))
+
+    def put(self, start: int, *args) -> NoReturn:
+        super().put(start, *args)  # counts _written, which locates rows in the hot window
+        num = len(args[0])
+        if self.hot_window > 0:
+            if self._hot is None:
+                self._hot = [np.empty((self.hot_window, *col.shape[1:]), dtype=col.dtype) for col in self._columns]
+            n = min(num, self.hot_window)
+            pos = (self._written - n + np.arange(n)) % self.hot_window
+            for hot, x in zip(self._hot, args):
+                hot[pos] = np.asarray(x)[num - n:]
+        self._head = (start + num) % self.capacity
+
+    def get(self, idxs: Union[List, np.ndarray]) -> List[np.ndarray]:
+        idxs = np.asarray(idxs)
+        if self._hot is None:
+            return [np.asarray(col[idxs]) for col in self._columns]
+        age = (self._head - 1 - idxs) % self.capacity    # 0 means the latest transition
+        is_hot = age < min(self.hot_window, self._written)
+        hot_pos = (self._written - 1 - age[is_hot]) % self.hot_window
+        cold_idxs = idxs[~is_hot]
+        data = []
+        for col, hot in zip(self._columns, self._hot):
+            out = np.empty((len(idxs), *col.shape[1:]), dtype=col.dtype)
+            out[is_hot] = hot[hot_pos]
+            out[~is_hot] = col[cold_idxs]
+            data.append(out)
+        return data
+
+    def flush(self) -> NoReturn:
+        if self._columns is not None:
+            [col.flush() for col in self._columns]
+
+    def save(self, snapshot: Snapshot, name: str) -> NoReturn:
+        super().save(snapshot, name)
+        snapshot.state[f'{name}/head'] = self._head
+
+    def load(self, snapshot: Snapshot, name: str) -> NoReturn:
+        super().load(snapshot, name)
+        self._head = snapshot.state.get(f'{name}/head', 0)
+        self._hot = None
+        if self.hot_window > 0 and self._columns is not None:   # mirror the latest transitions in memory again
+            n = min(self.hot_window, self._written, self.capacity)
+            rows = (self._head - n + np.arange(n)) % self.capacity
+            pos = (self._written - n + np.arange(n)) % self.hot_window
+            self._hot = [np.empty((self.hot_window, *col.shape[1:]), dtype=col.dtype) for col in self._columns]
+            for hot, col in zip(self._hot, self._columns):
+                hot[pos] = col[rows]
+
+
+class SharedMemoryStorage(ColumnarStorage):
+    '''
+    Columnar storage whose columns live in multiprocessing.shared_memory, see rls.utils.shared_arrays.SharedArrays,
+    so that several local processes could write transitions and another one could sample from the same columns without any copy through pipes.
+    Columns are allocated from `specs` at once, or lazily from the first batch if `specs` is None,
+    in the latter case the storage could only be shared with other processes after the first put().
+    '''
+
+    def __init__(self, capacity: int, specs: Optional[List[Tuple[tuple, np.dtype]]] = None):
+        '''
+        inputs:
+            specs: [(shape, dtype), ...] of every field without the batch axis, i.e. [((8,), np.float32), ((0,), np.float32), ((2,), np.float32), ...]
+        '''
+        self.shared = SharedArrays()
+        self.shared.create('written', (1,), np.int64, fill=0)
+        super().__init__(capacity)
+        if specs is not None:
+            self._columns = []
+            for shape, dtype in specs:
+                self._columns.append(self._allocate(tuple(shape), np.dtype(dtype)))
+
+    @property
+    def _written(self) -> int:
+        return int(self.shared['written'][0])
+
+    @_written.setter
+    def _written(self, value: int) -> NoReturn:
+        self.shared['written'][0] = value
+
+    def _allocate(self, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        key = f'column_{len(self._columns)}'
+        return self.shared.create(key, (self.capacity, *shape), dtype)
+
+    def _lazy_init(self, args) -> NoReturn:
+        assert self.shared.owner, 'columns have not been allocated by the creating process, pass specs or put data before sharing'
+        super()._lazy_init(args)
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state['_columns'] = None if self._columns is None else len(self._columns)
+        return state
+
+    def __setstate__(self, state: Dict) -> NoReturn:
+        n = state['_columns']
+        self.__dict__.update(state)
+        self._columns = None if n is None else [self.shared[f'column_{i}'] for i in range(n)]
+
+    def close(self) -> NoReturn:
+        '''
+        detach from the columns, the creating process also releases them.
+        '''
+        self._columns = None
+        self.shared.close()
+
+
+class TrajectoryStorage(ColumnarStorage):
+    '''
+    Keeps per-env trajectories contiguous, so that observations are stored by reference instead of twice as s and s_.
+    For every deduplicated pair of fields, i.e. (s, s_) or (visual_s, visual_s_), each env owns a ring of single observations, see FrameRing.
+    Every step only appends the newest frame of the next observation, plus the whole current observation when an episode begins,
+    which is detected by done of the previous step or by a current observation that differs from the previous next observation (truncation).
+    Transitions keep the env id and the sequence number of their newest frame, and both observations are rebuilt by index arithmetic when sampling,
+    or sampled packed as the frames they share, see get(packed=True).
+    Observations stacked by StackEnv along the last axis, i.e. [visual_sources, H, W, C*stack], are split into frames,
+    so that each frame is stored about once instead of 2 * stack times.
+    Fields must follow [s, visual_s, a, r, s_, visual_s_, done, ...].
+    '''
+    done_index = 6
+
+    def __init__(self, capacity: int, agents_num: int, pairs: List[Tuple[int, int, int]], margin: float = 0.125):
+        '''
+        inputs:
+            agents_num: number of envs, every add must contain one transition per env
+            pairs: [(index of observation, index of next observation, stack), ...], stack is how many frames are concatenated along the last axis
+            margin: extra frames per env relative to capacity / agents_num, covering the additional frames pushed at episode starts.
+                transitions whose frames have been overwritten are reported by is_valid()
+        '''
+        assert len(pairs) > 0, 'at least one pair of fields should be deduplicated'
+        super().__init__(capacity)
+        self.agents_num = agents_num
+        self.pairs = pairs
+        self.ref_index = sum([[i, j] for i, j, _ in pairs], [])
+        self.frame_capacity = [int(np.ceil(capacity / agents_num) * (1 + margin)) + stack + 1 for _, _, stack in pairs]
+        self._rings = None      # FrameRing of [agents_num, frame_capacity, *frame_shape] for every pair
+        self._shapes = None     # shapes of observations, without the batch axis
+        self._last = None   # next observations of the last add
+        self._last_done = None  # done of the last add, the next add of those envs begins new episodes
+
+    @staticmethod
+    def _split(x: np.ndarray, stack: int) -> np.ndarray:
+        '''
+        [B, ..., C*stack] => [B, stack, ..., C], oldest frame first
+        '''
+        x = x.reshape(*x.shape[:-1], stack, -1)
+        return np.moveaxis(x, -2, 1)
+
+    @staticmethod
+    def _join(frames: np.ndarray) -> np.ndarray:
+        '''
+        [B, stack, ..., C] => [B, ..., C*stack]
+        '''
+        x = np.moveaxis(frames, 1, -2)
+        return x.reshape(*x.shape[:-2], -1)
+
+    def put(self, start: int, *args) -> NoReturn:
+        num = len(args[0])
+        assert num == self.agents_num, 'every add must contain exactly one transition per env'
+        if self._rings is None:
+            self._shapes = [np.shape(args[i])[1:] for i, _, _ in self.pairs]
+        # observations of Discrete spaces are scalars, give them a trailing axis
+        obs = [np.asarray(args[i]).reshape(num, *(shape or (1,))) for (i, _, _), shape in zip(self.pairs, self._shapes)]
+        obs_ = [np.asarray(args[j]).reshape(num, *(shape or (1,))) for (_, j, _), shape in zip(self.pairs, self._shapes)]
+        if self._rings is None:
+            self._rings = [FrameRing(self.agents_num, cap, (*x.shape[1:-1], x.shape[-1] // stack), x.dtype)
+                           for x, cap, (_, _, stack) in zip(obs, self.frame_capacity, self.pairs)]
+            new_episode = np.ones(num, dtype=bool)
+        else:
+            new_episode = self._last_done.copy()
+            for x, last in zip(obs, self._last):
+                new_episode |= (x.reshape(num, -1) != last.reshape(num, -1)).any(axis=-1)
+        self._last = [x.copy() for x in obs_]
+        self._last_done = np.asarray(args[self.done_index]).reshape(num, -1).any(axis=-1)
+
+        env = np.arange(num)
+        starts = np.where(new_episode)[0]
+        seqs_ = []
+        for x, x_, ring, (_, _, stack) in zip(obs, obs_, self._rings, self.pairs):
+            if len(starts) > 0:    # push the whole observation at the beginning of episodes
+                ring.push_many(self._split(x[starts], stack), starts)
+            seqs_.append(ring.written.copy())
+            ring.push(self._split(x_, stack)[:, -1])
+
+        others = [x for i, x in enumerate(args) if i not in self.ref_index]
+        super().put(start, *others, env, *seqs_)
+
+    @property
+    def packed_pairs(self) -> List[Tuple[int, int, tuple]]:
+        '''
+        [(index of observation, index of next observation, shape of observation), ...] of fields sampled by get(packed=True)
+        '''
+        if self._shapes is None:
+            return []
+        return [(i, j, shape) for (i, j, _), shape in zip(self.pairs, self._shapes)]
+
+    def get(self, idxs: Union[List, np.ndarray], packed: bool = False) -> List[np.ndarray]:
+        '''
+        packed: instead of both observations of every pair, return the stack + 1 frames they share, [B, stack+1, *frame_shape] in their stored dtype,
+            in place of the observation and None in place of the next observation, so that a stacked pair is copied to the device
+            in about half of the bytes and split there. frames are joined as observation = frames[:, :-1], next observation = frames[:, 1:].
+        '''
+        data = super().get(idxs)
+        n = len(self.pairs)
+        env, seqs_ = data[-n - 1], data[-n:]
+        data = data[:-n - 1]
+        rebuilt = {}
+        for seq_, ring, shape, (i, j, stack) in zip(seqs_, self._rings, self._shapes, self.pairs):
+            x = ring.gather(env, seq_[:, np.newaxis] + np.arange(-stack, 1))  # [B, stack+1, *frame_shape]
+            if packed:
+                rebuilt[i], rebuilt[j] = x, None
+            else:
+                rebuilt[i] = self._join(x[:, :-1]).reshape(len(env), *shape)
+                rebuilt[j] = self._join(x[:, 1:]).reshape(len(env), *shape)
+        for i in sorted(rebuilt.keys()):
+            data.insert(i, rebuilt[i])
+        return data
+
+    def is_valid(self, idxs: Union[List, np.ndarray]) -> np.ndarray:
+        '''
+        whether all frames of the transitions are still in the frame rings
+        '''
+        n = len(self.pairs)
+        env = self._columns[-n - 1][idxs]
+        valid = np.ones(len(env), dtype=bool)
+        for col, ring, (_, _, stack) in zip(self._columns[-n:], self._rings, self.pairs):
+            valid &= col[idxs] - stack >= ring.written[env] - ring.capacity
+        return valid
+
+    def save(self, snapshot: Snapshot, name: str) -> NoReturn:
+        super().save(snapshot, name)
+        if self._rings is None:
+            return
+        for p, ring in enumerate(self._rings):
+            snapshot.save_ring(f'{name}/frames_{p}', ring.frames, ring.written, axis=1)
+            snapshot.save_array(f'{name}/frames_written_{p}', ring.written)
+            if self._last is not None:
+                snapshot.save_array(f'{name}/last_{p}', self._last[p])
+        snapshot.state[f'{name}/has_last'] = self._last is not None
+        if self._last_done is not None:
+            snapshot.state[f'{name}/last_done'] = self._last_done.tolist()
+        snapshot.state[f'{name}/shapes'] = [list(shape) for shape in self._shapes]
+
+    def load(self, snapshot: Snapshot, name: str) -> NoReturn:
+        super().load(snapshot, name)
+        if f'{name}/shapes' not in snapshot.state:
+            return
+        self._shapes = [tuple(shape) for shape in snapshot.state[f'{name}/shapes']]
+        self._rings = []
+        for p in range(len(self.pairs)):
+            shape, dtype = snapshot.spec(f'{name}/frames_{p}')
+            ring = FrameRing(shape[0], shape[1], shape[2:], dtype)
+            snapshot.load_ring(f'{name}/frames_{p}', out=ring.frames)
+            snapshot.load_array(f'{name}/frames_written_{p}', out=ring.written)
+            self._rings.append(ring)
+        if snapshot.state[f'{name}/has_last']:
+            self._last = [snapshot.load_array(f'{name}/last_{p}') for p in range(len(self.pairs))]
+        self._last_done = np.asarray(snapshot.state.get(f'{name}/last_done', [False] * self.agents_num), dtype=bool)
+
+
+STORAGES = {
+    'object': ObjectStorage,
+    'columnar': ColumnarStorage
+}
+
+
+def make_storage(storage: Union[str, ColumnarStorage, ObjectStorage], capacity: int, **kwargs):
+    '''
+    storage: name of the storage, or an already built storage that is returned as it is
+    '''
+    if not isinstance(storage, str):
+        return storage
+    assert storage in STORAGES.keys(), f'storage must be one of {list(STORAGES.keys())}'
+    return STORAGES[storage](capacity, **kwargs)
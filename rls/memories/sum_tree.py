@@ -3,208 +3,227 @@
 
 import numpy as np
 
-
-class Sum_Tree(object):
-    def __init__(self, capacity):
-        """
-        capacity = 5，设置经验池大小
-        tree = [0,1,2,3,4,5,6,7,8,9,10,11,12] 8-12存放叶子结点p值，1-7存放父节点、根节点p值的和，0存放树节点的数量
-        data = [0,1,2,3,4,5] 1-5存放数据， 0存放capacity
-        Tree structure and array storage:
-        Tree index:
-                    1         -> storing priority sum
-              /          \ 
-             2            3
-            / \          / \
-          4     5       6   7
-         / \   / \     / \  / \
-        8   9 10   11 12                   -> storing priority for transitions
-        """
+from typing import \
+    List, \
+    Tuple, \
+    Union, \
+    NoReturn
+
+
+class Segment_Tree(object):
+    '''
+    Array-backed complete binary tree whose parents keep `op` of their children, leaves correspond to slot ids [0, capacity).
+    All batch operations walk the tree level by level, so there is no recursion and every level costs one vectorized numpy op.
+    '''
+    op = None   # np.add, np.minimum, np.maximum
+    neutral = 0.    # value of empty leaves, must not affect the result of `op`
+
+    def __init__(self, capacity: int):
         assert capacity > 0, 'capacity must larger than zero'
         self.now = 0
         self.capacity = capacity
-        self.parent_node_count = self.get_parent_node_count(capacity)
-        # print(self.parent_node_count)
-        self.tree = np.zeros(self.parent_node_count + capacity + 1)
-        self.tree[0] = len(self.tree) - 1   # 树的总节点数，也是最后一个节点的索引值
-        self.data = np.zeros(capacity + 1, dtype=object)
-        self.data[0] = capacity
-
-    def add(self, p, data):
+        self.depth = int(np.ceil(np.log2(capacity))) if capacity > 1 else 0
+        self.leaf_offset = 2 ** self.depth   # tree index of slot 0
+        self.tree = np.full(2 * self.leaf_offset, self.neutral)
+
+    def add(self, p: float) -> int:
         """
-        p : property
-        data : [s, a, r, s_, done]
+        p : priority
+        return: the slot id that the new transition should be written into
         """
-        idx = self.now + 1
-        self.data[idx] = data
-        tree_index = idx + self.parent_node_count
-        self._updatetree(tree_index, p)
-        if idx >= self.capacity:
-            self.now = 0
-        else:
-            self.now = idx
+        return self.add_batch(np.asarray([p]))[0]
 
-    def add_batch(self, p, data):
+    def add_batch(self, p: Union[List, np.ndarray]) -> np.ndarray:
         """
-        p : property
-        data : [[s, a, r, s_, done], ...]
+        p : priorities of a batch of new transitions
+        return: slot ids of the new transitions in order, i.e. [now, now+1, ...] % capacity
         """
-        num = len(data)
-        idx = (np.arange(num) + self.now) % self.capacity + 1   # [1, capacity]
-        self.data[idx] = data
-        tree_index = idx + self.parent_node_count
-        self._updatetree_batch(tree_index, p)
-        if idx[-1] >= self.capacity:
-            self.now = 0
-        else:
-            self.now = idx[-1]
-
-    def _updatetree(self, tree_index, p):
-        diff = p - self.tree[tree_index]
-        self._propagate(tree_index, diff)
-        self.tree[tree_index] = p
-
-    def _updatetree_batch(self, tree_index, p):
-        tree_index, idx = np.unique(tree_index, return_index=True)
-        p = p[idx]
-        diff = p - self.tree[tree_index]
-        sort_index = np.argsort(tree_index)
-        tree_index = np.sort(tree_index)
-        diff = diff[sort_index]
-        self._propagate_batch(tree_index, diff)
-        self.tree[tree_index] = p
-
-    def _propagate(self, tree_index, diff):
-        parent = tree_index // 2
-        self.tree[parent] += diff
-        if parent != 1:
-            self._propagate(parent, diff)
-
-    def _propagate_batch(self, tree_index, diff):
-        parent = tree_index // 2
-        _parent, idx1, count = np.unique(parent, return_index=True, return_counts=True)
-        _, idx2 = np.unique(parent[::-1], return_index=True)
-        diff = (diff[- 1 - idx2] + diff[idx1]) * count / 2
-        self.tree[_parent] += diff
-        if (_parent != 1).all():
-            self._propagate_batch(_parent, diff)
-
-    def get(self, seg_p_total):
+        p = np.asarray(p, dtype=self.tree.dtype)
+        num = len(p)
+        idx = (np.arange(num) + self.now) % self.capacity
+        self.update(idx, p)
+        self.now = (self.now + num) % self.capacity
+        return idx
+
+    def update(self, idx: Union[List, np.ndarray], p: Union[List, np.ndarray]) -> NoReturn:
         """
-        seg_p_total : The value of priority to sample
+        idx : slot ids, duplicates are allowed and the last one wins
+        p : new priorities
         """
-        tree_index = self._retrieve(1, seg_p_total)
-        data_index = tree_index - self.parent_node_count
-        return (tree_index, data_index, self.tree[tree_index], self.data[data_index])
-
-    def get_batch(self, ps):
-        assert isinstance(ps, (list, np.ndarray))
-        tidx, didx, p, d = zip(*[self.get(i) for i in ps])
-        tidx, didx, p, d = map(np.asarray, [tidx, didx, p, d])
-        d = [np.asarray(e) for e in zip(*d)]    # [[s, a], [s, a]] => [[s, s], [a, a]]
-        return (tidx, didx, p, d)
-
-    def get_batch_parallel(self, ps):
-        assert isinstance(ps, (list, np.ndarray))
-        init_idx = np.full(len(ps), 1)
-        tidx = self._retrieve_batch(init_idx, ps)
-        didx = tidx - self.parent_node_count
-        p = self.tree[tidx]
-        d = self.data[didx]
-        tidx, didx, p, d = map(np.asarray, [tidx, didx, p, d])
-        d = [np.asarray(e) for e in zip(*d)]    # [[s, a], [s, a]] => [[s, s], [a, a]]
-        return (tidx, didx, p, d)
-
-    def _retrieve(self, tree_index, seg_p_total):
-        left = 2 * tree_index
-        right = left + 1
-        # if index 0 is the root node
-        # left = 2 * tree_index + 1
-        # right = 2 * (tree_index + 1)
-        if left >= self.tree[0]:
-            return tree_index
-        return self._retrieve(left, seg_p_total) if seg_p_total <= self.tree[left] else self._retrieve(right, seg_p_total - self.tree[left])
-
-    def _retrieve_batch(self, tree_index, seg_p_total):
-        left = 2 * tree_index
-        right = left + 1
-        if (left >= self.tree[0]).all():
-            return tree_index
-        # index = np.where(self.tree[left] >= seg_p_total, left, 0) + np.where(self.tree[left] < seg_p_total, right, 0)
-        # seg_p_total = np.where(self.tree[left] >= seg_p_total, seg_p_total, 0) + np.where(self.tree[left] < seg_p_total, seg_p_total - self.tree[left], 0)
-        index = np.where(seg_p_total < self.tree[left], left, right)
-        seg_p_total = np.where(seg_p_total < self.tree[left], seg_p_total, seg_p_total - self.tree[left])
-        return self._retrieve_batch(index, seg_p_total)
+        tree_index = np.asarray(idx, dtype=np.int64) + self.leaf_offset
+        p = np.asarray(p, dtype=self.tree.dtype)
+        order = np.argsort(tree_index, kind='stable')
+        tree_index, p = tree_index[order], p[order]
+        last = np.append(tree_index[1:] != tree_index[:-1], True)
+        tree_index = tree_index[last]
+        self.tree[tree_index] = p[last]
+        self._propagate_batch(tree_index)
+
+    def _propagate_batch(self, tree_index: np.ndarray) -> NoReturn:
+        '''
+        tree_index: sorted and unique indexes of modified nodes.
+        recompute parents from both children level by level, which stays exact no matter how many children of a parent change.
+        '''
+        for _ in range(self.depth):
+            tree_index = tree_index // 2
+            tree_index = tree_index[np.append(True, tree_index[1:] != tree_index[:-1])]  # still sorted, dedup in O(n)
+            self.tree[tree_index] = self.op(self.tree[2 * tree_index], self.tree[2 * tree_index + 1])
 
     def pp(self):
-        print(self.tree, self.data)
+        print(self.tree)
+
+
+class Sum_Tree(Segment_Tree):
+    '''
+    capacity = 5，设置经验池大小
+    tree = [0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15] 8-12存放叶子结点p值，1-7存放父节点、根节点p值的和，0不使用
+    叶子结点只对应数据的槽位编号 slot = tree_index - leaf_offset, i.e. [0, capacity)，数据本身存放在经验池的列式存储中
+    Tree structure and array storage:
+    Tree index:
+                1         -> storing priority sum
+          /          \\
+         2            3
+        / \\          / \\
+      4     5       6   7
+     / \\   / \\     / \\  / \\
+    8   9 10   11 12                   -> storing priority for transitions, slot 0-4
+    '''
+    op = np.add
+    neutral = 0.
+
+    def get_batch_parallel(self, ps: Union[List, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        ps : values of priority to sample, in [0, total)
+        return: slot ids and their priorities
+        '''
+        ps = np.array(ps, dtype=self.tree.dtype)
+        tree_index = np.ones(len(ps), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * tree_index
+            left_p = self.tree[left]
+            go_right = (ps >= left_p) & (self.tree[left + 1] > 0)  # never walk into an empty subtree because of float rounding
+            ps = np.where(go_right, ps - left_p, ps)
+            tree_index = left + go_right
+        return tree_index - self.leaf_offset, self.tree[tree_index]
 
     @property
-    def total(self):
+    def total(self) -> float:
         return self.tree[1]
 
-    def get_parent_node_count(self, capacity):
-        i = 0
-        while True:
-            if pow(2, i) < capacity <= pow(2, i + 1):
-                return pow(2, i + 1) - 1
-            i += 1
 
+class Min_Tree(Segment_Tree):
+    '''
+    keeps the exact minimum priority of all filled slots, empty slots hold +inf.
+    '''
+    op = np.minimum
+    neutral = np.inf
 
-if __name__ == "__main__":
-    from time import time
-    t = 10
-    init_times = []
-    sample_times = []
-    update_times = []
-
-    for i in range(t):
-        tree = Sum_Tree(524288)
-        # [[s, a], [s, a], ...524288]
-        a = [[[1, 2], [3]] for _ in range(524288)]
-        b = np.arange(524288) + 1
-        start = time()
-        tree.add_batch(b, a)
-        init_times.append(time()-start)
+    @property
+    def min(self) -> float:
+        return self.tree[1]
 
-        all_intervals = np.linspace(0, tree.total, 1024 + 1)
-        ps = np.random.uniform(all_intervals[:-1], all_intervals[1:])
-        start = time()
-        tree.get_batch_parallel(ps)
-        sample_times.append(time()-start)
-        
-        start = time()
-        tree._updatetree_batch(np.random.randint(0, 524288, 1024), np.random.randint(0, 20, 1024))
-        update_times.append(time()-start)
 
-    # 0.24790284633636475 0.0028038501739501955 0.0010003089904785157
-    print(np.asarray(init_times).mean(), np.asarray(sample_times).mean(), np.asarray(update_times).mean())
+class Max_Tree(Segment_Tree):
+    '''
+    keeps the exact maximum priority of all filled slots, empty slots hold -inf.
+    '''
+    op = np.maximum
+    neutral = -np.inf
 
-    init_times = []
-    sample_times = []
-    update_times = []
+    @property
+    def max(self) -> float:
+        return self.tree[1]
 
-    for i in range(t):
-        tree = Sum_Tree(524288)
-        # [[s, a], [s, a], ...524288]
-        a = [[[1, 2], [3]] for _ in range(524288)]
-        b = np.arange(524288) + 1
-        start = time()
-        for _a, _b in zip(a, b):
-            tree.add(_b, _a)
-        init_times.append(time()-start)
 
-        all_intervals = np.linspace(0, tree.total, 1024 + 1)
-        ps = np.random.uniform(all_intervals[:-1], all_intervals[1:])
-        start = time()
-        tree.get_batch(ps)
-        sample_times.append(time()-start)
-        
-        start = time()
-        for _i, _p in zip(np.random.randint(0, 524288, 1024), np.random.randint(0, 20, 1024)):
-            tree._updatetree(_i, _p)
-        update_times.append(time()-start)
+if __name__ == "__main__":
+    from time import time
+
+    class Recursive_Sum_Tree(object):
+        '''
+        the previous recursive implementation that stores payloads in an object array, only kept here for timing.
+        '''
 
-    # 5.809855628013611 0.01910092830657959 0.017893266677856446
-    print(np.asarray(init_times).mean(), np.asarray(sample_times).mean(), np.asarray(update_times).mean())
-    
\ No newline at end of file
+        def __init__(self, capacity):
+            self.now = 0
+            self.capacity = capacity
+            self.parent_node_count = 2 ** int(np.ceil(np.log2(capacity))) - 1
+            self.tree = np.zeros(self.parent_node_count + capacity + 1)
+            self.tree[0] = len(self.tree) - 1
+            self.data = np.zeros(capacity + 1, dtype=object)
+
+        def add_batch(self, p, data):
+            idx = (np.arange(len(data)) + self.now) % self.capacity + 1
+            self.data[idx] = data
+            self._updatetree_batch(idx + self.parent_node_count, p)
+            self.now = 0 if idx[-1] >= self.capacity else idx[-1]
+
+        def _updatetree_batch(self, tree_index, p):
+            tree_index, idx = np.unique(tree_index, return_index=True)
+            p = p[idx]
+            diff = p - self.tree[tree_index]
+            self._propagate_batch(tree_index, diff)
+            self.tree[tree_index] = p
+
+        def _propagate_batch(self, tree_index, diff):
+            parent = tree_index // 2
+            _parent, idx1, count = np.unique(parent, return_index=True, return_counts=True)
+            _, idx2 = np.unique(parent[::-1], return_index=True)
+            diff = (diff[- 1 - idx2] + diff[idx1]) * count / 2
+            self.tree[_parent] += diff
+            if (_parent != 1).all():
+                self._propagate_batch(_parent, diff)
+
+        def get_batch_parallel(self, ps):
+            tidx = self._retrieve_batch(np.full(len(ps), 1), ps)
+            didx = tidx - self.parent_node_count
+            d = [np.asarray(e) for e in zip(*self.data[didx])]
+            return (tidx, didx, self.tree[tidx], d)
+
+        def _retrieve_batch(self, tree_index, seg_p_total):
+            left = 2 * tree_index
+            right = left + 1
+            if (left >= self.tree[0]).all():
+                return tree_index
+            index = np.where(seg_p_total < self.tree[left], left, right)
+            seg_p_total = np.where(seg_p_total < self.tree[left], seg_p_total, seg_p_total - self.tree[left])
+            return self._retrieve_batch(index, seg_p_total)
+
+        @property
+        def total(self):
+            return self.tree[1]
+
+    def timing(t, f, *args):
+        start = time()
+        for _ in range(t):
+            f(*args)
+        return (time() - start) / t
+
+    t = 3
+    batch_size = 1024
+    for power in range(19, 24):
+        capacity = 2 ** power
+        b = np.random.randint(1, 20, capacity).astype(np.float64)
+        all_intervals = np.linspace(0, b.sum(), batch_size + 1)
+        ps = np.random.uniform(all_intervals[:-1], all_intervals[1:])
+        update_idx = np.random.randint(0, capacity, batch_size)
+        update_p = np.random.randint(1, 20, batch_size).astype(np.float64)
+
+        payload = np.empty(capacity, dtype=object)
+        payload[:] = [([1, 2], [3])] * capacity   # [[s, a], [s, a], ...]
+        old_tree = Recursive_Sum_Tree(capacity)
+        old_add = timing(t, old_tree.add_batch, b, payload)
+        old_sample = timing(t, old_tree.get_batch_parallel, ps)
+        old_update = timing(t, lambda i, p: old_tree._updatetree_batch(i + old_tree.parent_node_count + 1, p), update_idx, update_p)
+
+        tree = Sum_Tree(capacity)
+        new_add = timing(t, tree.add_batch, b)
+        new_sample = timing(t, tree.get_batch_parallel, ps)
+        new_update = timing(t, tree.update, update_idx, update_p)
+
+        print(f'2^{power} | add_batch: {old_add:.4f}s -> {new_add:.4f}s | sample: {old_sample * 1e3:.3f}ms -> {new_sample * 1e3:.3f}ms | update: {old_update * 1e3:.3f}ms -> {new_update * 1e3:.3f}ms')
+
+    # 2^19 | add_batch: 0.1622s -> 0.0340s | sample: 1.958ms -> 0.577ms | update: 1.932ms -> 0.618ms
+    # 2^20 | add_batch: 0.2852s -> 0.0870s | sample: 2.566ms -> 0.635ms | update: 1.992ms -> 0.940ms
+    # 2^21 | add_batch: 0.6809s -> 0.1894s | sample: 1.747ms -> 0.731ms | update: 1.618ms -> 0.836ms
+    # 2^22 | add_batch: 1.2465s -> 0.3445s | sample: 1.964ms -> 0.693ms | update: 2.326ms -> 0.812ms
+    # 2^23 | add_batch: 2.8000s -> 0.7570s | sample: 2.199ms -> 2.003ms | update: 2.570ms -> 2.354ms
@@ -0,0 +1,31 @@
+import sys
+sys.path.append('../..')
+import numpy as np
+
+from rls.memories.replay_buffer import NStepExperienceReplay
+
+GAMMA = 0.9
+
+
+def _step(t, num, done):
+    '''
+    states encode the step t, the trailing field plays the options of OC/IOC.
+    '''
+    s = np.full((num, 2), t, dtype=np.float32)
+    empty = np.zeros((num, 0))
+    return [s, empty, np.full((num, 1), t), np.ones(num)[:, None], s + 1, empty, np.asarray(done, dtype=np.float32)[:, None], np.full((num, 1), 10 + t)]
+
+
+def test_nstep_discount_and_extra_fields():
+    buff = NStepExperienceReplay(batch_size=1, capacity=64, gamma=GAMMA, n=3, agents_num=2)
+    for t in range(5):
+        buff.add(*_step(t, 2, [0, t == 1]))
+    s, visual_s, a, r, s_, visual_s_, done, options, discount = buff.get_all()
+    assert set(np.unique(done)) <= {0., 1.}
+    for i in range(buff.size):
+        first, k = int(s[i, 0]), int(round(np.log(discount[i, 0]) / np.log(GAMMA)))
+        assert a[i, 0] == first and options[i, 0] == 10 + first     # carried from the first step like the action
+        assert s_[i, 0] == first + k    # bootstraps from the state k steps later
+        assert np.isclose(r[i, 0], sum(GAMMA ** j for j in range(k)))
+    # env 1 finished at step 1, so its sequences of 2 and 1 steps are kept with their true discounts
+    assert np.allclose(np.sort(discount[done[:, 0] == 1, 0]), [GAMMA ** 2, GAMMA])
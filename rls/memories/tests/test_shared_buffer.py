@@ -0,0 +1,79 @@
+import sys
+sys.path.append('../..')
+import numpy as np
+import multiprocessing
+import pytest
+
+from multiprocessing import shared_memory
+
+from rls.memories.replay_buffer import \
+    SharedExperienceReplay, \
+    SharedPrioritizedExperienceReplay
+
+METHODS = [m for m in ['fork', 'spawn'] if m in multiprocessing.get_all_start_methods()]
+SPECS = [((1,), np.float64), ((0,), np.float64), ((1,), np.float64), ((1,), np.float64), ((1,), np.float64), ((0,), np.float64), ((1,), np.float64)]
+
+
+def _add(buff, begin, num):
+    ids = np.arange(begin, begin + num, dtype=np.float64)
+    buff.add(ids[:, None], np.zeros((num, 0)), ids[:, None], ids[:, None], ids[:, None] + 1, np.zeros((num, 0)), (ids % 2)[:, None])
+
+
+def _writer(buff, begin, num, step):
+    for i in range(begin, begin + num, step):
+        _add(buff, i, step)
+    buff.close()    # only detaches, the blocks belong to the parent
+
+
+def _crash(buff):
+    _add(buff, 1000, 4)
+    raise RuntimeError('actor crashed')
+
+
+def _run(start_method, target, *args):
+    p = multiprocessing.get_context(start_method).Process(target=target, args=args)
+    p.start()
+    p.join(60)
+    return p.exitcode
+
+
+def _names(buff):
+    return [shm.name for shm in buff._shared._shms + buff._buffer.shared._shms]
+
+
+def test_children_write_parent_samples():
+    for start_method in METHODS:     # spawned children attach to the blocks by name, forked ones inherit them
+        buff = SharedExperienceReplay(16, 64, specs=SPECS, start_method=start_method)
+        assert _run(start_method, _writer, buff, 0, 40, 4) == 0
+        assert _run(start_method, _writer, buff, 40, 40, 8) == 0
+        assert buff.size == 64 and buff.is_full
+        s, _, a, r, s_, _, done = buff.sample()
+        assert len(s) == 16 and (s >= 16).all()    # the first 16 transitions are overwritten
+        assert np.array_equal(a, s) and np.array_equal(s_, s + 1) and np.array_equal(done, s % 2)
+        assert set(buff.get_all()[0][:, 0].tolist()) == set(range(16, 80))
+        buff.close()
+
+
+def test_prioritized_trees_are_shared():
+    buff = SharedPrioritizedExperienceReplay(8, 32, 100, 0.6, 0.4, 0.01, True, specs=SPECS, start_method='spawn')
+    _add(buff, 0, 4)
+    assert _run('spawn', _writer, buff, 4, 12, 4) == 0
+    assert buff.size == 16 and np.isclose(buff.tree.total, 16 * buff.epsilon)
+    data, idxs = buff.sample(return_index=True)
+    assert np.array_equal(data[0][:, 0], idxs)  # slots follow the order of adds across processes
+    buff.update(np.full(len(idxs), 3.), 1)
+    _add(buff, 16, 2)   # new transitions take the largest priority
+    leaves = buff.tree.tree[buff.tree.leaf_offset:buff.tree.leaf_offset + 18]
+    assert np.isclose(buff.tree.total, leaves.sum()) and np.isclose(leaves[16:], leaves.max()).all()
+    buff.close()
+
+
+def test_crashed_child_and_owner_cleanup():
+    buff = SharedExperienceReplay(4, 16, specs=SPECS, start_method='spawn')
+    names = _names(buff)
+    assert _run('spawn', _crash, buff) != 0
+    assert buff.size == 4     # what the child added before crashing stays
+    buff.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
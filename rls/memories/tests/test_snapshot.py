@@ -0,0 +1,57 @@
+import sys
+sys.path.append('../..')
+import os
+import tempfile
+import numpy as np
+
+from rls.memories.snapshot import Snapshot
+from rls.memories.replay_buffer import \
+    ExperienceReplay, \
+    PrioritizedExperienceReplay
+
+
+def _add(buff, begin, num):
+    ids = np.arange(begin, begin + num, dtype=np.float64)
+    buff.add(ids[:, None], np.zeros((num, 0)), ids[:, None], ids, ids[:, None] + 1, np.zeros((num, 0)), ids % 2)
+
+
+def _same(a, b, seed=0):
+    np.random.seed(seed)
+    x = a.sample()
+    np.random.seed(seed)
+    y = b.sample()
+    return all(np.array_equal(i, j) for i, j in zip(x, y))
+
+
+def test_round_trip():
+    for make in [lambda: ExperienceReplay(8, 100, 'object'),
+                 lambda: ExperienceReplay(8, 100, 'columnar'),
+                 lambda: PrioritizedExperienceReplay(8, 100, 1000, 0.6, 0.4, 0.01, False, 'columnar')]:
+        path = tempfile.mkdtemp()
+        buff = make()
+        for t in range(5):
+            _add(buff, t * 30, 30)
+            buff.save(path)
+        restored = make()
+        assert restored.load(path) and restored.size == buff.size
+        assert _same(buff, restored)
+
+
+def test_interrupted_save_keeps_previous_snapshot():
+    path = tempfile.mkdtemp()
+    buff = ExperienceReplay(8, 100, 'columnar')
+    buff._snapshot = Snapshot(path, chunk_rows=16)
+    _add(buff, 0, 60)
+    buff.save(path)
+    saved = ExperienceReplay(8, 100, 'columnar')
+    saved.load(path)
+
+    _add(buff, 60, 20)
+    buff._save(buff._snapshot)  # new chunks are written, but the process dies before commit
+    restored = ExperienceReplay(8, 100, 'columnar')
+    assert restored.load(path) and restored.size == 60
+    assert _same(saved, restored)
+
+    buff.save(path)     # the next save commits and removes files that are no longer referenced
+    files = [f for _, _, fs in os.walk(path) for f in fs if f.endswith('.npy')]
+    assert len(files) == len(buff._snapshot._referenced())
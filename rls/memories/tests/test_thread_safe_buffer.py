@@ -0,0 +1,112 @@
+import sys
+sys.path.append('../..')
+import threading
+import numpy as np
+
+from rls.memories.replay_buffer import \
+    ExperienceReplay, \
+    PrioritizedExperienceReplay, \
+    ThreadSafeWrapper
+
+CAPACITY = 512
+BATCH = 32
+ADDS = 400
+DIM = 8
+
+
+def _transitions(ids):
+    '''
+    every field of a transition encodes the same id, so that a torn row is detected by comparing fields.
+    '''
+    ids = np.asarray(ids, dtype=np.float64)
+    s = np.repeat(ids[:, None], DIM, axis=1)
+    empty = np.zeros((len(ids), 0))
+    return [s, empty, ids[:, None], ids, s + 0.5, empty, ids % 2]
+
+
+def _check_rows(data):
+    s, visual_s, a, r, s_, visual_s_, done = data
+    ids = r
+    assert (s == ids[:, None]).all()
+    assert (a[:, 0] == ids).all()
+    assert (s_ == ids[:, None] + 0.5).all()
+    assert (done == ids % 2).all()
+    return ids
+
+
+def _run(buffer, learn):
+    errors = []
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)     # switch threads as often as possible to provoke races
+
+    def collector():
+        try:
+            for i in range(ADDS):
+                buffer.add(*_transitions(np.arange(i * BATCH, (i + 1) * BATCH)))
+        except Exception as e:
+            errors.append(e)
+
+    def learner():
+        try:
+            while t.is_alive():
+                if buffer.is_lg_batch_size:
+                    learn()
+        except Exception as e:
+            errors.append(e)
+
+    t = threading.Thread(target=collector)
+    l = threading.Thread(target=learner)
+    t.start()
+    l.start()
+    t.join()
+    l.join()
+    sys.setswitchinterval(interval)
+    assert not errors, errors
+
+
+def test_concurrent_er():
+    buffer = ThreadSafeWrapper(ExperienceReplay(BATCH, CAPACITY, storage='columnar'))
+    sampled = []
+
+    def learn():
+        sampled.append(_check_rows(buffer.sample()))
+    _run(buffer, learn)
+    assert len(sampled) > 0
+    assert buffer.size == CAPACITY
+    ids = _check_rows(buffer.get_all())
+    assert np.array_equal(np.sort(ids), np.arange((ADDS * BATCH) - CAPACITY, ADDS * BATCH))
+
+
+def test_concurrent_per():
+    buffer = ThreadSafeWrapper(PrioritizedExperienceReplay(BATCH, CAPACITY, max_train_step=ADDS,
+                                                           alpha=0.6, beta=0.4, epsilon=0.01, global_v=False, storage='columnar'))
+    updated = {}    # slot -> id of the transition whose priority was updated last
+
+    def priority(ids):
+        return ids % 7 + 1.
+
+    def learn():
+        data, idxs = buffer.sample(return_index=True)
+        ids = _check_rows(data)
+        buffer.update(priority(ids), 0, index=idxs)
+        updated.update(zip(idxs.tolist(), ids.tolist()))
+    _run(buffer, learn)
+    assert len(updated) > 0
+
+    # every parent still aggregates its children, no update got lost on the way to the root
+    for tree, op in [(buffer.tree, np.add), (buffer.min_tree, np.minimum), (buffer.max_tree, np.maximum)]:
+        parents = np.arange(1, tree.leaf_offset)
+        assert np.allclose(tree.tree[parents], op(tree.tree[2 * parents], tree.tree[2 * parents + 1]))
+    leaves = buffer.tree.tree[buffer.tree.leaf_offset:buffer.tree.leaf_offset + CAPACITY]
+    assert np.array_equal(leaves, buffer.min_tree.tree[buffer.min_tree.leaf_offset:][:CAPACITY])
+    assert np.array_equal(leaves, buffer.max_tree.tree[buffer.max_tree.leaf_offset:][:CAPACITY])
+
+    # a slot that still holds the transition updated last must keep that priority
+    stored = buffer._buffer.get(np.arange(CAPACITY))[3]
+    checked = 0
+    for slot, id in updated.items():
+        if stored[slot] == id:
+            expected = np.power(priority(id) + buffer.epsilon, buffer.alpha)
+            assert np.isclose(leaves[slot], expected)
+            checked += 1
+    assert checked > 0
@@ -0,0 +1,58 @@
+import sys
+sys.path.append('../..')
+import numpy as np
+
+from rls.memories.replay_buffer import \
+    ExperienceReplay, \
+    TrajectoryExperienceReplay
+
+N, STACK = 4, 3
+
+
+def _fill(buffers, steps=200):
+    '''
+    stacked observations of N envs, finished envs restart from a new observation,
+    except env 0, which restarts from its terminal observation so that only done tells the new episode.
+    '''
+    rng = np.random.default_rng(1)
+    vis = np.zeros((N, 1, 5, 5, STACK), np.uint8)
+    vec = np.zeros((N, 2 * 3), np.float32)
+    for _ in range(steps):
+        vis_ = np.concatenate([vis[..., 1:], rng.integers(0, 255, (N, 1, 5, 5, 1), dtype=np.uint8)], -1)
+        vec_ = np.concatenate([vec[:, 3:], rng.normal(size=(N, 3)).astype(np.float32)], -1)
+        a, r, done = rng.normal(size=(N, 2)), rng.normal(size=N), (rng.random(N) < 0.1).astype(np.float32)
+        for buff in buffers:
+            buff.add(vec, vis, a, r, vec_, vis_, done)
+        vis, vec = vis_.copy(), vec_.copy()
+        for i in np.where(done[1:])[0] + 1:
+            vis[i] = rng.integers(0, 255, (1, 5, 5, 1), dtype=np.uint8)
+            vec[i] = np.tile(rng.normal(size=3), 2)
+
+
+def test_trajectory_matches_experience_replay():
+    buff = TrajectoryExperienceReplay(16, 2000, N, vector_stack=2, visual_stack=STACK)
+    ref = ExperienceReplay(16, 2000, 'columnar')
+    _fill([buff, ref])
+    for seed in range(10):
+        np.random.seed(seed)
+        data = buff.sample()
+        np.random.seed(seed)
+        assert all(np.array_equal(x, y) for x, y in zip(data, ref.sample()))
+        np.random.seed(seed)
+        packed = buff.sample(packed=True)
+        for i, j, shape in buff.packed_pairs:
+            assert packed[j] is None and packed[i].shape[1] == {0: 2, 1: STACK}[i] + 1     # stack + 1 frames
+            assert packed[i].dtype == data[i].dtype
+
+
+def test_whole_observation_is_pushed_after_done():
+    buff = TrajectoryExperienceReplay(16, 100, 1, vector_stack=0, visual_stack=STACK)
+    vis = np.arange(STACK, dtype=np.uint8).reshape(1, 1, 1, 1, STACK)
+    empty = np.zeros((1, 0))
+    written = []
+    for done in [0., 0., 1., 0.]:   # the next observation of the terminal step is also the first one of the new episode
+        vis_ = np.concatenate([vis[..., 1:], vis[..., -1:] + 1], -1)
+        buff.add(empty, vis, np.zeros((1, 1)), np.zeros(1), empty, vis_, np.array([done]))
+        vis = vis_
+        written.append(int(buff._buffer._rings[0].written[0]))
+    assert np.diff(written).tolist() == [1, 1, STACK + 1]
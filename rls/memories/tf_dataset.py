@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import tensorflow as tf
+
+from typing import \
+    Any, \
+    Callable, \
+    Optional, \
+    Union
+
+from rls.memories.replay_buffer import ReplayBuffer
+
+
+def _to_structure(x: Any) -> Any:
+    '''
+    tf.data only accepts tuples and dicts as nested structures, lists returned by replay buffers are turned into tuples.
+    '''
+    if isinstance(x, (list, tuple)):
+        return tuple(_to_structure(i) for i in x)
+    if isinstance(x, dict):
+        return {k: _to_structure(v) for k, v in x.items()}
+    return x
+
+
+def infer_signature(example: Any) -> Any:
+    '''
+    TensorSpec of every array in a sampled batch, the leading batch dimension is left unknown.
+    '''
+    def _spec(x):
+        x = np.asarray(x)
+        shape = (None, *x.shape[1:]) if x.ndim > 0 else ()
+        return tf.TensorSpec(shape=shape, dtype=tf.as_dtype(x.dtype))
+    return tf.nest.map_structure(_spec, example)
+
+
+def make_replay_dataset(source: Union[ReplayBuffer, Callable[[], Any]],
+                        map_func: Optional[Callable] = None,
+                        num_parallel_calls: int = tf.data.AUTOTUNE,
+                        prefetch: int = tf.data.AUTOTUNE) -> tf.data.Dataset:
+    '''
+    expose a replay buffer as an infinite tf.data.Dataset, every element is one sampled batch.
+    inputs:
+        source: anything with a sample() method, i.e. a replay buffer in rls.memories or its thread-safe wrapper,
+            or a function that samples one batch from it,
+            i.e. returns [s, visual_s, a, r, s_, visual_s_, done] or a dict of arrays.
+        map_func: tensor-side processing of every batch, i.e. one-hot and normalization, runs with `num_parallel_calls`
+        prefetch: number of processed batches kept ready, AUTOTUNE by default
+    return:
+        dataset, iterate it to get ready-to-train tensors
+    '''
+    sample = source.sample if hasattr(source, 'sample') else source
+    example = _to_structure(sample())
+    signature = infer_signature(example)
+
+    def generator():
+        yield example
+        while True:
+            yield _to_structure(sample())
+
+    dataset = tf.data.Dataset.from_generator(generator, output_signature=signature)
+    if map_func is not None:
+        dataset = dataset.map(map_func, num_parallel_calls=num_parallel_calls, deterministic=True)
+    return dataset.prefetch(prefetch)
@@ -10,13 +10,22 @@ from typing import \
     Optional
 
 from rls.common.config import Config
-from rls.memories.replay_buffer import ReplayBuffer
+from rls.memories.replay_buffer import \
+    ReplayBuffer, \
+    ThreadSafeWrapper
 
 BufferDict = {
     'ER': 'ExperienceReplay',
     'PER': 'PrioritizedExperienceReplay',
     'NstepER': 'NStepExperienceReplay',
     'NstepPER': 'NStepPrioritizedExperienceReplay',
+    'MemmapER': 'MemmapExperienceReplay',
+    'MemmapPER': 'MemmapPrioritizedExperienceReplay',
+    'MemmapNstepER': 'MemmapNStepExperienceReplay',
+    'MemmapNstepPER': 'MemmapNStepPrioritizedExperienceReplay',
+    'SharedER': 'SharedExperienceReplay',
+    'SharedPER': 'SharedPrioritizedExperienceReplay',
+    'TrajectoryER': 'TrajectoryExperienceReplay',
     'EpisodeER': 'EpisodeExperienceReplay'
 }
 
@@ -40,8 +49,11 @@ def get_buffer(buffer_args: Config) -> Optional[ReplayBuffer]:
     if _buffer_type in BufferDict.keys():
         Buffer = getattr(importlib.import_module(f'rls.memories.replay_buffer'), 
                         BufferDict[_buffer_type])
-        return Buffer(batch_size=buffer_args['batch_size'], 
+        buffer = Buffer(batch_size=buffer_args['batch_size'], 
                     capacity=buffer_args['buffer_size'], 
                     **buffer_args[_buffer_type].to_dict)
+        if buffer_args.get('thread_safe', False):
+            buffer = ThreadSafeWrapper(buffer)
+        return buffer
     else:
         return None
\ No newline at end of file
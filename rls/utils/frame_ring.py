@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from typing import \
+    NoReturn, \
+    Optional, \
+    Tuple, \
+    Union
+
+
+class FrameRing(object):
+    '''
+    Preallocated circular buffers of frames, one per env, [n, capacity, *frame_shape].
+    The k-th frame written by env i lives in slot k % capacity, `written` counts the frames written by every env.
+    With capacity equal to the number of stacked frames it replaces deque + LazyFrames in StackEnv and the batched preprocessor,
+    with a larger capacity it holds the frames of trajectories of rls.memories.storage.TrajectoryStorage.
+    The stacking rings and the replay rings are separate instances: the replay keeps frames long after the env has stacked past them,
+    and the buffer may live apart from the envs (process/ray backends, snapshots), so every kept frame is copied into the replay once.
+    '''
+
+    def __init__(self, n: int, capacity: int, frame_shape: Tuple, dtype=np.float32):
+        self.n = n
+        self.capacity = capacity
+        self.frame_shape = tuple(frame_shape)
+        self.frames = np.zeros((n, capacity, *self.frame_shape), dtype=dtype)
+        self.written = np.zeros(n, dtype=np.int64)
+
+    def _env(self, idxs) -> np.ndarray:
+        return np.arange(self.n) if idxs is None else np.asarray(idxs)
+
+    def push(self, x: np.ndarray, idxs: Optional[Union[list, np.ndarray]] = None) -> NoReturn:
+        '''
+        append one frame per env, x: [len(idxs), *frame_shape], all envs if idxs is None
+        '''
+        if idxs is None and (self.n == 1 or (self.written == self.written[0]).all()):
+            self.frames[:, self.written[0] % self.capacity] = x    # envs stepped together share the slot, no index arrays
+            self.written += 1
+            return
+        env = self._env(idxs)
+        self.frames[env, self.written[env] % self.capacity] = x
+        self.written[env] += 1
+
+    def push_many(self, x: np.ndarray, idxs: Optional[Union[list, np.ndarray]] = None) -> NoReturn:
+        '''
+        append several frames per env, x: [len(idxs), k, *frame_shape], oldest frame first
+        '''
+        env = self._env(idxs)
+        k = x.shape[1]
+        self.frames[env[:, np.newaxis], (self.written[env, np.newaxis] + np.arange(k)) % self.capacity] = x
+        self.written[env] += k
+
+    def fill(self, x: np.ndarray, idxs: Optional[Union[list, np.ndarray]] = None) -> NoReturn:
+        '''
+        overwrite every slot of envs with one frame, i.e. at the beginning of episodes.
+        written is kept, so that envs stepped together keep sharing the same slot.
+        '''
+        env = slice(None) if idxs is None else np.asarray(idxs)
+        self.frames[env] = x[:, np.newaxis]
+
+    def gather(self, env: np.ndarray, seqs: np.ndarray) -> np.ndarray:
+        '''
+        frames by sequence number, env: [B], seqs: [B, k] => [B, k, *frame_shape]
+        '''
+        return self.frames[env[:, np.newaxis], seqs % self.capacity]
+
+    def stacked(self, idxs: Optional[Union[list, np.ndarray]] = None, dtype=None) -> np.ndarray:
+        '''
+        the latest `capacity` frames of envs concatenated along the last axis, oldest first, like StackEnv did.
+        frames are copied once, and cast to dtype if given, straight into a new contiguous array.
+        return:
+            [len(idxs), *frame_shape[:-1], frame_shape[-1] * capacity]
+        '''
+        m = self.n if idxs is None else len(idxs)
+        c = self.frame_shape[-1]
+        out = np.empty((m, *self.frame_shape[:-1], c * self.capacity), dtype=dtype or self.frames.dtype)
+        if idxs is None and (self.n == 1 or (self.written == self.written[0]).all()):
+            for k in range(self.capacity):
+                out[..., k * c:(k + 1) * c] = self.frames[:, (self.written[0] + k) % self.capacity]
+        else:
+            env = self._env(idxs)
+            for k in range(self.capacity):
+                out[..., k * c:(k + 1) * c] = self.frames[env, (self.written[env] + k) % self.capacity]
+        return out
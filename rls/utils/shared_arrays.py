@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import weakref
+import numpy as np
+
+from multiprocessing import shared_memory
+from typing import \
+    Dict, \
+    List, \
+    NoReturn, \
+    Optional
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:    # python >= 3.13, the creator alone is responsible for unlinking
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:   # processes started by multiprocessing share the resource tracker of the creator
+        return shared_memory.SharedMemory(name=name)
+
+
+def _release_shared_memory(shms: List[shared_memory.SharedMemory], owner: bool) -> NoReturn:
+    for shm in shms:
+        shm.close()
+        if owner:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedArrays(object):
+    '''
+    Named numpy arrays placed in multiprocessing.shared_memory blocks. Pickling only transfers names, shapes and dtypes,
+    so that processes that receive this object, i.e. through the arguments of multiprocessing.Process, attach to the same memory.
+    The creating process owns the blocks and unlinks them on close(), when it is garbage collected or at exit.
+    If the owner crashes, the resource tracker of multiprocessing unlinks the leaked blocks.
+    '''
+
+    def __init__(self):
+        self.owner = True
+        self._specs = {}    # key: (shared memory name, shape, dtype)
+        self._shms = []
+        self._arrays = {}
+        self._finalizer = weakref.finalize(self, _release_shared_memory, self._shms, True)
+
+    def create(self, key: str, shape: tuple, dtype: np.dtype, fill: Optional[float] = None) -> np.ndarray:
+        assert self.owner, 'only the creating process could allocate shared arrays'
+        assert key not in self._specs, f'shared array {key} already exists'
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self._shms.append(shm)
+        self._specs[key] = (shm.name, tuple(shape), dtype.str)
+        self._arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        if fill is not None:
+            self._arrays[key].fill(fill)
+        return self._arrays[key]
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self._arrays[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._arrays
+
+    def __getstate__(self) -> Dict:
+        return {'specs': self._specs}
+
+    def __setstate__(self, state: Dict) -> NoReturn:
+        self.owner = False
+        self._specs = state['specs']
+        self._shms = []
+        self._arrays = {}
+        for key, (name, shape, dtype) in self._specs.items():
+            shm = _attach_shared_memory(name)
+            self._shms.append(shm)
+            self._arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        self._finalizer = weakref.finalize(self, _release_shared_memory, self._shms, False)
+
+    def close(self) -> NoReturn:
+        '''
+        detach from all blocks, the owner unlinks them as well. arrays must not be used afterwards.
+        '''
+        self._arrays = {}
+        self._finalizer()
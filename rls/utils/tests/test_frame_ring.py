@@ -0,0 +1,47 @@
+import sys
+sys.path.append('../..')
+import numpy as np
+
+from collections import deque
+
+from rls.utils.frame_ring import FrameRing
+
+
+def _concat(frames):
+    return np.concatenate(list(frames), axis=-1)
+
+
+def test_stacked_matches_deque():
+    n, stack = 3, 4
+    ring = FrameRing(n, stack, (5, 6, 2), np.uint8)
+    first = np.random.randint(0, 256, (n, 5, 6, 2)).astype(np.uint8)
+    ring.fill(first)
+    stacks = [deque([first[i]] * stack, maxlen=stack) for i in range(n)]
+    for t in range(11):
+        x = np.random.randint(0, 256, (n, 5, 6, 2)).astype(np.uint8)
+        if t % 3 == 2:  # only some envs step, or restart their episodes
+            idxs = [0, 2]
+            ring.push(x[idxs], idxs)
+            ring.fill(x[[1]], [1])
+            stacks[1] = deque([x[1]] * stack, maxlen=stack)
+        else:
+            idxs = list(range(n))
+            ring.push(x)
+        for i in idxs:
+            stacks[i].append(x[i])
+        out = ring.stacked()
+        assert out.shape == (n, 5, 6, 2 * stack) and out.flags['C_CONTIGUOUS']
+        assert all(np.array_equal(out[i], _concat(stacks[i])) for i in range(n))
+        assert np.array_equal(ring.stacked([2, 0]), out[[2, 0]])
+    assert np.allclose(ring.stacked(dtype=np.float32), out)
+
+
+def test_vector_frames_and_gather():
+    ring = FrameRing(2, 5, (3,))
+    ring.push_many(np.arange(2 * 4 * 3, dtype=np.float32).reshape(2, 4, 3))
+    ring.push(np.full((2, 3), -1, dtype=np.float32))
+    assert (ring.written == 5).all()
+    assert ring.stacked().shape == (2, 15)
+    x = ring.gather(np.array([1]), np.array([[3, 4, 5]]))
+    assert np.array_equal(x[0, 0], [21, 22, 23]) and (x[0, 1] == -1).all()
+    assert np.array_equal(x[0, 2], [12, 13, 14])    # sequence 5 is not written yet, its slot still holds sequence 0
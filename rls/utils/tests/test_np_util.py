@@ -16,3 +16,51 @@ def test_all_equal():
 
 
 test_all_equal()
+
+
+def _list_discounted_sum(x, gamma, init_value, dones):
+    y = []
+    for _x, _d in zip(x[::-1], dones[::-1]):
+        init_value = gamma * (1 - _d) * init_value + _x
+        y.append(init_value)
+    return y[::-1]
+
+
+def _list_discounted_sum_minus(x, gamma, init_value, dones, z):
+    y = []
+    for _x, _d, _z in zip(x[::-1], dones[::-1], z[::-1]):
+        y.append(gamma * (1 - _d) * init_value + _x - _z)
+        init_value = _z
+    return y[::-1]
+
+
+def test_discounted_sum():
+    for T, n_agents in [(1, 1), (2, 3), (17, 4), (100, 1), (2000, 64)]:
+        x = np.random.randn(T, n_agents)
+        dones = (np.random.rand(T, n_agents) < 0.1).astype(np.float32)
+        init_value = np.random.randn(n_agents)
+        y = discounted_sum(x, 0.99, init_value, dones)
+        assert isinstance(y, np.ndarray)
+        assert np.allclose(y, _list_discounted_sum(x, 0.99, init_value, dones))
+        assert np.allclose(discounted_sum(x, 0.9, 0., dones), _list_discounted_sum(x, 0.9, 0., dones))
+    x = [np.random.randn(3) for _ in range(5)]  # lists of per-step arrays are accepted as well
+    dones = [np.zeros(3) for _ in range(5)]
+    assert np.allclose(discounted_sum(x, 0.9, 1., dones), _list_discounted_sum(x, 0.9, 1., dones))
+    assert len(discounted_sum([], 0.9, 1., [])) == 0
+
+
+def test_discounted_sum_minus():
+    for T, n_agents in [(1, 1), (2, 3), (17, 4), (2000, 64)]:
+        x = np.random.randn(T, n_agents)
+        z = np.random.randn(T, n_agents)
+        dones = (np.random.rand(T, n_agents) < 0.1).astype(np.float32)
+        init_value = np.random.randn(n_agents)
+        y = discounted_sum_minus(x, 0.99, init_value, dones, z)
+        assert isinstance(y, np.ndarray)
+        assert np.allclose(y, _list_discounted_sum_minus(x, 0.99, init_value, dones, z))
+    # a single agent, values are squeezed to scalars while rewards keep the agent axis
+    x = np.random.randn(20, 1)
+    z = np.random.randn(20)
+    dones = np.zeros((20, 1))
+    assert np.allclose(discounted_sum_minus(x, 0.99, 0.5, dones, z), _list_discounted_sum_minus(x, 0.99, 0.5, dones, z))
+    assert np.allclose(discounted_sum(z, 0.99, 0.5, dones), _list_discounted_sum(z, 0.99, 0.5, dones))
@@ -0,0 +1,25 @@
+import sys
+sys.path.append('../..')
+import numpy as np
+import tensorflow as tf
+
+from rls.utils.np_utils import \
+    discounted_sum, \
+    discounted_sum_minus
+from rls.utils.tf2_utils import \
+    tf_discounted_sum, \
+    tf_discounted_sum_minus
+
+
+def test_tf_discounted_sum():
+    x = np.random.randn(50, 8)
+    z = np.random.randn(50, 8)
+    dones = (np.random.rand(50, 8) < 0.1).astype(np.float32)
+    init_value = np.random.randn(8)
+    assert np.allclose(tf_discounted_sum(x, 0.99, init_value, dones).numpy(), discounted_sum(x, 0.99, init_value, dones), atol=1e-5)
+    assert np.allclose(tf_discounted_sum_minus(x, 0.99, init_value, dones, z).numpy(), discounted_sum_minus(x, 0.99, init_value, dones, z), atol=1e-5)
+
+    @tf.function
+    def gae(td_error, dones):
+        return tf_discounted_sum(td_error, 0.95 * 0.99, 0., dones)
+    assert np.allclose(gae(tf.constant(x, tf.float32), tf.constant(dones)).numpy(), discounted_sum(x, 0.95 * 0.99, 0., dones), atol=1e-4)
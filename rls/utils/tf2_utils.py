@@ -219,3 +219,26 @@ def update_target_net_weights(tge: List[tf.Tensor], src: List[tf.Tensor], ployak
         tf.group([t.assign(s) for t, s in zip(tge, src)])
     else:
         tf.group([t.assign(ployak * t + (1 - ployak) * s) for t, s in zip(tge, src)])
+
+
+def tf_discounted_sum(x, gamma, init_value, dones):
+    '''
+    tf.scan version of rls.utils.np_utils.discounted_sum, usable inside tf.function.
+    y_t = x_t + gamma * (1 - done_t) * y_{t+1}, y_T = init_value
+    x, dones: [T, ...]
+    '''
+    x = tf.convert_to_tensor(x)
+    discount = gamma * (1. - tf.cast(dones, x.dtype))
+    init_value = tf.broadcast_to(tf.cast(init_value, x.dtype), tf.shape(x)[1:])
+    return tf.scan(lambda y, elems: elems[0] + elems[1] * y, (x, discount), initializer=init_value, reverse=True)
+
+
+def tf_discounted_sum_minus(x, gamma, init_value, dones, z):
+    '''
+    version of rls.utils.np_utils.discounted_sum_minus for tensors.
+    y_t = x_t + gamma * (1 - done_t) * z_{t+1} - z_t, z_T = init_value
+    '''
+    x = tf.convert_to_tensor(x)
+    z = tf.cast(z, x.dtype)
+    z_ = tf.concat([z[1:], tf.broadcast_to(tf.cast(init_value, x.dtype), tf.shape(z)[1:])[tf.newaxis]], axis=0)
+    return gamma * (1. - tf.cast(dones, x.dtype)) * z_ + x - z